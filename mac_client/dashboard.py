@@ -5,7 +5,7 @@ Run this on your Mac to get a visual web interface for monitoring.
 """
 import requests
 from fastapi import FastAPI, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 from typing import Optional
@@ -68,24 +68,48 @@ async def api_devices():
     return JSONResponse(_agent_get("/devices"))
 
 @app.get("/api/alerts")
-async def api_alerts(hours: int = 24):
-    return JSONResponse(_agent_get("/alerts", {"hours": hours}))
+async def api_alerts(hours: int = 24, cursor: Optional[str] = None):
+    return JSONResponse(_agent_get("/alerts", {"hours": hours, "cursor": cursor}))
 
 @app.get("/api/alerts/device/{ip}")
-async def api_alerts_device(ip: str, hours: int = 24):
-    return JSONResponse(_agent_get(f"/alerts/device/{ip}", {"hours": hours}))
+async def api_alerts_device(ip: str, hours: int = 24, cursor: Optional[str] = None):
+    return JSONResponse(_agent_get(f"/alerts/device/{ip}", {"hours": hours, "cursor": cursor}))
 
 @app.get("/api/dns/list")
-async def api_dns_list(limit: int = 100, offset: int = 0):
-    return JSONResponse(_agent_get("/dns/list", {"limit": limit, "offset": offset}))
+async def api_dns_list(limit: int = 100, offset: int = 0, before_id: Optional[str] = None):
+    return JSONResponse(_agent_get("/dns/list", {"limit": limit, "offset": offset, "before_id": before_id}))
+
+@app.get("/api/dns/stream")
+def api_dns_stream(request: Request, ip: Optional[str] = None, severity: Optional[str] = None,
+                   category: Optional[str] = None, since_id: Optional[int] = None):
+    """Relay the agent's live event stream; EventSource reconnects resume via Last-Event-ID."""
+    params = {k: v for k, v in {"ip": ip, "severity": severity, "category": category,
+                                "since_id": since_id}.items() if v is not None}
+    headers = {"X-Auth-Token": AUTH_TOKEN}
+    if request.headers.get("last-event-id"):
+        headers["Last-Event-ID"] = request.headers["last-event-id"]
+
+    def relay():
+        try:
+            with requests.get(f"{AGENT_URL}/dns/stream", headers=headers, params=params,
+                              stream=True, timeout=(10, 60)) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=None):
+                    yield chunk
+        except Exception:
+            # Ending the response makes the browser reconnect on its own
+            return
+
+    return StreamingResponse(relay(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
 @app.get("/api/dns/search")
-async def api_dns_search(term: str, limit: int = 200):
-    return JSONResponse(_agent_get("/dns/search", {"term": term, "limit": limit}))
+async def api_dns_search(term: str, limit: int = 200, before_id: Optional[str] = None):
+    return JSONResponse(_agent_get("/dns/search", {"term": term, "limit": limit, "before_id": before_id}))
 
 @app.get("/api/dns/device/{ip}")
-async def api_dns_device(ip: str, limit: int = 200):
-    return JSONResponse(_agent_get(f"/dns/device/{ip}", {"limit": limit}))
+async def api_dns_device(ip: str, limit: int = 200, before_id: Optional[str] = None):
+    return JSONResponse(_agent_get(f"/dns/device/{ip}", {"limit": limit, "before_id": before_id}))
 
 @app.get("/api/dns/domains")
 async def api_dns_domains(ip: Optional[str] = None, days: int = 7, limit: int = 200):
@@ -290,7 +314,7 @@ DASHBOARD_HTML = """<!DOCTYPE html>
 </main>
 
 <script>
-let liveInterval=null, liveLastId=0, knownDevices=[], currentDeviceIp=null, devLiveInterval=null, devLiveLastId=0, currentDevSection='domains';
+let liveSource=null, knownDevices=[], currentDeviceIp=null, devLiveSource=null, currentDevSection='domains';
 
 // ── Severity check ────────────────────────────────────────
 const HIGH_KW=['porn','xxx','nsfw','hentai','onlyfans','fap','nude','casino','gambling','betting','sexo'];
@@ -299,6 +323,14 @@ const MED_KW=['vpn','unblock','proxy-','hookup','dating'];
 const MED_DOM=['tinder.com','bumble.com','omegle.com','nordvpn.com','expressvpn.com','torproject.org','protonvpn.com'];
 function sev(d){d=d.toLowerCase();for(const k of HIGH_KW)if(d.includes(k))return'high';for(const x of HIGH_DOM)if(d===x||d.endsWith('.'+x))return'high';for(const k of MED_KW)if(d.includes(k))return'medium';for(const x of MED_DOM)if(d===x||d.endsWith('.'+x))return'medium';return null}
 function sevBadge(s){if(s==='high')return'<span class="px-2 py-0.5 rounded bg-red-500/20 text-red-400 text-xs font-bold">HIGH</span>';if(s==='medium')return'<span class="px-2 py-0.5 rounded bg-yellow-500/20 text-yellow-400 text-xs font-semibold">MEDIUM</span>';return''}
+function pageArg(cursor){return cursor?`&before_id=${encodeURIComponent(cursor)}`:''}
+function alertPageArg(cursor){return cursor?`&cursor=${encodeURIComponent(cursor)}`:''}
+// Append a page of rows to an already rendered table and move its "Load more" link along
+function appendPage(containerId,rows,next,loader){
+  const c=document.getElementById(containerId);c.querySelector('tbody').insertAdjacentHTML('beforeend',rows);
+  const more=c.querySelector('.load-more');if(more)more.remove();c.insertAdjacentHTML('beforeend',moreLink(next,loader));
+}
+function moreLink(next,loader){return next?`<div class="load-more p-3 text-center"><button onclick="${loader}('${next}')" class="text-sm text-accent hover:text-white">Load more</button></div>`:''}
 function escHtml(s){return s.replace(/&/g,'&amp;').replace(/</g,'&lt;').replace(/>/g,'&gt;')}
 
 // ── Tab switching ─────────────────────────────────────────
@@ -312,7 +344,7 @@ function switchTab(name){
   if(name==='devices')loadDevices();
   if(name==='dns')loadDNS();
   // Stop device live feed if leaving device tab
-  if(name!=='device'&&devLiveInterval){clearInterval(devLiveInterval);devLiveInterval=null}
+  if(name!=='device'&&devLiveSource){devLiveSource.close();devLiveSource=null}
 }
 
 // ── API helpers ───────────────────────────────────────────
@@ -355,19 +387,21 @@ async function loadOverview(){
 }
 
 // ── Alerts ────────────────────────────────────────────────
-async function loadAlerts(){
+async function loadAlerts(cursor){
   const h=document.getElementById('alert-hours').value,dv=document.getElementById('alert-device').value;
-  const p=dv?`/alerts/device/${dv}?hours=${h}`:`/alerts?hours=${h}`;
+  const p=(dv?`/alerts/device/${dv}?hours=${h}`:`/alerts?hours=${h}`)+alertPageArg(cursor);
   const data=await api(p);
   if(data.error){document.getElementById('alerts-list').innerHTML=`<p class="p-4 text-red-400">${data.error}</p>`;return}
-  if(!data.alerts||!data.alerts.length){document.getElementById('alerts-list').innerHTML='<p class="p-6 text-green-400 text-center">No alerts found</p>';return}
-  let html=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
-    <th class="px-4 py-3 text-left">Severity</th><th class="px-4 py-3 text-left">Category</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Device</th><th class="px-4 py-3 text-left">Time</th></tr></thead><tbody>`;
-  data.alerts.forEach(a=>{const sc=a.severity==='high'?'severity-high':'severity-medium';const ts=(a.timestamp||'').replace('T',' ').slice(0,19);
-    html+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50 cursor-pointer" onclick="openDevice('${a.source_ip}')">
+  if(!cursor&&(!data.alerts||!data.alerts.length)){document.getElementById('alerts-list').innerHTML='<p class="p-6 text-green-400 text-center">No alerts found</p>';return}
+  let rows='';
+  (data.alerts||[]).forEach(a=>{const sc=a.severity==='high'?'severity-high':'severity-medium';const ts=(a.timestamp||'').replace('T',' ').slice(0,19);
+    rows+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50 cursor-pointer" onclick="openDevice('${a.source_ip}')">
       <td class="px-4 py-2.5 ${sc} uppercase text-xs">${a.severity}</td><td class="px-4 py-2.5 text-slate-300">${a.label}</td>
       <td class="px-4 py-2.5 text-cyan-400">${a.domain}</td><td class="px-4 py-2.5 text-accent">${a.source_ip}</td><td class="px-4 py-2.5 text-slate-500">${ts}</td></tr>`});
-  html+='</tbody></table>';document.getElementById('alerts-list').innerHTML=html;
+  if(cursor){appendPage('alerts-list',rows,data.next_cursor,'loadAlerts');return}
+  document.getElementById('alerts-list').innerHTML=`<div class="px-4 py-2 bg-slate-800 text-sm text-slate-400">${data.count.toLocaleString()} alerts</div>
+    <table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
+    <th class="px-4 py-3 text-left">Severity</th><th class="px-4 py-3 text-left">Category</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Device</th><th class="px-4 py-3 text-left">Time</th></tr></thead><tbody>${rows}</tbody></table>`+moreLink(data.next_cursor,'loadAlerts');
 }
 
 // ── Devices Grid ──────────────────────────────────────────
@@ -472,7 +506,7 @@ function devSection(name){
   else if(name==='devlive')startDevLive();
 
   // Stop dev live if switching away
-  if(name!=='devlive'&&devLiveInterval){clearInterval(devLiveInterval);devLiveInterval=null}
+  if(name!=='devlive'&&devLiveSource){devLiveSource.close();devLiveSource=null}
 }
 
 async function loadDevDomains(){
@@ -500,22 +534,23 @@ async function loadDevDomains(){
   html+='</tbody></table>';c.innerHTML=html;
 }
 
-async function loadDevQueries(){
+async function loadDevQueries(cursor){
   const c=document.getElementById('dev-content');
-  c.innerHTML='<p class="p-6 text-cyan-400 text-center pulse">Loading queries...</p>';
-  const data=await api(`/dns/device/${currentDeviceIp}?limit=200`);
+  if(!cursor)c.innerHTML='<p class="p-6 text-cyan-400 text-center pulse">Loading queries...</p>';
+  const data=await api(`/dns/device/${currentDeviceIp}?limit=200${pageArg(cursor)}`);
   if(data.error){c.innerHTML=`<p class="p-4 text-red-400">${data.error}</p>`;return}
-  if(!data.queries?.length){c.innerHTML='<p class="p-6 text-slate-400 text-center">No queries yet</p>';return}
-  let html=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
-    <th class="px-4 py-3 text-left">Time</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Type</th><th class="px-4 py-3 text-left">Flag</th></tr></thead><tbody>`;
+  if(!cursor&&!data.queries?.length){c.innerHTML='<p class="p-6 text-slate-400 text-center">No queries yet</p>';return}
+  let rows='';
   data.queries.forEach(q=>{
     const ts=(q.timestamp||'').replace('T',' ').slice(0,19);
     const s=sev(q.domain);const badge=s?sevBadge(s):'';
     const cls=s==='high'?'text-red-400 font-semibold':s==='medium'?'text-yellow-400':'text-cyan-400';
-    html+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50">
+    rows+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50">
       <td class="px-4 py-2 text-slate-500 text-xs">${ts}</td><td class="px-4 py-2 ${cls}">${q.domain}</td>
       <td class="px-4 py-2 text-slate-500 text-xs">${q.query_type||'A'}</td><td class="px-4 py-2">${badge}</td></tr>`});
-  html+='</tbody></table>';c.innerHTML=html;
+  if(cursor){appendPage('dev-content',rows,data.next_cursor,'loadDevQueries');return}
+  c.innerHTML=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
+    <th class="px-4 py-3 text-left">Time</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Type</th><th class="px-4 py-3 text-left">Flag</th></tr></thead><tbody>${rows}</tbody></table>`+moreLink(data.next_cursor,'loadDevQueries');
 }
 
 async function loadDevTimeline(){
@@ -552,83 +587,63 @@ async function loadDevTimeline(){
   c.innerHTML=html;
 }
 
-async function loadDevAlerts(){
+async function loadDevAlerts(cursor){
   const c=document.getElementById('dev-content');
-  const data=window._devAlerts||await api(`/alerts/device/${currentDeviceIp}?hours=720`);
-  if(!data.alerts?.length){c.innerHTML='<p class="p-6 text-green-400 text-center">No alerts for this device</p>';return}
-  let html=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
-    <th class="px-4 py-3 text-left">Severity</th><th class="px-4 py-3 text-left">Category</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Time</th></tr></thead><tbody>`;
-  data.alerts.forEach(a=>{const ts=(a.timestamp||'').replace('T',' ').slice(0,19);
-    html+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50">
+  const data=(!cursor&&window._devAlerts)||await api(`/alerts/device/${currentDeviceIp}?hours=720`+alertPageArg(cursor));
+  if(!cursor&&!data.alerts?.length){c.innerHTML='<p class="p-6 text-green-400 text-center">No alerts for this device</p>';return}
+  let rows='';
+  (data.alerts||[]).forEach(a=>{const ts=(a.timestamp||'').replace('T',' ').slice(0,19);
+    rows+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50">
       <td class="px-4 py-2.5">${sevBadge(a.severity)}</td><td class="px-4 py-2.5 text-slate-300">${a.label}</td>
       <td class="px-4 py-2.5 text-cyan-400">${a.domain}</td><td class="px-4 py-2.5 text-slate-500">${ts}</td></tr>`});
-  html+='</tbody></table>';c.innerHTML=html;
+  if(cursor){appendPage('dev-content',rows,data.next_cursor,'loadDevAlerts');return}
+  c.innerHTML=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
+    <th class="px-4 py-3 text-left">Severity</th><th class="px-4 py-3 text-left">Category</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Time</th></tr></thead><tbody>${rows}</tbody></table>`+moreLink(data.next_cursor,'loadDevAlerts');
 }
 
 function startDevLive(){
   const c=document.getElementById('dev-content');
-  devLiveLastId=0;
   c.innerHTML=`<div class="p-4"><div class="flex items-center gap-2 mb-3"><span class="dot live-on"></span><span class="text-white font-semibold text-sm">Live feed for ${currentDeviceIp}</span></div>
     <div id="dev-live-entries" class="space-y-1 max-h-[400px] overflow-auto font-mono text-xs"></div></div>`;
-  if(devLiveInterval)clearInterval(devLiveInterval);
-  devLiveInterval=setInterval(pollDevLive,2000);
-  pollDevLive();
-}
-
-async function pollDevLive(){
-  const data=await api(`/dns/device/${currentDeviceIp}?limit=20`);
-  if(data.error||!data.queries)return;
-  const container=document.getElementById('dev-live-entries');
-  if(!container)return;
-  data.queries.reverse().forEach(q=>{
-    if(q.id<=devLiveLastId)return;
-    devLiveLastId=q.id;
-    const ts=(q.timestamp||'').replace('T',' ').slice(11,19);
-    const s=sev(q.domain);
-    let cls='text-cyan-400',flag='';
-    if(s==='high'){cls='text-red-400 font-bold';flag=' *** FLAGGED ***'}
-    else if(s==='medium'){cls='text-yellow-400';flag=' * flagged *'}
-    const entry=document.createElement('div');
-    entry.innerHTML=`<span class="text-slate-500">${ts}</span> <span class="${cls}">${q.domain}${flag}</span>`;
-    container.appendChild(entry);
-    while(container.children.length>200)container.removeChild(container.firstChild);
-  });
-  container.scrollTop=container.scrollHeight;
+  if(devLiveSource)devLiveSource.close();
+  devLiveSource=openStream(`ip=${encodeURIComponent(currentDeviceIp)}`,'dev-live-entries',false);
 }
 
 // ── DNS Queries ───────────────────────────────────────────
-async function loadDNS(){
+async function loadDNS(cursor){
   const dv=document.getElementById('dns-device-filter').value,lim=document.getElementById('dns-limit').value;
-  const p=dv?`/dns/device/${dv}?limit=${lim}`:`/dns/list?limit=${lim}`;
+  const p=(dv?`/dns/device/${dv}?limit=${lim}`:`/dns/list?limit=${lim}`)+pageArg(cursor);
   const data=await api(p);
   if(data.error){document.getElementById('dns-list').innerHTML=`<p class="p-4 text-red-400">${data.error}</p>`;return}
   const queries=data.queries||[];
-  if(!queries.length){document.getElementById('dns-list').innerHTML='<p class="p-6 text-slate-400 text-center">No DNS queries recorded yet</p>';return}
-  let html=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
-    <th class="px-4 py-3 text-left">Time</th><th class="px-4 py-3 text-left">Device</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Type</th></tr></thead><tbody>`;
+  if(!cursor&&!queries.length){document.getElementById('dns-list').innerHTML='<p class="p-6 text-slate-400 text-center">No DNS queries recorded yet</p>';return}
+  let rows='';
   queries.forEach(q=>{const ts=(q.timestamp||'').replace('T',' ').slice(0,19);
-    html+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50 cursor-pointer" onclick="openDevice('${q.source_ip}')">
+    rows+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50 cursor-pointer" onclick="openDevice('${q.source_ip}')">
       <td class="px-4 py-2 text-slate-500 text-xs">${ts}</td><td class="px-4 py-2 text-accent">${q.source_ip}</td>
       <td class="px-4 py-2 text-cyan-400">${q.domain}</td><td class="px-4 py-2 text-slate-500 text-xs">${q.query_type||'A'}</td></tr>`});
-  html+='</tbody></table>';document.getElementById('dns-list').innerHTML=html;
+  if(cursor){appendPage('dns-list',rows,data.next_cursor,'loadDNS');return}
+  document.getElementById('dns-list').innerHTML=`<table class="w-full text-sm"><thead><tr class="bg-slate-800 text-slate-400 text-xs uppercase">
+    <th class="px-4 py-3 text-left">Time</th><th class="px-4 py-3 text-left">Device</th><th class="px-4 py-3 text-left">Domain</th><th class="px-4 py-3 text-left">Type</th></tr></thead><tbody>${rows}</tbody></table>`+moreLink(data.next_cursor,'loadDNS');
 }
 
 // ── Search ────────────────────────────────────────────────
-async function doSearch(){
+async function doSearch(cursor){
   const term=document.getElementById('search-input').value.trim();if(!term)return;
-  document.getElementById('search-results').innerHTML='<p class="p-6 text-cyan-400 text-center pulse">Searching...</p>';
-  const data=await api(`/dns/search?term=${encodeURIComponent(term)}&limit=200`);
+  if(!cursor)document.getElementById('search-results').innerHTML='<p class="p-6 text-cyan-400 text-center pulse">Searching...</p>';
+  const data=await api(`/dns/search?term=${encodeURIComponent(term)}&limit=200${pageArg(cursor)}`);
   if(data.error){document.getElementById('search-results').innerHTML=`<p class="p-4 text-red-400">${data.error}</p>`;return}
-  if(!data.queries?.length){document.getElementById('search-results').innerHTML=`<p class="p-6 text-slate-400 text-center">No results for "${term}"</p>`;return}
-  let html=`<div class="px-4 py-2 bg-slate-800 text-sm text-slate-400">${data.count} results for "${term}"</div>
-    <table class="w-full text-sm"><thead><tr class="bg-slate-800/50 text-slate-400 text-xs uppercase">
-    <th class="px-4 py-2 text-left">Time</th><th class="px-4 py-2 text-left">Device</th><th class="px-4 py-2 text-left">Domain</th><th class="px-4 py-2 text-left">Type</th></tr></thead><tbody>`;
+  if(!cursor&&!data.queries?.length){document.getElementById('search-results').innerHTML=`<p class="p-6 text-slate-400 text-center">No results for "${term}"</p>`;return}
+  let rows='';
   data.queries.forEach(q=>{const ts=(q.timestamp||'').replace('T',' ').slice(0,19);
     const hl=q.domain.replace(new RegExp(`(${term.replace(/[.*+?^${}()|[\\]\\\\]/g,'\\\\$&')})`,'gi'),'<span class="bg-yellow-500/30 text-yellow-300">$1</span>');
-    html+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50 cursor-pointer" onclick="openDevice('${q.source_ip}')">
+    rows+=`<tr class="border-b border-slate-700 hover:bg-slate-800/50 cursor-pointer" onclick="openDevice('${q.source_ip}')">
       <td class="px-4 py-2 text-slate-500 text-xs">${ts}</td><td class="px-4 py-2 text-accent">${q.source_ip}</td>
       <td class="px-4 py-2 text-cyan-400">${hl}</td><td class="px-4 py-2 text-slate-500 text-xs">${q.query_type||'A'}</td></tr>`});
-  html+='</tbody></table>';document.getElementById('search-results').innerHTML=html;
+  if(cursor){appendPage('search-results',rows,data.next_cursor,'doSearch');return}
+  document.getElementById('search-results').innerHTML=`<div class="px-4 py-2 bg-slate-800 text-sm text-slate-400">Results for "${term}"</div>
+    <table class="w-full text-sm"><thead><tr class="bg-slate-800/50 text-slate-400 text-xs uppercase">
+    <th class="px-4 py-2 text-left">Time</th><th class="px-4 py-2 text-left">Device</th><th class="px-4 py-2 text-left">Domain</th><th class="px-4 py-2 text-left">Type</th></tr></thead><tbody>${rows}</tbody></table>`+moreLink(data.next_cursor,'doSearch');
 }
 
 // ── Terminal ──────────────────────────────────────────────
@@ -645,25 +660,29 @@ async function runCommand(){
 
 // ── Global Live Feed ──────────────────────────────────────
 function toggleLive(){
-  if(liveInterval){clearInterval(liveInterval);liveInterval=null;
+  if(liveSource){liveSource.close();liveSource=null;
     document.getElementById('live-feed').classList.add('hidden');document.getElementById('live-dot').className='dot live-off';document.getElementById('live-btn').textContent='Start Live';
   }else{document.getElementById('live-feed').classList.remove('hidden');document.getElementById('live-dot').className='dot live-on';document.getElementById('live-btn').textContent='Stop Live';
-    liveInterval=setInterval(pollLive,2000);pollLive()}
+    liveSource=openStream('','live-entries',true)}
 }
-async function pollLive(){
-  const data=await api('/dns/list?limit=20');if(data.error||!data.queries)return;
-  const container=document.getElementById('live-entries');
-  data.queries.reverse().forEach(q=>{
-    if(q.id<=liveLastId)return;liveLastId=q.id;
-    const ts=(q.timestamp||'').replace('T',' ').slice(11,19);const s=sev(q.domain);
+
+// Push feed from the agent; the browser reconnects and resumes by event id on its own
+function openStream(params,containerId,showIp){
+  const source=new EventSource('/api/dns/stream'+(params?'?'+params:''));
+  source.onmessage=ev=>{
+    const container=document.getElementById(containerId);if(!container)return;
+    const q=JSON.parse(ev.data);
+    const ts=(q.timestamp||'').replace('T',' ').slice(11,19);const s=q.severity;
     let cls='text-cyan-400',flag='';
     if(s==='high'){cls='text-red-400 font-bold';flag=' *** FLAGGED ***'}
     else if(s==='medium'){cls='text-yellow-400';flag=' * flagged *'}
     const entry=document.createElement('div');
-    entry.innerHTML=`<span class="text-slate-500">${ts}</span> <span class="text-white">${q.source_ip}</span> <span class="${cls}">${q.domain}${flag}</span>`;
+    entry.innerHTML=`<span class="text-slate-500">${ts}</span> `+(showIp?`<span class="text-white">${q.source_ip}</span> `:'')+`<span class="${cls}">${escHtml(q.domain)}${flag}</span>`;
     container.appendChild(entry);
     while(container.children.length>200)container.removeChild(container.firstChild);
-  });container.scrollTop=container.scrollHeight;
+    container.scrollTop=container.scrollHeight;
+  };
+  return source;
 }
 
 async function refreshAll(){await loadOverview();const d=await api('/devices');if(!d.error){knownDevices=d.devices||[];populateDeviceDropdowns()}}
@@ -10,13 +10,14 @@ Usage:
     python remote.py devices
     python remote.py alerts [--hours N]
     python remote.py alerts device <ip> [--hours N]
-    python remote.py dns list [--limit N]
-    python remote.py dns search <term> [--from DATE] [--to DATE]
-    python remote.py dns device <ip> [--from DATE] [--to DATE]
+    python remote.py dns list [--limit N] [--cursor C | --all]
+    python remote.py dns search <term> [--from DATE] [--to DATE] [--cursor C | --all]
+    python remote.py dns device <ip> [--from DATE] [--to DATE] [--cursor C | --all]
     python remote.py dns domains [--ip IP] [--days N]
     python remote.py dns report <ip> [--days N]
     python remote.py dns timeline <ip> [--days N]
-    python remote.py dns live
+    python remote.py dns live [--ip IP] [--severity LEVEL] [--category CAT]
+    python remote.py dns export [--format ndjson|csv] [--compress gzip|zstd] [--from DATE] [--to DATE] [-o FILE]
 """
 import argparse
 import json
@@ -102,8 +103,41 @@ def cmd_status():
         f"  Total queries: {data['dns_stats']['total_queries']}\n"
         f"  Queries today: {data['dns_stats']['queries_today']}\n"
         f"  Unique devices: {data['dns_stats']['unique_devices']}\n"
-        f"\n[bold cyan]Components:[/bold cyan]\n"
     )
+    proxy = data.get("dns_proxy")
+    if proxy and proxy.get("cache"):
+        cache = proxy["cache"]
+        panel_text += (
+            f"\n[bold cyan]DNS Cache ({proxy['engine']}):[/bold cyan]\n"
+            f"  Entries: {cache['entries']} ({cache['bytes'] // 1024} KB)\n"
+            f"  Hits / misses: {cache['hits']} / {cache['misses']} ({cache['hit_ratio']:.0%})\n"
+        )
+    limits = proxy.get("rate_limit") if proxy else None
+    if limits and limits["clients"]:
+        panel_text += (
+            f"\n[bold cyan]Rate Limiting:[/bold cyan]\n"
+            f"  Limited clients: {len(limits['clients'])}\n"
+            f"  Refused / dropped: {limits['refused']} / {limits['dropped']}\n"
+        )
+    writer = data.get("log_writer")
+    if writer:
+        panel_text += (
+            f"\n[bold cyan]Log Writer:[/bold cyan]\n"
+            f"  Queue: {writer['queue_depth']} / {writer['queue_max']}\n"
+            f"  Batch: {writer['avg_batch_size']} rows, {writer['avg_flush_ms']} ms avg flush\n"
+        )
+        lost = writer["dropped"] + writer["failed"]
+        if lost:
+            panel_text += f"  [red]Lost rows: {lost}[/red]\n"
+    pool = data.get("db_pool")
+    if pool:
+        busy = "[red]saturated[/red]" if pool["saturated"] else "ok"
+        panel_text += (
+            f"\n[bold cyan]DB Read Pool:[/bold cyan]\n"
+            f"  Workers: {pool['active']} / {pool['workers']} busy, {pool['queued']} queued ({busy})\n"
+            f"  Timeouts: {pool['timeouts']}\n"
+        )
+    panel_text += "\n[bold cyan]Components:[/bold cyan]\n"
     for comp, running in data["components"].items():
         status_icon = "[green]ON[/green]" if running else "[dim]OFF[/dim]"
         panel_text += f"  {comp}: {status_icon}\n"
@@ -158,11 +192,14 @@ def cmd_devices():
     table.add_column("Vendor")
     table.add_column("First Seen")
     table.add_column("Last Seen")
+    table.add_column("Rate Limited", justify="right")
 
     for d in data["devices"]:
+        limited = d.get("rate_limited", 0)
         table.add_row(
             d["ip"], d["mac"], d.get("hostname", ""), d.get("vendor", ""),
             d.get("first_seen", ""), d.get("last_seen", ""),
+            f"[red]{limited}[/red]" if limited else "",
         )
 
     console.print(table)
@@ -186,10 +223,24 @@ def _print_dns_table(queries, title="DNS Queries"):
     console.print(table)
 
 
+def _show_dns_pages(path: str, params: dict, args, title):
+    """Print a page of queries from --cursor on, or every page with --all."""
+    if args.cursor:
+        params["before_id"] = args.cursor
+    while True:
+        data = _get(path, params)
+        _print_dns_table(data["queries"], title(data))
+        if not (args.all and data.get("next_cursor")):
+            break
+        params["before_id"] = data["next_cursor"]
+    if not args.all:
+        _print_next_page(data)
+
+
 def cmd_dns_list(args):
     """Show recent DNS queries."""
-    data = _get("/dns/list", {"limit": args.limit})
-    _print_dns_table(data["queries"], f"Recent DNS Queries ({data['count']})")
+    _show_dns_pages("/dns/list", {"limit": args.limit}, args,
+                    lambda data: f"Recent DNS Queries ({data['count']})")
 
 
 def cmd_dns_search(args):
@@ -200,8 +251,8 @@ def cmd_dns_search(args):
     if args.to_date:
         params["to"] = args.to_date
 
-    data = _get("/dns/search", params)
-    _print_dns_table(data["queries"], f"DNS Search: '{args.term}' ({data['count']} results)")
+    _show_dns_pages("/dns/search", params, args,
+                    lambda data: f"DNS Search: '{args.term}' ({data['count']} results)")
 
 
 def cmd_dns_device(args):
@@ -212,8 +263,8 @@ def cmd_dns_device(args):
     if args.to_date:
         params["to"] = args.to_date
 
-    data = _get(f"/dns/device/{args.ip}", params)
-    _print_dns_table(data["queries"], f"DNS Queries from {args.ip} ({data['count']})")
+    _show_dns_pages(f"/dns/device/{args.ip}", params, args,
+                    lambda data: f"DNS Queries from {args.ip} ({data['count']})")
 
 
 def cmd_dns_report(args):
@@ -257,6 +308,8 @@ def cmd_dns_domains(args):
     params = {"days": args.days, "limit": args.limit}
     if args.ip:
         params["ip"] = args.ip
+    if args.category:
+        params["category"] = args.category
 
     data = _get("/dns/domains", params)
 
@@ -313,9 +366,57 @@ def cmd_dns_timeline(args):
     console.print(table)
 
 
+def cmd_dns_export(args):
+    """Download the DNS log as NDJSON or CSV, writing to disk as it streams."""
+    params = {"format": args.format}
+    for key, value in (("compress", args.compress), ("from", args.from_date), ("to", args.to_date),
+                       ("ip", args.ip), ("category", args.category)):
+        if value:
+            params[key] = value
+    suffix = {"gzip": ".gz", "zstd": ".zst"}.get(args.compress, "")
+    output = args.output or f"dns-export.{args.format}{suffix}"
+
+    start = time.time()
+    written = 0
+    try:
+        with requests.get(f"{AGENT_URL}/dns/export", headers=_headers(), params=params,
+                          stream=True, timeout=(10, 300)) as r:
+            if r.status_code in (401, 403):
+                console.print("[red]Authentication failed. Check your AUTH_TOKEN.[/red]")
+                sys.exit(1)
+            if r.status_code == 400:
+                console.print(f"[red]{r.json().get('detail', 'Bad request')}[/red]")
+                sys.exit(1)
+            r.raise_for_status()
+            with open(output, "wb") as f, console.status(f"Exporting to {output}...") as status:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    written += len(chunk)
+                    status.update(f"Exporting to {output}... {written / 1e6:.1f} MB")
+    except requests.ConnectionError:
+        console.print(f"[red]Cannot connect to agent at {AGENT_URL}[/red]")
+        sys.exit(1)
+    except requests.RequestException as e:
+        console.print(f"[red]Export failed after {written / 1e6:.1f} MB: {e}[/red]")
+        sys.exit(1)
+
+    console.print(f"[green]Wrote {written / 1e6:.1f} MB to {output} in {time.time() - start:.1f}s[/green]")
+
+
+def _print_next_page(data):
+    """Tell the user how to fetch the next page, if there is one."""
+    if data.get("next_cursor"):
+        console.print(f"[dim]More results: add --cursor {data['next_cursor']}[/dim]")
+
+
 def cmd_alerts(args):
     """Show flagged domains (adult, VPN, dating, gambling, etc.)."""
-    data = _get("/alerts", {"hours": args.hours})
+    params = {"hours": args.hours, "limit": args.limit}
+    if args.category:
+        params["category"] = args.category
+    if args.cursor:
+        params["cursor"] = args.cursor
+    data = _get("/alerts", params)
 
     if data["count"] == 0:
         console.print(f"[green]No alerts in the last {args.hours} hours.[/green]")
@@ -326,6 +427,7 @@ def cmd_alerts(args):
     table.add_column("Category")
     table.add_column("Domain", style="cyan")
     table.add_column("Device IP", style="bold")
+    table.add_column("Hits", justify="right")
     table.add_column("Time", style="dim")
 
     for a in data["alerts"]:
@@ -338,14 +440,20 @@ def cmd_alerts(args):
             sev_display = sev
 
         ts = a.get("timestamp", "").replace("T", " ")[:19]
-        table.add_row(sev_display, a["label"], a["domain"], a["source_ip"], ts)
+        table.add_row(sev_display, a["label"], a["domain"], a["source_ip"], str(a.get("hits", "")), ts)
 
     console.print(table)
+    _print_next_page(data)
 
 
 def cmd_alerts_device(args):
     """Show flagged domains for a specific device."""
-    data = _get(f"/alerts/device/{args.ip}", {"hours": args.hours})
+    params = {"hours": args.hours, "limit": args.limit}
+    if args.category:
+        params["category"] = args.category
+    if args.cursor:
+        params["cursor"] = args.cursor
+    data = _get(f"/alerts/device/{args.ip}", params)
 
     if data["count"] == 0:
         console.print(f"[green]No alerts for {args.ip} in the last {args.hours} hours.[/green]")
@@ -355,6 +463,7 @@ def cmd_alerts_device(args):
     table.add_column("Severity", style="bold")
     table.add_column("Category")
     table.add_column("Domain", style="cyan")
+    table.add_column("Hits", justify="right")
     table.add_column("Time", style="dim")
 
     for a in data["alerts"]:
@@ -367,72 +476,63 @@ def cmd_alerts_device(args):
             sev_display = sev
 
         ts = a.get("timestamp", "").replace("T", " ")[:19]
-        table.add_row(sev_display, a["label"], a["domain"], ts)
+        table.add_row(sev_display, a["label"], a["domain"], str(a.get("hits", "")), ts)
 
     console.print(table)
+    _print_next_page(data)
+
+
+def _stream_events(params: dict):
+    """Yield (id, event) pairs from the agent's server-sent event stream."""
+    with requests.get(f"{AGENT_URL}/dns/stream", headers=_headers(), params=params,
+                      stream=True, timeout=(10, 60)) as r:
+        if r.status_code in (401, 403):
+            console.print("[red]Authentication failed. Check your AUTH_TOKEN.[/red]")
+            sys.exit(1)
+        if r.status_code == 400:
+            console.print(f"[red]{r.json().get('detail', 'Bad request')}[/red]")
+            sys.exit(1)
+        r.raise_for_status()
+        event_id = None
+        for line in r.iter_lines(decode_unicode=True):
+            if line.startswith("id:"):
+                event_id = int(line[3:].strip())
+            elif line.startswith("data:") and event_id is not None:
+                yield event_id, json.loads(line[5:])
+                event_id = None
 
 
 def cmd_dns_live(args):
-    """Live tail of DNS queries (polls every 2 seconds)."""
+    """Live tail of DNS queries, pushed by the agent as they are logged."""
     console.print("[cyan]Live DNS monitoring (Ctrl+C to stop)...[/cyan]\n")
-    seen_ids = set()
-    last_id = 0
-
-    # Inline severity check for live coloring
-    HIGH_KEYWORDS = ["porn", "xxx", "nsfw", "hentai", "onlyfans", "fap", "nude", "sexo",
-                     "casino", "gambling", "betting", "slots", "self-harm", "suicide"]
-    HIGH_DOMAINS = ["pornhub.com", "xvideos.com", "xnxx.com", "xhamster.com", "redtube.com",
-                    "onlyfans.com", "chaturbate.com", "stripchat.com", "draftkings.com",
-                    "fanduel.com", "stake.com", "bet365.com"]
-    MED_KEYWORDS = ["vpn", "unblock", "proxy-", "hookup", "dating"]
-    MED_DOMAINS = ["tinder.com", "bumble.com", "grindr.com", "omegle.com", "nordvpn.com",
-                   "expressvpn.com", "surfshark.com", "protonvpn.com", "torproject.org"]
-
-    def _live_severity(domain):
-        d = domain.lower()
-        for kw in HIGH_KEYWORDS:
-            if kw in d:
-                return "high"
-        for dd in HIGH_DOMAINS:
-            if d == dd or d.endswith("." + dd):
-                return "high"
-        for kw in MED_KEYWORDS:
-            if kw in d:
-                return "medium"
-        for dd in MED_DOMAINS:
-            if d == dd or d.endswith("." + dd):
-                return "medium"
-        return None
+    params = {k: v for k, v in {"ip": args.ip, "severity": args.severity,
+                                "category": args.category}.items() if v}
+    last_id = None
 
     try:
         while True:
-            data = _get("/dns/list", {"limit": 20})
-            new_queries = []
-
-            for q in reversed(data["queries"]):
-                qid = q.get("id", 0)
-                if qid > last_id:
-                    new_queries.append(q)
-                    last_id = qid
-
-            for q in new_queries:
-                ts = q.get("timestamp", "").replace("T", " ")[:19]
-                domain = q["domain"]
-                src = q["source_ip"]
-                qtype = q.get("query_type", "A")
-
-                flag = _live_severity(domain)
-                if flag == "high":
-                    domain_display = f"[red bold]{domain} *** FLAGGED ***[/red bold]"
-                elif flag == "medium":
-                    domain_display = f"[yellow]{domain} * flagged *[/yellow]"
-                else:
-                    domain_display = f"[cyan]{domain}[/cyan]"
-
-                console.print(f"[dim]{ts}[/dim]  [bold]{src}[/bold]  {domain_display}  [dim]{qtype}[/dim]")
-
-            time.sleep(2)
-
+            # Resume after the last event shown, so reconnects never drop or repeat queries
+            if last_id is not None:
+                params["since_id"] = last_id
+            try:
+                for last_id, q in _stream_events(params):
+                    ts = q.get("timestamp", "").replace("T", " ")[:19]
+                    domain = q["domain"]
+                    src = q["source_ip"]
+                    qtype = q.get("query_type", "A")
+
+                    flag = q.get("severity")
+                    if flag == "high":
+                        domain_display = f"[red bold]{domain} *** FLAGGED ***[/red bold]"
+                    elif flag == "medium":
+                        domain_display = f"[yellow]{domain} * flagged *[/yellow]"
+                    else:
+                        domain_display = f"[cyan]{domain}[/cyan]"
+
+                    console.print(f"[dim]{ts}[/dim]  [bold]{src}[/bold]  {domain_display}  [dim]{qtype}[/dim]")
+            except requests.RequestException as e:
+                console.print(f"[dim]Stream interrupted ({e.__class__.__name__}); reconnecting...[/dim]")
+                time.sleep(2)
     except KeyboardInterrupt:
         console.print("\n[yellow]Live monitoring stopped.[/yellow]")
 
@@ -468,6 +568,8 @@ def build_parser():
     # dns list
     p_dns_list = dns_sub.add_parser("list", help="Show recent DNS queries")
     p_dns_list.add_argument("--limit", type=int, default=100)
+    p_dns_list.add_argument("--cursor", help="Continue from a previous page")
+    p_dns_list.add_argument("--all", action="store_true", help="Follow every page to the end")
 
     # dns search
     p_dns_search = dns_sub.add_parser("search", help="Search DNS queries by keyword")
@@ -475,6 +577,8 @@ def build_parser():
     p_dns_search.add_argument("--limit", type=int, default=200)
     p_dns_search.add_argument("--from", dest="from_date", help="Start date (YYYY-MM-DD)")
     p_dns_search.add_argument("--to", dest="to_date", help="End date (YYYY-MM-DD)")
+    p_dns_search.add_argument("--cursor", help="Continue from a previous page")
+    p_dns_search.add_argument("--all", action="store_true", help="Follow every page to the end")
 
     # dns device
     p_dns_dev = dns_sub.add_parser("device", help="Show queries from a device")
@@ -482,6 +586,8 @@ def build_parser():
     p_dns_dev.add_argument("--limit", type=int, default=200)
     p_dns_dev.add_argument("--from", dest="from_date", help="Start date (YYYY-MM-DD)")
     p_dns_dev.add_argument("--to", dest="to_date", help="End date (YYYY-MM-DD)")
+    p_dns_dev.add_argument("--cursor", help="Continue from a previous page")
+    p_dns_dev.add_argument("--all", action="store_true", help="Follow every page to the end")
 
     # dns report
     p_dns_report = dns_sub.add_parser("report", help="Generate device browsing report")
@@ -493,14 +599,29 @@ def build_parser():
     p_dns_domains.add_argument("--ip", help="Filter by device IP")
     p_dns_domains.add_argument("--days", type=int, default=7)
     p_dns_domains.add_argument("--limit", type=int, default=200)
+    p_dns_domains.add_argument("--category", help="Only this category (e.g. adult)")
 
     # dns timeline
     p_dns_tl = dns_sub.add_parser("timeline", help="Show hourly activity for a device")
     p_dns_tl.add_argument("ip", help="Device IP address")
     p_dns_tl.add_argument("--days", type=int, default=7)
 
+    # dns export
+    p_dns_export = dns_sub.add_parser("export", help="Download the DNS log (NDJSON or CSV)")
+    p_dns_export.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    p_dns_export.add_argument("--compress", choices=["gzip", "zstd"])
+    p_dns_export.add_argument("--from", dest="from_date", help="Start date (YYYY-MM-DD)")
+    p_dns_export.add_argument("--to", dest="to_date", help="End date (YYYY-MM-DD)")
+    p_dns_export.add_argument("--ip", help="Only this device IP")
+    p_dns_export.add_argument("--category", help="Only this category (e.g. adult)")
+    p_dns_export.add_argument("-o", "--output", help="Output file (default dns-export.<format>[.gz|.zst])")
+
     # dns live
-    dns_sub.add_parser("live", help="Live tail of DNS queries")
+    p_dns_live = dns_sub.add_parser("live", help="Live tail of DNS queries")
+    p_dns_live.add_argument("--ip", help="Only this device IP")
+    p_dns_live.add_argument("--severity", choices=["low", "medium", "high"],
+                            help="Only queries at or above this severity")
+    p_dns_live.add_argument("--category", help="Only this category (e.g. adult)")
 
     # alerts
     p_alerts = sub.add_parser("alerts", help="Show flagged domains (adult, VPN, etc.)")
@@ -508,11 +629,17 @@ def build_parser():
 
     # alerts (default — all devices)
     p_alerts.add_argument("--hours", type=int, default=24)
+    p_alerts.add_argument("--category", help="Only this category (e.g. adult)")
+    p_alerts.add_argument("--limit", type=int, default=100)
+    p_alerts.add_argument("--cursor", help="Continue from a previous page")
 
     # alerts device <ip>
     p_alerts_dev = p_alerts_sub.add_parser("device", help="Show alerts for a specific device")
     p_alerts_dev.add_argument("ip", help="Device IP address")
     p_alerts_dev.add_argument("--hours", type=int, default=24)
+    p_alerts_dev.add_argument("--category", help="Only this category (e.g. adult)")
+    p_alerts_dev.add_argument("--limit", type=int, default=100)
+    p_alerts_dev.add_argument("--cursor", help="Continue from a previous page")
 
     return parser
 
@@ -546,7 +673,7 @@ def main():
             cmd_alerts(args)
     elif args.command == "dns":
         if not args.dns_command:
-            console.print("[yellow]Usage: remote.py dns {list|search|device|domains|report|timeline|live}[/yellow]")
+            console.print("[yellow]Usage: remote.py dns {list|search|device|domains|report|timeline|live|export}[/yellow]")
             return
         if args.dns_command == "list":
             cmd_dns_list(args)
@@ -562,6 +689,8 @@ def main():
             cmd_dns_timeline(args)
         elif args.dns_command == "live":
             cmd_dns_live(args)
+        elif args.dns_command == "export":
+            cmd_dns_export(args)
     else:
         parser.print_help()
 
@@ -8,29 +8,38 @@ import signal
 import socket
 import sys
 import os
+import json
+import threading
+import csv
+import io
+import zlib
 from contextlib import asynccontextmanager
 from typing import Optional
 
-from fastapi import FastAPI, Depends, Query, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, Query, HTTPException, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
 from config import (
     CAPTURE_MODE, API_HOST, API_PORT, LOG_LEVEL,
-    GATEWAY_IP, NETWORK_CIDR, INTERFACE,
+    GATEWAY_IP, NETWORK_CIDR, INTERFACE, DNS_PROXY_ENGINE, DNS_PROXY_WORKERS, CATEGORY_LISTS,
 )
 from auth import verify_token
 from db import (
-    init_db, get_recent_queries, search_queries, get_queries_by_device,
+    init_db, start_log_writer, stop_log_writer, get_log_writer_stats,
+    start_read_pool, stop_read_pool, read_query, get_read_pool_stats, QueryTimeout, InvalidDate, InvalidCursor,
+    start_partition_maintenance, stop_partition_maintenance,
+    get_recent_queries, search_queries, get_queries_by_device,
     get_device_report, get_query_stats, get_all_devices,
-    get_unique_domains, get_all_queries_for_alerts, get_activity_timeline,
+    get_unique_domains, get_recent_alerts, get_activity_timeline, recategorize,
+    get_queries_since, get_last_query_id, SEVERITY_LEVELS, export_queries, EXPORT_FIELDS,
 )
+from live_feed import feed as live_feed, LAGGED
 from network_scanner import scan_network, get_known_devices
 from command_executor import execute_command
-from domain_categories import (
-    categorize_domain, categorize_batch, get_alerts_from_queries, CATEGORIES,
-)
+from domain_categories import get_categorizer
+from blocklists import reload_category_lists, get_category_list_stats
 
 # ── Logging setup ───────────────────────────────────────────
 logging.basicConfig(
@@ -65,10 +74,23 @@ def start_capture():
     """Start the selected DNS capture mode."""
     global dns_proxy_server, arp_spoofer, dns_sniffer
 
+    start_log_writer()
+
     if CAPTURE_MODE == "proxy":
-        logger.info("=== Starting Mode A: DNS Proxy ===")
-        from dns_proxy import DNSProxyServer
-        dns_proxy_server = DNSProxyServer()
+        engine = f"{DNS_PROXY_WORKERS} asyncio workers" if DNS_PROXY_WORKERS > 1 else DNS_PROXY_ENGINE
+        logger.info(f"=== Starting Mode A: DNS Proxy ({engine}) ===")
+        if DNS_PROXY_WORKERS > 1:
+            from proxy_workers import ProxyWorkerPool
+            dns_proxy_server = ProxyWorkerPool()
+        elif DNS_PROXY_ENGINE == "asyncio":
+            from dns_proxy import AsyncDNSProxyServer
+            dns_proxy_server = AsyncDNSProxyServer()
+        elif DNS_PROXY_ENGINE == "threaded":
+            from dns_proxy import DNSProxyServer
+            dns_proxy_server = DNSProxyServer()
+        else:
+            logger.error(f"Unknown DNS_PROXY_ENGINE: {DNS_PROXY_ENGINE}. Use 'threaded' or 'asyncio'.")
+            sys.exit(1)
         dns_proxy_server.start()
 
     elif CAPTURE_MODE == "arp":
@@ -102,6 +124,15 @@ def stop_capture():
         dns_sniffer.stop()
     if arp_spoofer:
         arp_spoofer.stop()
+    # Last, so every query captured above reaches the database
+    stop_log_writer()
+
+
+def refresh_categories() -> dict:
+    """Load the external category lists, then re-tag logged history to match."""
+    result = reload_category_lists() if CATEGORY_LISTS else {}
+    result["recategorized_domains"] = recategorize()
+    return result
 
 
 # ── FastAPI app ─────────────────────────────────────────────
@@ -109,11 +140,17 @@ def stop_capture():
 async def lifespan(app: FastAPI):
     """Startup and shutdown lifecycle."""
     init_db()
+    start_read_pool()
     start_capture()
+    start_partition_maintenance()
+    # Large lists take a few seconds; categorize with built-ins until then
+    threading.Thread(target=refresh_categories, name="category-lists", daemon=True).start()
     logger.info(f"Agent ready on {API_HOST}:{API_PORT}")
     yield
     logger.info("Shutting down...")
+    stop_partition_maintenance()
     stop_capture()
+    stop_read_pool()
 
 
 app = FastAPI(
@@ -123,6 +160,24 @@ app = FastAPI(
 )
 
 
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request, exc: QueryTimeout):
+    """Report a cancelled database scan as a gateway timeout."""
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(InvalidDate)
+async def invalid_date_handler(request, exc: InvalidDate):
+    """Reject malformed from/to filters."""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request, exc: InvalidCursor):
+    """Reject page cursors that were not issued by this agent."""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
 # ── Request / Response models ───────────────────────────────
 class ExecRequest(BaseModel):
     command: str
@@ -135,6 +190,7 @@ class ExecRequest(BaseModel):
 @app.get("/status", dependencies=[Depends(verify_token)])
 async def status():
     """Health check and basic stats."""
+    # In-memory counters: no database read, so no read-pool slot
     stats = get_query_stats()
     return {
         "status": "running",
@@ -144,6 +200,11 @@ async def status():
         "network": NETWORK_CIDR,
         "interface": INTERFACE,
         "dns_stats": stats,
+        "dns_proxy": dns_proxy_server.stats() if dns_proxy_server else None,
+        "log_writer": get_log_writer_stats(),
+        "db_pool": get_read_pool_stats(),
+        "live_stream": live_feed.stats(),
+        "category_lists": get_category_list_stats(),
         "components": {
             "dns_proxy": dns_proxy_server.is_running if dns_proxy_server else False,
             "arp_spoofer": arp_spoofer.is_running if arp_spoofer else False,
@@ -156,10 +217,157 @@ async def status():
 async def dns_list(
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
+    before_id: Optional[str] = Query(None, description="next_cursor from a previous page (older rows)"),
+    after_id: Optional[str] = Query(None, description="prev_cursor from a previous page (newer rows)"),
 ):
     """Get recent DNS queries."""
-    queries = get_recent_queries(limit=limit, offset=offset)
-    return {"count": len(queries), "queries": queries}
+    page = await read_query(get_recent_queries, limit=limit, offset=offset,
+                            before_id=before_id, after_id=after_id)
+    return {"count": len(page["queries"]), **page}
+
+
+# Replay page size and idle keep-alive for /dns/stream
+STREAM_REPLAY_BATCH = 500
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def _sse(event: dict) -> str:
+    return f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.get("/dns/stream", dependencies=[Depends(verify_token)])
+async def dns_stream(
+    ip: Optional[str] = Query(None, description="Only this device"),
+    severity: Optional[str] = Query(None, description="Minimum severity: low, medium or high"),
+    category: Optional[str] = Query(None, description="Only this category"),
+    since_id: Optional[int] = Query(None, ge=0, description="Replay queries after this id first"),
+    last_event_id: Optional[int] = Header(None, ge=0),
+):
+    """
+    Server-Sent Events stream of DNS queries as they are committed.
+    Each event's SSE id is the query id; reconnect with since_id (or the
+    standard Last-Event-ID header) to replay the gap from the database.
+    """
+    if severity is not None and severity not in SEVERITY_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Unknown severity: {severity}")
+    min_level = SEVERITY_LEVELS.get(severity, 0)
+    if since_id is None:
+        since_id = last_event_id
+
+    def matches(event: dict) -> bool:
+        return ((not ip or event["source_ip"] == ip)
+                and SEVERITY_LEVELS.get(event["severity"], 0) >= min_level
+                and (not category or event["category"] == category))
+
+    async def events():
+        # Subscribe before reading the backlog so nothing falls in between;
+        # overlap is skipped by id.
+        sub = live_feed.subscribe(matches)
+        try:
+            last_id = since_id if since_id is not None else await read_query(get_last_query_id)
+            replay = True
+            while True:
+                while replay:
+                    batch = await read_query(
+                        get_queries_since, last_id, STREAM_REPLAY_BATCH,
+                        ip=ip, min_severity=min_level, category=category,
+                    )
+                    for event in batch:
+                        yield _sse(event)
+                        last_id = event["id"]
+                    replay = len(batch) == STREAM_REPLAY_BATCH
+
+                item = await sub.get(STREAM_KEEPALIVE_SECONDS)
+                if item is None:
+                    yield ": keep-alive\n\n"
+                elif item is LAGGED:
+                    replay = True
+                elif item["id"] > last_id:
+                    yield _sse(item)
+                    last_id = item["id"]
+        finally:
+            live_feed.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Rows read (and encoded) per step of /dns/export
+EXPORT_BATCH = 5000
+
+_EXPORT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+_COMPRESSED_TYPES = {"gzip": ("application/gzip", ".gz"), "zstd": ("application/zstd", ".zst")}
+
+
+def _export_compressor(compress: Optional[str]):
+    """A compressobj-style encoder (compress/flush), or None for plain output."""
+    if compress == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compress == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise HTTPException(status_code=400, detail="zstd export needs the zstandard package on the agent")
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+
+def _encode_rows(rows: list, fmt: str, header: bool) -> bytes:
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue().encode()
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+@app.get("/dns/export", dependencies=[Depends(verify_token)])
+async def dns_export(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    compress: Optional[str] = Query(None, pattern="^(gzip|zstd)$"),
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    ip: Optional[str] = Query(None, description="Only this device"),
+    category: Optional[str] = Query(None, description="Only this category"),
+):
+    """
+    Stream the DNS log as NDJSON or CSV, oldest first, optionally gzip or
+    zstd compressed. Rows are read, encoded and sent a batch at a time, so
+    memory stays flat however much is exported.
+    """
+    compressor = _export_compressor(compress)
+    filters = dict(from_date=from_date, to_date=to_date, ip=ip, category=category)
+    # First batch up front, so a bad filter is still a plain 400
+    first = await read_query(export_queries, None, EXPORT_BATCH, **filters)
+
+    async def body():
+        batch, header = first, True
+        while True:
+            chunk = _encode_rows(batch["queries"], fmt, header)
+            header = False
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+            if batch["after"] is None:
+                break
+            batch = await read_query(export_queries, batch["after"], EXPORT_BATCH, **filters)
+        if compressor:
+            yield compressor.flush()
+
+    media_type = _EXPORT_TYPES[fmt]
+    filename = f"dns-export.{fmt}"
+    if compress:
+        media_type, suffix = _COMPRESSED_TYPES[compress]
+        filename += suffix
+    return StreamingResponse(
+        body(), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @app.get("/dns/search", dependencies=[Depends(verify_token)])
@@ -168,10 +376,13 @@ async def dns_search(
     limit: int = Query(200, ge=1, le=1000),
     from_date: Optional[str] = Query(None, alias="from"),
     to_date: Optional[str] = Query(None, alias="to"),
+    before_id: Optional[str] = Query(None, description="next_cursor from a previous page (older rows)"),
+    after_id: Optional[str] = Query(None, description="prev_cursor from a previous page (newer rows)"),
 ):
     """Search DNS queries by domain keyword."""
-    queries = search_queries(term=term, limit=limit, from_date=from_date, to_date=to_date)
-    return {"term": term, "count": len(queries), "queries": queries}
+    page = await read_query(search_queries, term=term, limit=limit, from_date=from_date, to_date=to_date,
+                            before_id=before_id, after_id=after_id)
+    return {"term": term, "count": len(page["queries"]), **page}
 
 
 @app.get("/dns/device/{ip}", dependencies=[Depends(verify_token)])
@@ -180,10 +391,13 @@ async def dns_device(
     limit: int = Query(200, ge=1, le=1000),
     from_date: Optional[str] = Query(None, alias="from"),
     to_date: Optional[str] = Query(None, alias="to"),
+    before_id: Optional[str] = Query(None, description="next_cursor from a previous page (older rows)"),
+    after_id: Optional[str] = Query(None, description="prev_cursor from a previous page (newer rows)"),
 ):
     """Get DNS queries from a specific device."""
-    queries = get_queries_by_device(ip=ip, limit=limit, from_date=from_date, to_date=to_date)
-    return {"ip": ip, "count": len(queries), "queries": queries}
+    page = await read_query(get_queries_by_device, ip=ip, limit=limit, from_date=from_date, to_date=to_date,
+                            before_id=before_id, after_id=after_id)
+    return {"ip": ip, "count": len(page["queries"]), **page}
 
 
 @app.get("/dns/report/{ip}", dependencies=[Depends(verify_token)])
@@ -192,7 +406,7 @@ async def dns_report(
     days: int = Query(30, ge=1, le=365),
 ):
     """Generate a browsing report for a device."""
-    report = get_device_report(ip=ip, days=days)
+    report = await read_query(get_device_report, ip=ip, days=days)
     return report
 
 
@@ -205,8 +419,14 @@ async def network_scan():
 
 @app.get("/devices", dependencies=[Depends(verify_token)])
 async def list_devices():
-    """List all previously discovered devices."""
-    devices = get_known_devices()
+    """List all previously discovered devices, with how often the DNS proxy has rate-limited each."""
+    devices = await read_query(get_known_devices)
+    proxy = dns_proxy_server.stats() if dns_proxy_server else None
+    limited = ((proxy or {}).get("rate_limit") or {}).get("clients", {})
+    for device in devices:
+        events = limited.get(device["ip"])
+        device["rate_limited"] = events["rate_limited"] + events["queue_full"] if events else 0
+        device["last_limited"] = events["last_limited"] if events else None
     return {"count": len(devices), "devices": devices}
 
 
@@ -224,23 +444,26 @@ async def exec_command(req: ExecRequest):
 @app.get("/alerts", dependencies=[Depends(verify_token)])
 async def get_alerts(
     hours: int = Query(24, ge=1, le=720),
+    category: Optional[str] = Query(None, description="Only this category"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
 ):
     """Get flagged domains from the last N hours (adult, VPN, dating, etc.)."""
-    queries = get_all_queries_for_alerts(hours=hours)
-    alerts = get_alerts_from_queries(queries)
-    return {"hours": hours, "count": len(alerts), "alerts": alerts}
+    page = await read_query(get_recent_alerts, hours=hours, category=category, limit=limit, cursor=cursor)
+    return {"hours": hours, **page}
 
 
 @app.get("/alerts/device/{ip}", dependencies=[Depends(verify_token)])
 async def get_device_alerts(
     ip: str,
     hours: int = Query(24, ge=1, le=720),
+    category: Optional[str] = Query(None, description="Only this category"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
 ):
     """Get flagged domains for a specific device."""
-    queries = get_all_queries_for_alerts(hours=hours)
-    device_queries = [q for q in queries if q.get("source_ip") == ip]
-    alerts = get_alerts_from_queries(device_queries)
-    return {"ip": ip, "hours": hours, "count": len(alerts), "alerts": alerts}
+    page = await read_query(get_recent_alerts, hours=hours, ip=ip, category=category, limit=limit, cursor=cursor)
+    return {"ip": ip, "hours": hours, **page}
 
 
 @app.get("/dns/domains", dependencies=[Depends(verify_token)])
@@ -248,15 +471,10 @@ async def dns_domains(
     ip: Optional[str] = Query(None),
     days: int = Query(7, ge=1, le=365),
     limit: int = Query(200, ge=1, le=1000),
+    category: Optional[str] = Query(None, description="Only this category"),
 ):
     """Get unique domains with visit counts and auto-categorization."""
-    domains = get_unique_domains(ip=ip, days=days, limit=limit)
-    # Add category info to each domain
-    for d in domains:
-        cat = categorize_domain(d["domain"])
-        d["category"] = cat["category"] if cat else None
-        d["category_label"] = cat["label"] if cat else None
-        d["severity"] = cat["severity"] if cat else None
+    domains = await read_query(get_unique_domains, ip=ip, days=days, limit=limit, category=category)
     return {"count": len(domains), "domains": domains}
 
 
@@ -266,7 +484,7 @@ async def dns_timeline(
     days: int = Query(7, ge=1, le=90),
 ):
     """Get hourly activity timeline for a device."""
-    timeline = get_activity_timeline(ip=ip, days=days)
+    timeline = await read_query(get_activity_timeline, ip=ip, days=days)
     return {"ip": ip, "days": days, "timeline": timeline}
 
 
@@ -274,16 +492,29 @@ async def dns_timeline(
 async def list_categories():
     """List all domain categories and their known domains."""
     result = {}
-    for cat_id, cat in CATEGORIES.items():
+    for cat_id, cat in get_categorizer().categories.items():
         result[cat_id] = {
             "label": cat["label"],
             "severity": cat["severity"],
             "domain_count": len(cat["domains"]),
             "keyword_count": len(cat["keywords"]),
         }
+    lists = get_category_list_stats()
+    for source in lists.get("sources", []):
+        if source["category"] in result:
+            result[source["category"]]["domain_count"] += source["domains"]
     return result
 
 
+@app.post("/categories/reload", dependencies=[Depends(verify_token)])
+async def reload_categories():
+    """Re-read the external category lists, swap in the new matcher and re-tag history."""
+    try:
+        return await asyncio.to_thread(refresh_categories)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/spoof/refresh", dependencies=[Depends(verify_token)])
 async def refresh_spoof_targets():
     """Re-scan network and update ARP spoof targets (Mode B only)."""
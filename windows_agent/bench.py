@@ -0,0 +1,709 @@
+"""
+Windows Remote Network Monitor — Micro-benchmarks.
+Self-contained: nothing here touches the database or leaves localhost.
+
+Usage:
+    python bench.py categorize
+    python bench.py categorize --rules 10000 1000000 --lookups 200000
+    python bench.py blocklist --domains 3000000
+    python bench.py segment --rows 2000000
+    python bench.py wire --packets 20000
+    python bench.py upstream --stubs 300/0 5/0.3 dead
+    python bench.py workers --workers 1 2 4 --clients 4
+    python bench.py prefetch --budgets 0 20 100
+    python bench.py limits --qps 0 50
+"""
+import argparse
+import logging
+import multiprocessing
+import random
+import os
+import select
+import socket
+import sqlite3
+import string
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from config import LOG_LEVEL
+from domain_categories import Categorizer
+from blocklists import load_domain_list
+from segment import Segment, write_segment
+from dns_wire import parse_query, edns_state, scan_answer, readdress
+from upstream_pool import UpstreamPool
+from dns_cache import DNSCache
+from dns_proxy import AsyncDNSProxyServer, set_query_sink
+from client_limits import ClientLimiter, FairSlots
+from proxy_workers import ProxyWorkerPool, reuse_port_available
+from dnslib import DNSRecord, DNSQuestion, EDNS0, RR, A, CNAME, SOA, QTYPE
+import db
+
+logging.basicConfig(
+    level=getattr(logging, LOG_LEVEL),
+    format="%(asctime)s [%(name)s] %(levelname)s: %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+logger = logging.getLogger("bench")
+
+_TLDS = ["com", "net", "org", "io", "co", "tv", "app", "xxx"]
+
+
+def _label(rnd, lo=4, hi=12):
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(lo, hi)))
+
+
+def _synthetic_categories(rules, rnd, categories=8, keyword_share=0.001):
+    """Split `rules` random rules over a few categories, mostly domains."""
+    keywords = max(categories, int(rules * keyword_share))
+    cats = {
+        f"cat{i}": {"label": f"Category {i}", "severity": "low", "domains": [], "keywords": []}
+        for i in range(categories)
+    }
+    names = list(cats)
+    for i in range(rules):
+        cat = cats[names[i % categories]]
+        if i < keywords:
+            cat["keywords"].append(_label(rnd, 5, 8))
+        else:
+            cat["domains"].append(f"{_label(rnd)}.{rnd.choice(_TLDS)}")
+    return cats
+
+
+def _linear_categorize(domain, categories):
+    """The pre-compiled categorizer: scan every rule of every category."""
+    domain = domain.lower().rstrip(".")
+    for cat_id, cat in categories.items():
+        for known_domain in cat["domains"]:
+            if domain == known_domain or domain.endswith("." + known_domain):
+                return cat_id
+        for keyword in cat["keywords"]:
+            if keyword in domain:
+                return cat_id
+    return None
+
+
+def _workload(categories, lookups, rnd, hit_share=0.2):
+    """Realistic-ish query names: mostly unlisted, some subdomains of listed ones."""
+    listed = [d for cat in categories.values() for d in cat["domains"]]
+    names = []
+    for _ in range(lookups):
+        if listed and rnd.random() < hit_share:
+            names.append(f"{_label(rnd, 2, 6)}.{rnd.choice(listed)}")
+        else:
+            names.append(f"{_label(rnd, 2, 6)}.{_label(rnd)}.{rnd.choice(_TLDS)}")
+    return names
+
+
+def _timed(fn, names):
+    start = time.perf_counter()
+    for name in names:
+        fn(name)
+    return (time.perf_counter() - start) / len(names) * 1e6
+
+
+def cmd_categorize(args):
+    """Compare compiled and linear categorization at each rule count."""
+    rnd = random.Random(args.seed)
+    for rules in args.rules:
+        categories = _synthetic_categories(rules, rnd)
+        names = _workload(categories, args.lookups, rnd)
+
+        start = time.perf_counter()
+        categorizer = Categorizer(categories)
+        compile_s = time.perf_counter() - start
+
+        compiled_us = _timed(lambda n: categorizer.match(n.lower().rstrip(".")), names)
+
+        # The linear scan is O(rules) per lookup; sample it rather than run it all
+        sample = names[:max(1, min(len(names), 2_000_000 // rules))]
+        linear_us = _timed(lambda n: _linear_categorize(n, categories), sample)
+
+        logger.info(
+            f"rules={rules:>9,}  compile={compile_s:.2f}s  "
+            f"compiled={compiled_us:.2f}us/lookup  "
+            f"linear={linear_us:,.0f}us/lookup ({len(sample)} sampled)  "
+            f"speedup={linear_us / compiled_us:,.0f}x"
+        )
+
+
+def cmd_blocklist(args):
+    """Load a generated hosts-format list and report load time, size and lookup cost."""
+    rnd = random.Random(args.seed)
+    fd, path = tempfile.mkstemp(suffix=".hosts")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("# synthetic list\n127.0.0.1 localhost\n")
+            for _ in range(args.domains):
+                f.write(f"0.0.0.0 {_label(rnd)}.{_label(rnd, 3, 8)}.{rnd.choice(_TLDS)}\n")
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        domain_list = load_domain_list({"adult": [path]})
+        load_s = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        names = [f"www.{_label(rnd)}.{rnd.choice(_TLDS)}" for _ in range(args.lookups)]
+        lookup_us = _timed(domain_list.match, names)
+
+        logger.info(
+            f"domains={len(domain_list):,}  load={load_s:.2f}s  "
+            f"resident={domain_list.nbytes / 1e6:.1f}MB  load_peak={peak / 1e6:.0f}MB  "
+            f"lookup={lookup_us:.2f}us"
+        )
+    finally:
+        os.unlink(path)
+
+
+def _synthetic_log(rows, devices, domains, rnd):
+    """Query rows in segment column order: a few devices, Zipf-ish domain popularity, 30 days."""
+    ts = 1_767_225_600_000
+    step = 30 * 86400 * 1000 // rows
+    weights = [1 / (rank + 1) for rank in range(domains)]
+    picks = rnd.choices(range(1, domains + 1), weights, k=rows)
+    for i, domain_id in enumerate(picks, 1):
+        ts += rnd.randint(0, 2 * step)
+        flagged = domain_id % 97 == 0
+        yield (i, ts, rnd.randint(1, devices), domain_id, rnd.choice((1, 1, 1, 28, 65)), None, None,
+               1 if flagged else None, 2 if flagged else 0)
+
+
+def cmd_segment(args):
+    """Size and aggregate scan cost of a partition as SQLite rows and as an archive segment."""
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "partition.db")
+        conn = sqlite3.connect(path)
+        conn.executescript(db._PARTITION_SCHEMA.format(schema="main"))
+        conn.executemany("INSERT INTO dns_queries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         _synthetic_log(args.rows, args.devices, args.domains, rnd))
+        conn.commit()
+        conn.execute("VACUUM")
+        db_bytes = os.path.getsize(path)
+
+        seg_path = os.path.join(tmp, "partition.seg")
+        start = time.perf_counter()
+        write_segment(seg_path, conn.execute("SELECT * FROM dns_queries ORDER BY ts, id"))
+        write_s = time.perf_counter() - start
+        seg_bytes = os.path.getsize(seg_path)
+        segment = Segment(seg_path)
+
+        newest = conn.execute("SELECT MAX(ts) FROM dns_queries").fetchone()[0]
+        week = (newest - 7 * 86400 * 1000, newest)
+
+        def sql_report():
+            return dict(conn.execute(
+                "SELECT domain_id, COUNT(*) FROM dns_queries WHERE source_id = 1 AND ts BETWEEN ? AND ? "
+                "GROUP BY domain_id", week
+            ).fetchall())
+
+        def segment_report():
+            counts = Counter()
+            for block in segment.scan(("domain_id",), lo=week[0], hi=week[1], source_ids=[1]):
+                counts.update(d for d, in block)
+            return dict(counts)
+
+        def sql_hourly():
+            return conn.execute(
+                "SELECT ts / 3600000, source_id, domain_id, COUNT(*) FROM dns_queries "
+                "GROUP BY ts / 3600000, source_id, domain_id"
+            ).fetchall()
+
+        def segment_hourly():
+            counts = Counter()
+            for block in segment.scan(("ts", "source_id", "domain_id")):
+                counts.update((ts // 3600000, s, d) for ts, s, d in block)
+            return counts
+
+        timings = []
+        for name, sql, seg in (("device week", sql_report, segment_report),
+                               ("hourly rollup", sql_hourly, segment_hourly)):
+            start = time.perf_counter()
+            expected = sql()
+            sql_s = time.perf_counter() - start
+            start = time.perf_counter()
+            got = seg()
+            seg_s = time.perf_counter() - start
+            assert len(got) == len(expected), f"{name}: segment and SQLite results differ"
+            timings.append((name, sql_s, seg_s))
+        segment.close()
+        conn.close()
+
+    logger.info(
+        f"rows={args.rows:,}  sqlite={db_bytes / 1e6:.1f}MB  segment={seg_bytes / 1e6:.1f}MB  "
+        f"ratio={db_bytes / seg_bytes:.1f}x  write={write_s:.1f}s"
+    )
+    for name, sql_s, seg_s in timings:
+        logger.info(f"{name:>13}: sqlite={sql_s * 1000:.0f}ms  segment={seg_s * 1000:.0f}ms")
+
+
+def _synthetic_exchange(rnd):
+    """A client query (with EDNS) and a typical upstream answer: A records, a CNAME chain or NXDOMAIN."""
+    name = f"{_label(rnd)}.{_label(rnd, 3, 8)}.{rnd.choice(_TLDS)}"
+    qtype = rnd.choice(("A", "A", "A", "AAAA", "HTTPS"))
+    query = DNSRecord(q=DNSQuestion(name, getattr(QTYPE, qtype)))
+    query.header.id = rnd.getrandbits(16)
+    query.add_ar(EDNS0(udp_len=1232))
+    reply = query.reply()
+    kind = rnd.random()
+    if kind < 0.15:
+        reply.header.rcode = 3
+        reply.add_auth(RR(name.split(".", 1)[1], QTYPE.SOA, ttl=900,
+                          rdata=SOA("ns1.example.net", "hostmaster.example.net", (1, 7200, 900, 1209600, 300))))
+    else:
+        target = name
+        if kind < 0.5:
+            target = f"{_label(rnd)}.cdn.example.net"
+            reply.add_answer(RR(name, QTYPE.CNAME, ttl=rnd.randint(60, 3600), rdata=CNAME(target)))
+        for _ in range(rnd.randint(1, 4)):
+            reply.add_answer(RR(target, QTYPE.A, ttl=rnd.randint(30, 300),
+                                rdata=A(".".join(str(rnd.randint(1, 254)) for _ in range(4)))))
+    reply.add_ar(EDNS0(udp_len=1232))
+    return query.pack(), reply.pack()
+
+
+def _dnslib_cache_ttl(record):
+    """The cache TTL rule of dns_cache, evaluated on a parsed record."""
+    if record.header.tc:
+        return None
+    if record.header.rcode == 0 and record.rr:
+        return min(rr.ttl for rr in record.rr)
+    if record.header.rcode in (0, 3):
+        for rr in record.auth:
+            if rr.rtype == QTYPE.SOA:
+                return min(rr.ttl, rr.rdata.times[-1])
+    return None
+
+
+def cmd_wire(args):
+    """Per-packet proxy CPU: dnslib decode/encode against reading the wire format directly."""
+    rnd = random.Random(args.seed)
+    exchanges = [_synthetic_exchange(rnd) for _ in range(args.packets)]
+
+    # Both paths must agree before their timings mean anything
+    for query, response in exchanges:
+        request = DNSRecord.parse(query)
+        txid, qname, qtype, qclass = parse_query(query)
+        assert (txid, qname, qtype, qclass) == (request.header.id, str(request.q.qname),
+                                                 request.q.qtype, request.q.qclass)
+        assert scan_answer(response)[0] == _dnslib_cache_ttl(DNSRecord.parse(response))
+
+    def dnslib_miss():
+        # Threaded engine before: parse, re-pack to forward, parse the answer, re-pack it
+        for query, response in exchanges:
+            request = DNSRecord.parse(query)
+            key = DNSCache.key_for(request)
+            QTYPE[request.q.qtype]
+            request.pack()
+            reply = DNSRecord.parse(response)
+            _dnslib_cache_ttl(reply)
+            reply.pack()
+
+    def wire_miss():
+        for query, response in exchanges:
+            txid, qname, qtype, qclass = parse_query(query)
+            key = (qname.lower(), qtype, qclass, edns_state(query))
+            QTYPE[qtype]
+            scan_answer(response)
+
+    scanned = [scan_answer(response)[1] for _, response in exchanges]
+
+    def dnslib_hit():
+        for _, response in exchanges:
+            reply = DNSRecord.parse(response)
+            reply.header.id = 1
+            for rr in reply.rr + reply.auth + reply.ar:
+                if rr.rtype != QTYPE.OPT:
+                    rr.ttl = max(0, rr.ttl - 5)
+            reply.pack()
+
+    def wire_hit():
+        for (_, response), offsets in zip(exchanges, scanned):
+            readdress(response, 1, offsets, 5)
+
+    for name, old, new in (("forwarded", dnslib_miss, wire_miss), ("cache hit", dnslib_hit, wire_hit)):
+        start = time.perf_counter()
+        old()
+        old_us = (time.perf_counter() - start) * 1e6 / args.packets
+        start = time.perf_counter()
+        new()
+        new_us = (time.perf_counter() - start) * 1e6 / args.packets
+        logger.info(f"{name:>9}: dnslib={old_us:.1f}us/packet  wire={new_us:.1f}us/packet  "
+                    f"speedup={old_us / new_us:.1f}x")
+
+
+def _stub_upstream(delay_ms, loss, rnd, ttl=60):
+    """A local DNS server answering every query with one A record after delay_ms, dropping a share of them."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+
+    def answer(data, addr):
+        time.sleep(delay_ms / 1000)
+        reply = DNSRecord.parse(data).reply()
+        reply.add_answer(RR(reply.q.qname, QTYPE.A, ttl=ttl, rdata=A("192.0.2.1")))
+        sock.sendto(reply.pack(), addr)
+
+    def serve():
+        while True:
+            data, addr = sock.recvfrom(4096)
+            if rnd.random() >= loss:
+                threading.Thread(target=answer, args=(data, addr), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+def _dead_upstream():
+    """A local port nobody listens on."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"127.0.0.1:{port}"
+
+
+def cmd_upstream(args):
+    """Lookup latency through the upstream pool against local stubs with injected latency and loss."""
+    rnd = random.Random(args.seed)
+    servers = []
+    for stub in args.stubs:
+        if stub == "dead":
+            servers.append(_dead_upstream())
+        else:
+            delay_ms, _, loss = stub.partition("/")
+            servers.append(_stub_upstream(float(delay_ms), float(loss or 0), rnd))
+
+    for hedge in (False, True):
+        pool = UpstreamPool(servers, timeout=args.timeout, hedge=hedge)
+        latencies, failures = [], 0
+        for i in range(args.lookups):
+            query = DNSRecord(q=DNSQuestion(f"q{i}.example.com"))
+            start = time.perf_counter()
+            try:
+                pool.exchange(query.pack())
+            except TimeoutError:
+                failures += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+        stats = pool.stats()
+        logger.info(f"hedge={'on ' if hedge else 'off'}  p50={pick(0.5):.0f}ms  p95={pick(0.95):.0f}ms  "
+                    f"p99={pick(0.99):.0f}ms  timeouts={failures}  hedges={stats['hedges']}  "
+                    f"hedge_wins={stats['hedge_wins']}")
+        for stub, server in zip(args.stubs, stats["servers"]):
+            logger.info(f"    {stub:>8}: srtt_ms={server['srtt_ms']}  failure_rate={server['failure_rate']}  "
+                        f"asked={server['queries']}  answered={server['answers']}")
+
+
+def _free_port():
+    """A port free for both UDP and TCP on all addresses, as of now."""
+    while True:
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind(("0.0.0.0", 0))
+        port = udp.getsockname()[1]
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            tcp.bind(("0.0.0.0", port))
+            return port
+        except OSError:
+            continue
+        finally:
+            udp.close()
+            tcp.close()
+
+
+def _blast(port, names, seconds, sockets, window, results, source="127.0.0.1"):
+    """
+    Load generator process: keep `window` queries outstanding on each of
+    `sockets` client sockets (distinct source ports, so SO_REUSEPORT spreads
+    them) and count the answers.
+    """
+    packets = [DNSRecord(q=DNSQuestion(name)).pack() for name in names]
+    socks = []
+    for _ in range(sockets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((source, 0))
+        sock.connect(("127.0.0.1", port))
+        sock.setblocking(False)
+        socks.append(sock)
+    outstanding = dict.fromkeys(socks, 0)
+    heard = dict.fromkeys(socks, time.monotonic())
+    sent = answered = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        for sock in socks:
+            if now - heard[sock] > 0.2:
+                # Its outstanding queries were lost; start over with a full window
+                outstanding[sock] = 0
+                heard[sock] = now
+            while outstanding[sock] < window:
+                sock.send(packets[sent % len(packets)])
+                sent += 1
+                outstanding[sock] += 1
+        ready, _, _ = select.select(socks, [], [], 0.05)
+        for sock in ready:
+            while True:
+                try:
+                    sock.recv(4096)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    continue
+                answered += 1
+                outstanding[sock] = max(0, outstanding[sock] - 1)
+                heard[sock] = time.monotonic()
+    results.put(answered)
+
+
+def cmd_workers(args):
+    """Proxy throughput (mostly cache hits) by worker process count, with the query log shipped but not stored."""
+    rnd = random.Random(args.seed)
+    upstream = _stub_upstream(0, 0, rnd)
+    names = [f"{_label(rnd)}.{rnd.choice(_TLDS)}" for _ in range(args.names)]
+    distribution = args.distribution or ("reuseport" if reuse_port_available() else "dispatcher")
+    logger.info(f"{os.cpu_count()} CPUs, {args.clients} client processes, {distribution}")
+    ctx = multiprocessing.get_context("spawn")
+    baseline = None
+    for count in args.workers:
+        ingested = [0]
+
+        def ingest(rows):
+            ingested[0] += len(rows)
+
+        port = _free_port()
+        pool = ProxyWorkerPool(count, servers=[upstream], port=port, distribution=distribution,
+                               ingest=ingest, log_level="WARNING")
+        pool.start()
+        try:
+            for seconds in (args.warmup, args.seconds):
+                results = ctx.Queue()
+                clients = [ctx.Process(target=_blast, args=(port, names, seconds, args.sockets,
+                                                            args.window, results))
+                           for _ in range(args.clients)]
+                logged_before = ingested[0]
+                for client in clients:
+                    client.start()
+                answered = sum(results.get() for _ in clients)
+                for client in clients:
+                    client.join()
+            time.sleep(0.2)
+            logged = ingested[0] - logged_before
+        finally:
+            pool.stop()
+        qps = answered / args.seconds
+        baseline = baseline or qps
+        logger.info(f"workers={count:>2}  answered={qps:,.0f}/s  logged={logged / args.seconds:,.0f}/s  "
+                    f"scaling={qps / baseline:.2f}x")
+
+
+def cmd_prefetch(args):
+    """Client-side latency for a Zipf-popular name set with short TTLs, by prefetch budget."""
+    rnd = random.Random(args.seed)
+    upstream = _stub_upstream(args.delay_ms, 0, rnd, ttl=args.ttl)
+    names = [f"{_label(rnd)}.{rnd.choice(_TLDS)}" for _ in range(args.names)]
+    weights = [1 / (i + 1) for i in range(args.names)]
+    # The first TTL only fills the cache; latency is measured after it
+    warmup = int(args.qps * args.ttl)
+    workload = rnd.choices(names, weights, k=warmup + int(args.qps * args.seconds))
+    packets = [DNSRecord(q=DNSQuestion(name)).pack() for name in workload]
+    logger.info(f"{args.names} names, TTL {args.ttl}s, upstream {args.delay_ms:.0f}ms, "
+                f"{args.qps} queries/s for {args.ttl}s + {args.seconds:.0f}s")
+    # One log line per query would cost more than the lookups being measured
+    logging.getLogger("dns_proxy").setLevel(logging.WARNING)
+    for budget in args.budgets:
+        port = _free_port()
+        server = AsyncDNSProxyServer([upstream], port=port, tcp=False, cache=DNSCache(prefetch_budget=budget))
+        server.start()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        latencies = []
+        start = time.perf_counter()
+        try:
+            for i, packet in enumerate(packets):
+                # Paced, so prefetch sees the same clock as a real client population
+                delay = start + i / args.qps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sent = time.perf_counter()
+                client.sendto(packet, ("127.0.0.1", port))
+                try:
+                    client.recv(4096)
+                except socket.timeout:
+                    continue
+                if i >= warmup:
+                    latencies.append((time.perf_counter() - sent) * 1000)
+            stats = server.cache.stats()
+        finally:
+            client.close()
+            server.stop()
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+        logger.info(f"budget={budget:>4}/s  p50={pick(0.5):.2f}ms  p99={pick(0.99):.2f}ms  "
+                    f"p99.9={pick(0.999):.2f}ms  hit_ratio={stats['hit_ratio']}  "
+                    f"without_prefetch={stats['hit_ratio_without_prefetch']}  "
+                    f"prefetches={stats['prefetches']}  skipped={stats['prefetch_skipped']}  "
+                    f"failed={stats['prefetch_failures']}")
+
+
+def cmd_limits(args):
+    """A paced client's latency while another floods the proxy with cache misses, by per-client rate limit."""
+    rnd = random.Random(args.seed)
+    upstream = _stub_upstream(args.delay_ms, 0, rnd)
+    flood_names = [f"{_label(rnd)}.{rnd.choice(_TLDS)}" for _ in range(args.flood_names)]
+    logger.info(f"flooder on 127.0.0.2 ({args.sockets} sockets x {args.window} outstanding), "
+                f"client on 127.0.0.3 at {args.client_qps}/s, upstream {args.delay_ms:.0f}ms")
+    logging.getLogger("dns_proxy").setLevel(logging.ERROR)
+    # Logged queries are discarded, not written
+    set_query_sink(lambda *row: None)
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for qps in args.qps:
+            port = _free_port()
+            server = AsyncDNSProxyServer([upstream], port=port, tcp=False,
+                                         limiter=ClientLimiter(qps, qps * 4, "refuse"))
+            if not qps:
+                # Off means no per-client upstream cap either
+                server.slots = FairSlots(args.flood_names, args.flood_names)
+            server.start()
+            results = ctx.Queue()
+            flooder = ctx.Process(target=_blast, args=(port, flood_names, args.seconds + 1, args.sockets,
+                                                       args.window, results, "127.0.0.2"))
+            flooder.start()
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.bind(("127.0.0.3", 0))
+            client.settimeout(1)
+            latencies, lost = [], 0
+            try:
+                time.sleep(0.5)
+                start = time.perf_counter()
+                for i in range(int(args.client_qps * args.seconds)):
+                    delay = start + i / args.client_qps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    sent = time.perf_counter()
+                    client.sendto(DNSRecord(q=DNSQuestion(f"c{i}.example.com")).pack(), ("127.0.0.1", port))
+                    try:
+                        client.recv(4096)
+                    except socket.timeout:
+                        lost += 1
+                        continue
+                    latencies.append((time.perf_counter() - sent) * 1000)
+                flooded = results.get()
+                flooder.join()
+                limits = server.stats()["rate_limit"]
+            finally:
+                client.close()
+                server.stop()
+            latencies.sort()
+            pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0
+            logger.info(f"limit={qps or 'off':>4}  client p50={pick(0.5):.1f}ms  p99={pick(0.99):.1f}ms  "
+                        f"lost={lost}  flooder answered={flooded / (args.seconds + 1):,.0f}/s  "
+                        f"refused={limits['refused']}")
+    finally:
+        set_query_sink(None)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="bench",
+        description="Windows Remote Network Monitor — micro-benchmarks",
+    )
+    sub = parser.add_subparsers(dest="command", help="Available commands")
+
+    # categorize
+    p_cat = sub.add_parser("categorize", help="Domain categorizer lookup cost by rule count")
+    p_cat.add_argument("--rules", type=int, nargs="+", default=[10_000, 1_000_000])
+    p_cat.add_argument("--lookups", type=int, default=100_000)
+    p_cat.add_argument("--seed", type=int, default=1)
+    p_cat.set_defaults(func=cmd_categorize)
+
+    # blocklist
+    p_list = sub.add_parser("blocklist", help="Category list import time and memory")
+    p_list.add_argument("--domains", type=int, default=3_000_000)
+    p_list.add_argument("--lookups", type=int, default=100_000)
+    p_list.add_argument("--seed", type=int, default=1)
+    p_list.set_defaults(func=cmd_blocklist)
+
+    # segment
+    p_seg = sub.add_parser("segment", help="Archive segment size and scan cost against SQLite rows")
+    p_seg.add_argument("--rows", type=int, default=2_000_000)
+    p_seg.add_argument("--devices", type=int, default=12)
+    p_seg.add_argument("--domains", type=int, default=20_000)
+    p_seg.add_argument("--seed", type=int, default=1)
+    p_seg.set_defaults(func=cmd_segment)
+
+    # wire
+    p_wire = sub.add_parser("wire", help="Per-packet proxy CPU with and without dnslib decoding")
+    p_wire.add_argument("--packets", type=int, default=20_000)
+    p_wire.add_argument("--seed", type=int, default=1)
+    p_wire.set_defaults(func=cmd_wire)
+
+    # upstream
+    p_up = sub.add_parser("upstream", help="Upstream pool latency against local stubs, with and without hedging")
+    p_up.add_argument("--stubs", nargs="+", default=["300/0", "5/0.3", "dead"],
+                      help="One stub per entry: 'delay_ms/loss' or 'dead'")
+    p_up.add_argument("--lookups", type=int, default=300)
+    p_up.add_argument("--timeout", type=float, default=2.0)
+    p_up.add_argument("--seed", type=int, default=1)
+    p_up.set_defaults(func=cmd_upstream)
+
+    # workers
+    p_work = sub.add_parser("workers", help="Proxy throughput by worker process count")
+    p_work.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p_work.add_argument("--clients", type=int, default=os.cpu_count() or 1,
+                        help="Load generator processes")
+    p_work.add_argument("--sockets", type=int, default=16, help="Client sockets per load generator")
+    p_work.add_argument("--window", type=int, default=8, help="Outstanding queries per client socket")
+    p_work.add_argument("--names", type=int, default=500)
+    p_work.add_argument("--seconds", type=float, default=5.0)
+    p_work.add_argument("--warmup", type=float, default=2.0, help="Seconds to fill every worker's cache first")
+    p_work.add_argument("--distribution", choices=["reuseport", "dispatcher"])
+    p_work.add_argument("--seed", type=int, default=1)
+    p_work.set_defaults(func=cmd_workers)
+
+    # prefetch
+    p_pre = sub.add_parser("prefetch", help="Popular-name latency through the proxy by prefetch budget")
+    p_pre.add_argument("--budgets", type=float, nargs="+", default=[0, 20, 100],
+                       help="Prefetches per second; 0 disables")
+    p_pre.add_argument("--names", type=int, default=200)
+    p_pre.add_argument("--ttl", type=int, default=10)
+    p_pre.add_argument("--delay-ms", type=float, default=30)
+    p_pre.add_argument("--qps", type=int, default=500)
+    p_pre.add_argument("--seconds", type=float, default=30)
+    p_pre.add_argument("--seed", type=int, default=1)
+    p_pre.set_defaults(func=cmd_prefetch)
+
+    # limits
+    p_lim = sub.add_parser("limits", help="A normal client's latency next to a flooding one, by per-client rate limit")
+    p_lim.add_argument("--qps", type=float, nargs="+", default=[0, 50],
+                       help="Per-client queries per second (burst 4x); 0 disables every per-client limit")
+    p_lim.add_argument("--client-qps", type=int, default=50)
+    p_lim.add_argument("--sockets", type=int, default=8, help="Flooder sockets")
+    p_lim.add_argument("--window", type=int, default=32, help="Outstanding flood queries per socket")
+    p_lim.add_argument("--flood-names", type=int, default=100_000)
+    p_lim.add_argument("--delay-ms", type=float, default=20)
+    p_lim.add_argument("--seconds", type=float, default=10)
+    p_lim.add_argument("--seed", type=int, default=1)
+    p_lim.set_defaults(func=cmd_limits)
+
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return
+
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
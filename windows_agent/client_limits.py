@@ -0,0 +1,220 @@
+"""
+Per-client admission control for the DNS proxy.
+Each source IP gets a token bucket; a query over its client's rate is
+answered REFUSED (or dropped) before it is logged or forwarded, so one
+flooding device costs the rest of the network almost nothing. Lookups
+that have to go upstream also need one of a fixed number of slots: a
+client may hold only so many at once, and when every slot is busy the
+waiting lookups get them round-robin by client, so one client's backlog
+can't starve another's.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from config import (
+    DNS_CLIENT_QPS, DNS_CLIENT_BURST, DNS_RATE_LIMIT_ACTION, DNS_UPSTREAM_SLOTS, DNS_CLIENT_UPSTREAM_MAX,
+)
+from dns_wire import refused
+
+logger = logging.getLogger("client_limits")
+
+# Clients with a bucket, and clients with limit events kept for /status.
+# Past these the least recently seen are forgotten (spoofed floods).
+_MAX_CLIENTS = 4096
+_MAX_TRACKED = 1024
+
+
+class ClientQueueFull(Exception):
+    """A client already has as many upstream lookups outstanding as it may."""
+
+
+class ClientLimiter:
+    """Token bucket per source IP, and who has been limited how often."""
+
+    def __init__(self, qps: float = DNS_CLIENT_QPS, burst: float = DNS_CLIENT_BURST,
+                 action: str = DNS_RATE_LIMIT_ACTION):
+        if action not in ("refuse", "drop"):
+            raise ValueError(f"Unknown DNS_RATE_LIMIT_ACTION: {action}")
+        self.qps = qps
+        self.burst = max(burst, 1)
+        self.action = action
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # {ip: [tokens, updated_at]}
+        self._events: "OrderedDict[str, dict]" = OrderedDict()   # {ip: counters}
+        self._lock = threading.Lock()
+        self.refused = 0
+        self.dropped = 0
+
+    def admit(self, client_ip: str) -> bool:
+        """Take one token from the client's bucket; False (and counted) if it is empty."""
+        if self.qps <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client_ip)
+            if bucket:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.qps)
+                bucket[1] = now
+                self._buckets.move_to_end(client_ip)
+            else:
+                bucket = self._buckets[client_ip] = [self.burst, now]
+                if len(self._buckets) > _MAX_CLIENTS:
+                    self._buckets.popitem(last=False)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True
+        self.limited(client_ip, "rate_limited")
+        return False
+
+    def limited(self, client_ip: str, reason: str):
+        """Count a limit event ("rate_limited" or "queue_full") against a client."""
+        with self._lock:
+            events = self._events.get(client_ip)
+            if events:
+                self._events.move_to_end(client_ip)
+            else:
+                events = self._events[client_ip] = {"rate_limited": 0, "queue_full": 0, "last_limited": 0.0}
+                if len(self._events) > _MAX_TRACKED:
+                    self._events.popitem(last=False)
+            events[reason] += 1
+            events["last_limited"] = time.time()
+            # A full upstream queue is always answered REFUSED
+            if self.action == "refuse" or reason == "queue_full":
+                self.refused += 1
+            else:
+                self.dropped += 1
+
+    def refusal(self, query: bytes) -> Optional[bytes]:
+        """What a limited client gets: REFUSED, or None to send nothing."""
+        if self.action == "refuse" and len(query) >= 12:
+            return refused(query)
+        return None
+
+    def stats(self) -> Dict:
+        """Totals and per-client limit events, for the status endpoint and the devices list."""
+        with self._lock:
+            return {
+                "qps": self.qps,
+                "burst": self.burst,
+                "action": self.action,
+                "refused": self.refused,
+                "dropped": self.dropped,
+                "clients": {
+                    ip: {
+                        "rate_limited": e["rate_limited"],
+                        "queue_full": e["queue_full"],
+                        "last_limited": datetime.fromtimestamp(e["last_limited"]).isoformat(timespec="seconds"),
+                    }
+                    for ip, e in self._events.items()
+                },
+            }
+
+
+class FairSlots:
+    """
+    A fixed number of upstream slots. A client holds at most per_client
+    slots and queued waiters together; while every slot is busy, each
+    released slot goes to the next waiting client in turn.
+    """
+
+    def __init__(self, slots: int = DNS_UPSTREAM_SLOTS, per_client: int = DNS_CLIENT_UPSTREAM_MAX):
+        self.slots = max(1, slots)
+        self.per_client = max(1, per_client)
+        self.active = 0
+        self._held: Dict[str, int] = {}                       # {ip: slots held}
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()  # {ip: waiters}, in turn order
+        self._lock = threading.Lock()
+        self.queued = 0
+
+    def acquire(self, client_ip: str, waiter: Callable[[], None]) -> bool:
+        """
+        True if a slot was taken now; False if the client is queued, in
+        which case waiter() is called once one is handed over. Raises
+        ClientQueueFull if the client has no room left.
+        """
+        with self._lock:
+            queue = self._waiting.get(client_ip)
+            if self._held.get(client_ip, 0) + (len(queue) if queue else 0) >= self.per_client:
+                raise ClientQueueFull(client_ip)
+            if self.active < self.slots and not self._waiting:
+                self.active += 1
+                self._held[client_ip] = self._held.get(client_ip, 0) + 1
+                return True
+            if queue is None:
+                queue = self._waiting[client_ip] = deque()
+            queue.append(waiter)
+            self.queued += 1
+            return False
+
+    def release(self, client_ip: str):
+        """Give a slot back, handing it to the next waiting client if there is one."""
+        with self._lock:
+            held = self._held.get(client_ip, 0) - 1
+            if held > 0:
+                self._held[client_ip] = held
+            else:
+                self._held.pop(client_ip, None)
+            if not self._waiting:
+                self.active -= 1
+                return
+            client, queue = next(iter(self._waiting.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            self._held[client] = self._held.get(client, 0) + 1
+        waiter()
+
+    def cancel(self, client_ip: str, waiter: Callable[[], None]) -> bool:
+        """Withdraw a queued waiter; False if it was handed a slot first (release it then)."""
+        with self._lock:
+            queue = self._waiting.get(client_ip)
+            if not queue or waiter not in queue:
+                return False
+            queue.remove(waiter)
+            if not queue:
+                del self._waiting[client_ip]
+            return True
+
+    def wait(self, client_ip: str, timeout: float):
+        """Blocking acquire for the threaded engine; TimeoutError if no slot came in time."""
+        granted = threading.Event()
+        if self.acquire(client_ip, granted.set) or granted.wait(timeout):
+            return
+        if self.cancel(client_ip, granted.set):
+            raise TimeoutError("No upstream slot came free")
+
+    async def wait_async(self, client_ip: str, timeout: float):
+        """acquire() for the asyncio engine, awaited on its event loop."""
+        granted = asyncio.get_running_loop().create_future()
+
+        def waiter():
+            if not granted.done():
+                granted.set_result(None)
+
+        if self.acquire(client_ip, waiter):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except asyncio.TimeoutError:
+            if self.cancel(client_ip, waiter):
+                raise TimeoutError("No upstream slot came free")
+        except asyncio.CancelledError:
+            if not self.cancel(client_ip, waiter):
+                self.release(client_ip)
+            raise
+
+    def stats(self) -> Dict:
+        """Slot use for the status endpoint."""
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "active": self.active,
+                "waiting": sum(len(q) for q in self._waiting.values()),
+                "queued": self.queued,
+            }
@@ -39,9 +39,84 @@ NETWORK_CIDR = "10.0.0.0/24"
 UPSTREAM_DNS = "8.8.8.8"
 UPSTREAM_DNS_ALT = "8.8.4.4"
 
+# Every upstream the proxy may use ("ip" or "ip:port"). Each lookup goes to
+# the fastest healthy one; servers that keep failing are skipped for a while.
+UPSTREAM_DNS_SERVERS = [UPSTREAM_DNS, UPSTREAM_DNS_ALT]
+
+# Seconds before a lookup gives up on every upstream and answers SERVFAIL.
+DNS_UPSTREAM_TIMEOUT = 5.0
+
+# Hedged queries: if the chosen upstream hasn't answered within its usual
+# latency (smoothed RTT + 4 deviations, clamped to this range in ms), the
+# query is also sent to the next one and the first answer wins. Without
+# hedging each server gets an even share of DNS_UPSTREAM_TIMEOUT before the
+# next one is tried.
+DNS_HEDGE = True
+DNS_HEDGE_MIN_MS = 20
+DNS_HEDGE_MAX_MS = 1000
+
 # DNS proxy listen port (Mode A only).
 DNS_PROXY_PORT = 53
 
+# Also answer DNS over TCP on the proxy port. Clients retry there when a UDP
+# answer doesn't fit their EDNS0 buffer; connections stay open for reuse.
+DNS_PROXY_TCP = True
+
+# Seconds an idle client TCP connection is kept open.
+DNS_TCP_IDLE_TIMEOUT = 10
+
+# DNS proxy engine (Mode A only).
+# "threaded" — dnslib DNSServer, one thread per request
+# "asyncio"  — single event loop, upstream queries multiplexed over a few sockets
+DNS_PROXY_ENGINE = "threaded"
+
+# Number of long-lived upstream UDP sockets used by the asyncio engine.
+DNS_UPSTREAM_SOCKETS = 4
+
+# Proxy worker processes (Mode A only). Above 1, each worker runs the asyncio
+# engine with its own socket and cache and ships its query log to the agent
+# process. Linux spreads clients over the workers with SO_REUSEPORT; other
+# systems start a dispatcher process that owns the port and relays to them.
+DNS_PROXY_WORKERS = 1
+
+# In-memory DNS response cache (Mode A only). Memory cap in bytes, 0 disables.
+DNS_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Upper bound on how long any answer is cached, in seconds.
+DNS_CACHE_MAX_TTL = 86400
+
+# Serve-stale (RFC 8767): an expired answer is kept this many seconds longer
+# and served when no upstream answers for it. 0 disables.
+DNS_SERVE_STALE_MAX = 86400
+
+# TTL on stale answers. After a failed lookup the name is answered stale for
+# this long before upstream is tried again.
+DNS_STALE_ANSWER_TTL = 30
+
+# Prefetch: an answer asked for at least DNS_PREFETCH_MIN_HITS times is
+# refreshed in the background once it is in the last DNS_PREFETCH_WINDOW
+# (share) of its TTL, so popular names never expire in front of a client.
+DNS_PREFETCH_MIN_HITS = 3
+DNS_PREFETCH_WINDOW = 0.1
+
+# Most background refreshes started per second. 0 disables prefetch.
+DNS_PREFETCH_BUDGET = 20
+
+# Per-client rate limit: each source IP may send DNS_CLIENT_QPS queries per
+# second on average, in bursts of up to DNS_CLIENT_BURST. 0 disables.
+DNS_CLIENT_QPS = 50
+DNS_CLIENT_BURST = 200
+
+# What a client over its rate gets: "refuse" (a REFUSED answer) or "drop"
+# (no answer at all).
+DNS_RATE_LIMIT_ACTION = "refuse"
+
+# Most upstream lookups in flight at once, and most one client may have in
+# flight or waiting; past that its cache misses are answered REFUSED. While
+# every slot is busy, waiting lookups get them in turn by client.
+DNS_UPSTREAM_SLOTS = 256
+DNS_CLIENT_UPSTREAM_MAX = 32
+
 # ============================================================
 # API SERVER
 # ============================================================
@@ -57,6 +132,49 @@ API_HOST = "0.0.0.0"
 # SQLite database file path (relative to agent directory).
 DB_PATH = "dns_monitor.db"
 
+# DNS queries are written by one background thread in batches: a batch is
+# committed after LOG_BATCH_SIZE rows or LOG_FLUSH_INTERVAL_MS, whichever first.
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL_MS = 250
+
+# Max rows waiting to be written.
+LOG_QUEUE_SIZE = 50000
+
+# What to do when the queue is full:
+# "block"       — capture threads wait for room
+# "drop_oldest" — discard the oldest queued row
+# "spill"       — append overflow rows to LOG_SPILL_PATH, written back later
+LOG_OVERFLOW_POLICY = "spill"
+LOG_SPILL_PATH = "dns_spill.jsonl"
+
+# API reads run on a fixed pool of worker threads, each with its own
+# read-only connection, so a slow report never stalls other requests.
+DB_READ_WORKERS = 4
+
+# Per-request query timeout in seconds; longer scans are cancelled.
+DB_QUERY_TIMEOUT = 30
+
+# The query log is split into one SQLite file per period in this directory
+# (relative to DB_PATH's directory); reads only open the periods they need.
+# "month" or "day".
+DB_PARTITION_DIR = "partitions"
+DB_PARTITION_PERIOD = "month"
+
+# Drop raw queries older than this many days, a whole partition at a time
+# (0 = keep forever). Reports, timelines and alerts keep their rollups.
+DB_RETENTION_DAYS = 0
+
+# Convert closed partitions older than this many days into compact,
+# read-only columnar segments (0 = never). Archived periods stay searchable.
+DB_ARCHIVE_AFTER_DAYS = 0
+
+# How often the agent applies retention and archiving, in seconds.
+DB_MAINTENANCE_INTERVAL = 3600
+
+# /status totals are counted as queries are logged and saved to the
+# database this often, in seconds; startup catches up from the last save.
+DB_STATS_SAVE_INTERVAL = 60
+
 # ============================================================
 # ARP SPOOF SETTINGS
 # ============================================================
@@ -67,6 +185,23 @@ ARP_SPOOF_INTERVAL = 2.0
 # Example: ["192.168.1.42", "192.168.1.43"]
 ARP_TARGETS = []
 
+# ============================================================
+# CATEGORY LISTS
+# ============================================================
+# External domain lists (hosts, adblock "||domain^" or one domain per line)
+# merged into the categorizer at startup and on POST /categories/reload.
+# Keys are category ids; built-in ones keep their label and severity.
+# Example:
+#   CATEGORY_LISTS = {
+#       "adult": ["lists/adult.txt"],
+#       "malware": {"label": "Malware", "severity": "high", "paths": ["lists/malware.hosts"]},
+#   }
+CATEGORY_LISTS = {}
+
+# Alerts are kept once per device and domain per window of this many hours,
+# with first/last sighting and a hit count.
+ALERT_WINDOW_HOURS = 24
+
 # ============================================================
 # LOGGING
 # ============================================================
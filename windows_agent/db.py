@@ -1,14 +1,40 @@
 """
 SQLite database for storing DNS query logs and device info.
 """
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import math
+import os
+import queue
+import shutil
 import sqlite3
 import threading
 import time
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from config import DB_PATH
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterator, List, Dict, Optional
+
+from dnslib import QTYPE
+
+from config import (
+    DB_PATH, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_MS, LOG_QUEUE_SIZE,
+    LOG_OVERFLOW_POLICY, LOG_SPILL_PATH, DB_READ_WORKERS, DB_QUERY_TIMEOUT,
+    ALERT_WINDOW_HOURS, DB_PARTITION_DIR, DB_PARTITION_PERIOD, DB_RETENTION_DAYS,
+    DB_ARCHIVE_AFTER_DAYS, DB_MAINTENANCE_INTERVAL, DB_STATS_SAVE_INTERVAL,
+)
+from domain_categories import categorize_domain
+from live_feed import feed as live_feed
+from segment import Segment, write_segment, COLUMNS as SEGMENT_COLUMNS
+
+logger = logging.getLogger("db")
 
 _local = threading.local()
+_fts_enabled = False
 
 
 def get_conn() -> sqlite3.Connection:
@@ -21,124 +47,2284 @@ def get_conn() -> sqlite3.Connection:
     return _local.conn
 
 
+class QueryTimeout(Exception):
+    """Raised when a pooled read exceeds its time budget."""
+
+
+class ReadPool:
+    """
+    Fixed set of worker threads, each holding a read-only connection.
+    Query functions run unchanged on the workers (get_conn() returns the
+    worker's connection) and a progress handler aborts them once the
+    request's deadline has passed.
+    """
+
+    # SQLite VM instructions between deadline checks
+    PROGRESS_STEPS = 10000
+
+    def __init__(self, workers: int = DB_READ_WORKERS, timeout: float = DB_QUERY_TIMEOUT):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="db-read",
+            initializer=self._init_worker,
+        )
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.max_wait_ms = 0.0
+
+    def _init_worker(self):
+        """Open this worker's read-only connection."""
+        uri = Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.set_progress_handler(self._past_deadline, self.PROGRESS_STEPS)
+        _local.conn = conn
+        _local.deadline = None
+        _local.read_only = True
+
+    @staticmethod
+    def _past_deadline() -> int:
+        """Progress handler: a non-zero return interrupts the running statement."""
+        deadline = getattr(_local, "deadline", None)
+        return 1 if deadline is not None and time.monotonic() > deadline else 0
+
+    def _call(self, fn: Callable, args: tuple, kwargs: dict, submitted: float, deadline: float):
+        """Run fn on a worker under the request's deadline."""
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.max_wait_ms = max(self.max_wait_ms, (time.monotonic() - submitted) * 1000)
+        _local.deadline = deadline
+        try:
+            if time.monotonic() > deadline:
+                raise QueryTimeout("Query timed out waiting for a database worker")
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise QueryTimeout(f"Query exceeded {self.timeout}s and was cancelled") from e
+            raise
+        finally:
+            _local.deadline = None
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Await fn(*args, **kwargs) on the pool."""
+        submitted = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor, self._call, fn, args, kwargs, submitted, submitted + self.timeout,
+            )
+        except QueryTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def shutdown(self):
+        """Stop the worker threads."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        """Pool saturation for monitoring."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self.active,
+                "queued": self.queued,
+                "saturated": self.active >= self.workers,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "max_wait_ms": round(self.max_wait_ms, 2),
+                "timeout_s": self.timeout,
+            }
+
+
+_read_pool: Optional[ReadPool] = None
+
+
+def start_read_pool():
+    """Create the shared read pool (call after init_db)."""
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = ReadPool()
+
+
+def stop_read_pool():
+    """Shut down the shared read pool."""
+    global _read_pool
+    if _read_pool:
+        _read_pool.shutdown()
+        _read_pool = None
+
+
+async def read_query(fn: Callable, *args, **kwargs):
+    """Run a query function on the read pool without blocking the event loop."""
+    if _read_pool is None:
+        start_read_pool()
+    return await _read_pool.run(fn, *args, **kwargs)
+
+
+def get_read_pool_stats() -> Optional[Dict]:
+    """Stats for the shared read pool, or None if it has not been started."""
+    return _read_pool.stats() if _read_pool else None
+
+
+# ── Schema ──────────────────────────────────────────────────
+# Version 1 stores each query as integers: epoch-millisecond timestamp,
+# source and domain dictionary ids, and the numeric query type.
+# Version 2 adds hourly per-device, per-domain rollups kept up to date by ingest.
+# Version 3 tags domains and each query row with a category id and severity.
+# Version 4 adds the alerts table, maintained by ingest.
+# Version 5 indexes dns_queries by (source_id, ts) for keyset paging per device.
+# Version 6 drops idx_domains_reversed, which no query reads.
+# Version 7 moves dns_queries into per-period partition files (see Partitions).
+SCHEMA_VERSION = 7
+
+# Row severity levels; 0 is uncategorized. Alerts are medium and above.
+SEVERITY_LEVELS = {"low": 1, "medium": 2, "high": 3}
+ALERT_SEVERITY = SEVERITY_LEVELS["medium"]
+_SEVERITY_NAMES = {level: name for name, level in SEVERITY_LEVELS.items()}
+
+_CATEGORY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL,
+        severity TEXT NOT NULL
+    );
+"""
+
+_ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS hourly_device_domain_counts (
+        hour INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        domain_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        first_seen INTEGER NOT NULL,
+        last_seen INTEGER NOT NULL,
+        PRIMARY KEY (source_id, hour, domain_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_hourly_hour ON hourly_device_domain_counts(hour);
+"""
+
+_ALERT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY,
+        source_id INTEGER NOT NULL REFERENCES sources(id),
+        domain_id INTEGER NOT NULL REFERENCES domains(id),
+        bucket INTEGER NOT NULL,
+        category_id INTEGER NOT NULL REFERENCES categories(id),
+        severity INTEGER NOT NULL,
+        first_seen INTEGER NOT NULL,
+        last_seen INTEGER NOT NULL,
+        hits INTEGER NOT NULL,
+        UNIQUE (source_id, domain_id, bucket)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_alerts_severity_seen ON alerts(severity, last_seen);
+    CREATE INDEX IF NOT EXISTS idx_alerts_source_severity_seen ON alerts(source_id, severity, last_seen);
+    CREATE INDEX IF NOT EXISTS idx_alerts_domain ON alerts(domain_id);
+"""
+
+_PARTITION_CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS partitions (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        period TEXT NOT NULL,
+        first_id INTEGER NOT NULL,
+        min_ts INTEGER,
+        max_ts INTEGER,
+        rows INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL DEFAULT 'active'
+    );
+"""
+
+# One partition file; {schema} is the name it is attached under. The
+# sources/domains/categories references point into the main database.
+_PARTITION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {schema}.dns_queries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        domain_id INTEGER NOT NULL,
+        qtype INTEGER NOT NULL DEFAULT 1,
+        response TEXT,
+        device_name TEXT,
+        category_id INTEGER,
+        severity INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE INDEX IF NOT EXISTS {schema}.idx_dns_ts ON dns_queries(ts);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_dns_source_ts ON dns_queries(source_id, ts);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_dns_domain_ts ON dns_queries(domain_id, ts);
+    -- Partial: only flagged rows, grouped by domain for /alerts. Queries must
+    -- repeat "severity >= 2" (ALERT_SEVERITY) verbatim for SQLite to use it.
+    CREATE INDEX IF NOT EXISTS {schema}.idx_dns_alert_domain_ts ON dns_queries(domain_id, ts) WHERE severity >= 2;
+    CREATE INDEX IF NOT EXISTS {schema}.idx_dns_category_ts ON dns_queries(category_id, ts)
+        WHERE category_id IS NOT NULL;
+"""
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS domains (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        reversed_name TEXT NOT NULL,
+        category_id INTEGER REFERENCES categories(id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_domains_category ON domains(category_id)
+        WHERE category_id IS NOT NULL;
+
+    CREATE TABLE IF NOT EXISTS sources (
+        id INTEGER PRIMARY KEY,
+        ip TEXT NOT NULL,
+        mac TEXT NOT NULL DEFAULT '',
+        UNIQUE (ip, mac)
+    );
+
+    CREATE TABLE IF NOT EXISTS devices (
+        ip TEXT PRIMARY KEY,
+        mac TEXT NOT NULL,
+        hostname TEXT DEFAULT '',
+        vendor TEXT DEFAULT '',
+        first_seen TEXT NOT NULL,
+        last_seen TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+""" + _ROLLUP_SCHEMA + _CATEGORY_SCHEMA + _ALERT_SCHEMA + _PARTITION_CATALOG_SCHEMA
+
+_HOUR_MS = 3600 * 1000
+_DAY_MS = 24 * _HOUR_MS
+_ALERT_WINDOW_MS = ALERT_WINDOW_HOURS * _HOUR_MS
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class InvalidDate(ValueError):
+    """Raised for a from/to filter that is not an ISO date or datetime."""
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor this server did not issue."""
+
+
+def _encode_cursor(*values: int) -> str:
+    """Opaque page cursor for a keyset position."""
+    raw = ",".join(str(v) for v in values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, size: int) -> List[int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = [int(v) for v in raw.decode().split(",")]
+    except ValueError:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    if len(values) != size:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    return values
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _to_ms(value: str) -> int:
+    """Parse an ISO date/datetime (UTC) into epoch milliseconds."""
+    try:
+        dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise InvalidDate(f"Invalid date: {value!r} (use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+
+def _since_ms(**delta) -> int:
+    """Epoch milliseconds for now minus a timedelta."""
+    return _now_ms() - int(timedelta(**delta).total_seconds() * 1000)
+
+
+def _iso(ts: int) -> str:
+    """Render epoch milliseconds in the log's ISO timestamp format."""
+    return (_EPOCH + timedelta(milliseconds=ts)).isoformat()
+
+
+def _qtype_code(name: str) -> int:
+    """Numeric code for a query type name ("AAAA", "TYPE65", "65")."""
+    code = QTYPE.reverse.get(name)
+    if code is not None:
+        return code
+    if name.startswith("TYPE"):
+        name = name[4:]
+    return int(name) if name.isdigit() else 0
+
+
+def _qtype_name(code: int) -> str:
+    """Query type name as the proxy logs it; dnslib spells unnamed types "TYPE65280"."""
+    return QTYPE[code]
+
+
+def _reverse_labels(name: str) -> str:
+    """www.example.com -> com.example.www"""
+    return ".".join(reversed(name.split(".")))
+
+
+def _category_of(name: str) -> Optional[str]:
+    cat = categorize_domain(name)
+    return cat["category"] if cat else None
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r["name"] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
 def init_db():
-    """Create tables if they don't exist."""
-    conn = get_conn()
-    conn.executescript("""
-        CREATE TABLE IF NOT EXISTS dns_queries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            source_ip TEXT NOT NULL,
-            source_mac TEXT DEFAULT '',
-            domain TEXT NOT NULL,
-            query_type TEXT DEFAULT 'A',
-            response TEXT DEFAULT '',
-            device_name TEXT DEFAULT ''
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_dns_timestamp ON dns_queries(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_dns_source_ip ON dns_queries(source_ip);
-        CREATE INDEX IF NOT EXISTS idx_dns_domain ON dns_queries(domain);
-
-        CREATE TABLE IF NOT EXISTS devices (
-            ip TEXT PRIMARY KEY,
-            mac TEXT NOT NULL,
-            hostname TEXT DEFAULT '',
-            vendor TEXT DEFAULT '',
-            first_seen TEXT NOT NULL,
-            last_seen TEXT NOT NULL
-        );
-    """)
+    """Create tables if they don't exist and migrate older databases."""
+    global _legacy_log
+    if DB_PARTITION_PERIOD not in ("month", "day"):
+        raise ValueError(f"Unknown DB_PARTITION_PERIOD: {DB_PARTITION_PERIOD}")
+    conn = get_conn()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    _legacy_log = bool(_table_columns(conn, "dns_queries"))
+    if version < SCHEMA_VERSION and _legacy_log:
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info(f"Migrating database to schema version {target}...")
+            _MIGRATIONS[target](conn)
+
+    conn.executescript(_SCHEMA)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    _init_search_index(conn)
     conn.commit()
 
+    # The newest partition's catalog figures may be ahead of it after a crash
+    newest = conn.execute(_SELECT_PARTITIONS + " LIMIT 1").fetchone()
+    if newest:
+        _recount_partition(conn, dict(newest))
+    _convert_gzip_archives(conn)
+    _load_query_counters(conn)
 
-def log_dns_query(source_ip: str, domain: str, query_type: str = "A",
-                  source_mac: str = "", response: str = "", device_name: str = ""):
-    """Insert a DNS query record."""
+
+def _migrate_v1(conn: sqlite3.Connection):
+    """
+    Rewrite dns_queries in place with integer columns: ISO text timestamps
+    become epoch milliseconds, and domains and source ip/mac pairs move into
+    dictionary tables. The database is compacted afterwards.
+    """
+    if "timestamp" not in _table_columns(conn, "dns_queries"):
+        return
+    conn.create_function("reverse_labels", 1, _reverse_labels, deterministic=True)
+    conn.create_function("qtype_code", 1, _qtype_code, deterministic=True)
+    conn.create_function("category_of", 1, _category_of, deterministic=True)
+
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        columns = _table_columns(conn, "domains")
+        if "reversed_name" not in columns:
+            conn.execute("ALTER TABLE domains ADD COLUMN reversed_name TEXT NOT NULL DEFAULT ''")
+        if "category" not in columns:
+            conn.execute("ALTER TABLE domains ADD COLUMN category TEXT")
+        conn.execute("INSERT OR IGNORE INTO domains (name) SELECT DISTINCT domain FROM dns_queries")
+        conn.execute("UPDATE domains SET reversed_name = reverse_labels(name), category = category_of(name)")
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                id INTEGER PRIMARY KEY,
+                ip TEXT NOT NULL,
+                mac TEXT NOT NULL DEFAULT '',
+                UNIQUE (ip, mac)
+            )
+        """)
+        conn.execute(
+            "INSERT OR IGNORE INTO sources (ip, mac) "
+            "SELECT DISTINCT source_ip, COALESCE(source_mac, '') FROM dns_queries"
+        )
+
+        conn.execute("""
+            CREATE TABLE dns_queries_v1 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts INTEGER NOT NULL,
+                source_id INTEGER NOT NULL REFERENCES sources(id),
+                domain_id INTEGER NOT NULL REFERENCES domains(id),
+                qtype INTEGER NOT NULL DEFAULT 1,
+                response TEXT,
+                device_name TEXT
+            )
+        """)
+        conn.execute("""
+            INSERT INTO dns_queries_v1 (id, ts, source_id, domain_id, qtype, response, device_name)
+            SELECT q.id,
+                   CAST(strftime('%s', substr(q.timestamp, 1, 19)) AS INTEGER) * 1000
+                     + CAST(substr(q.timestamp || '000', 21, 3) AS INTEGER),
+                   s.id, d.id, qtype_code(q.query_type),
+                   NULLIF(q.response, ''), NULLIF(q.device_name, '')
+            FROM dns_queries q
+            JOIN sources s ON s.ip = q.source_ip AND s.mac = COALESCE(q.source_mac, '')
+            JOIN domains d ON d.name = q.domain
+            ORDER BY q.id
+        """)
+        conn.execute("DROP TABLE dns_queries")
+        conn.execute("ALTER TABLE dns_queries_v1 RENAME TO dns_queries")
+        conn.execute("PRAGMA user_version = 1")
+
+    logger.info("Compacting database...")
+    conn.execute("VACUUM")
+
+
+def _migrate_v2(conn: sqlite3.Connection):
+    """Add the hourly rollup table and fill it from the existing log."""
+    conn.executescript(_ROLLUP_SCHEMA)
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    rebuild_rollups()
+
+
+def _migrate_v3(conn: sqlite3.Connection):
+    """Add category/severity columns and tag the existing log."""
+    conn.executescript(_CATEGORY_SCHEMA)
+    if "category_id" not in _table_columns(conn, "dns_queries"):
+        conn.execute("ALTER TABLE dns_queries ADD COLUMN category_id INTEGER REFERENCES categories(id)")
+        conn.execute("ALTER TABLE dns_queries ADD COLUMN severity INTEGER NOT NULL DEFAULT 0")
+    columns = _table_columns(conn, "domains")
+    if "category_id" not in columns:
+        conn.execute("ALTER TABLE domains ADD COLUMN category_id INTEGER REFERENCES categories(id)")
+    if "category" in columns:
+        conn.execute("ALTER TABLE domains DROP COLUMN category")
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    recategorize()
+
+
+def _migrate_v4(conn: sqlite3.Connection):
+    """Add the alerts table and fill it from the tagged log."""
+    conn.executescript(_ALERT_SCHEMA)
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    rebuild_alerts()
+
+
+def _migrate_v5(conn: sqlite3.Connection):
+    """Replace the per-source index with (source_id, ts) for keyset paging by device."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dns_source_ts ON dns_queries(source_id, ts)")
+    conn.execute("DROP INDEX IF EXISTS idx_dns_source")
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+
+
+def _migrate_v6(conn: sqlite3.Connection):
+    """Drop indexes no query uses; plan_check.py lists what each read relies on."""
+    conn.execute("DROP INDEX IF EXISTS idx_domains_reversed")
+    conn.execute("PRAGMA user_version = 6")
+    conn.commit()
+
+
+def _migrate_v7(conn: sqlite3.Connection):
+    """
+    Move dns_queries into per-period partition files, then compact. The log
+    is split at the first row of each period in time order, so partitions
+    keep ascending id ranges like those written from now on.
+    """
+    global _legacy_log
+    conn.executescript(_PARTITION_CATALOG_SCHEMA)
+    # Left by an attempt that stopped part way; the log is still all in main
+    for r in conn.execute("SELECT name FROM partitions").fetchall():
+        for path in (_partition_path(r["name"]), _partition_path(r["name"]) + "-wal"):
+            if os.path.exists(path):
+                os.remove(path)
+    conn.execute("DELETE FROM partitions")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dns_ts ON dns_queries(ts)")
+    conn.commit()
+
+    columns = "id, ts, source_id, domain_id, qtype, response, device_name, category_id, severity"
+    bounds = conn.execute("SELECT MIN(id) AS first, MAX(id) AS last, MIN(ts) AS lo FROM dns_queries").fetchone()
+    start = bounds["first"]
+    period = _period_of(bounds["lo"]) if start is not None else None
+    while start is not None and start <= bounds["last"]:
+        following = conn.execute(
+            "SELECT id, ts FROM dns_queries WHERE ts >= ? ORDER BY ts LIMIT 1", (_next_period_ms(period),)
+        ).fetchone()
+        end = max(following["id"], start) if following else bounds["last"] + 1
+        if end > start:
+            part = _create_partition(conn, period, start)
+            schema = _schema(conn, part)
+            with conn:
+                conn.execute(
+                    f"INSERT INTO {schema}.dns_queries ({columns}) "
+                    f"SELECT {columns} FROM main.dns_queries WHERE id >= ? AND id < ?", (start, end)
+                )
+            _recount_partition(conn, part)
+            logger.info(f"Moved queries {start}..{end - 1} into partition {part['name']}.")
+        if not following:
+            break
+        start, period = end, _period_of(following["ts"])
+
+    conn.execute("DROP TABLE dns_queries")
+    conn.execute("PRAGMA user_version = 7")
+    conn.commit()
+    _legacy_log = False
+    logger.info("Compacting database...")
+    conn.execute("VACUUM")
+
+
+_MIGRATIONS = {
+    1: _migrate_v1,
+    2: _migrate_v2,
+    3: _migrate_v3,
+    4: _migrate_v4,
+    5: _migrate_v5,
+    6: _migrate_v6,
+    7: _migrate_v7,
+}
+
+
+def _init_search_index(conn: sqlite3.Connection):
+    """Create the FTS5 trigram index over distinct domains, if SQLite supports it."""
+    global _fts_enabled
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'domains_fts'"
+    ).fetchone() is not None
+    try:
+        conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS domains_fts USING fts5(
+                name, content='domains', content_rowid='id', tokenize='trigram'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS domains_fts_ai AFTER INSERT ON domains BEGIN
+                INSERT INTO domains_fts(rowid, name) VALUES (new.id, new.name);
+            END;
+        """)
+        _fts_enabled = True
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 trigram index unavailable, /dns/search will scan: {e}")
+        _fts_enabled = False
+        return
+
+    # Index any dictionary entries that predate the FTS table
+    if not exists and conn.execute("SELECT 1 FROM domains LIMIT 1").fetchone():
+        rebuild_search_index()
+
+
+def rebuild_search_index() -> int:
+    """Rebuild the FTS index from the domain dictionary. Returns the number of domains."""
     conn = get_conn()
-    conn.execute(
-        "INSERT INTO dns_queries (timestamp, source_ip, source_mac, domain, query_type, response, device_name) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (datetime.utcnow().isoformat(), source_ip, source_mac, domain, query_type, response, device_name)
+    if not _fts_enabled:
+        raise RuntimeError("This SQLite build has no FTS5 trigram tokenizer.")
+    with conn:
+        conn.execute("INSERT INTO domains_fts(domains_fts) VALUES ('rebuild')")
+    return conn.execute("SELECT COUNT(*) AS cnt FROM domains").fetchone()["cnt"]
+
+
+# ── Partitions ──────────────────────────────────────────────
+# The query log lives in one SQLite file per DB_PARTITION_PERIOD, attached to
+# each connection when a read needs it; the main database keeps dictionaries,
+# rollups, alerts and the partitions catalog. Rows go into the partition of
+# the period they are written in, so ids increase from one partition to the
+# next and each covers [first_id, the next one's first_id). The catalog's
+# min_ts/max_ts, kept up to date by ingest, route time-range reads; they
+# only overlap a neighbour's for rows written late (replayed from the spill
+# file). Old periods are dropped a whole file at a time, or archived: turned
+# into a read-only columnar segment (segment.py) that reads scan in place.
+
+# Partitions attached per connection at once (SQLite's default limit is 10)
+_MAX_ATTACHED = 8
+
+_SELECT_PARTITIONS = (
+    "SELECT id, name, period, first_id, min_ts, max_ts, rows, state FROM partitions "
+    "WHERE state != 'dropped' ORDER BY id DESC"
+)
+
+_UPDATE_PARTITION_BOUNDS = (
+    "UPDATE partitions SET rows = rows + ?, "
+    "min_ts = MIN(COALESCE(min_ts, ?), ?), max_ts = MAX(COALESCE(max_ts, ?), ?) WHERE id = ?"
+)
+
+# Set while migrations read a log that predates partitions (main.dns_queries)
+_legacy_log = False
+_partition_lock = threading.Lock()
+
+
+def _period_of(ts: int) -> str:
+    """Partition period of an epoch-millisecond time: 2026-10 or 2026-10-17."""
+    day = _EPOCH + timedelta(milliseconds=ts)
+    return day.strftime("%Y-%m" if DB_PARTITION_PERIOD == "month" else "%Y-%m-%d")
+
+
+def _next_period_ms(period: str) -> int:
+    """Start of the period after this one, in epoch milliseconds."""
+    if len(period) == 7:
+        year, month = (int(v) for v in period.split("-"))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return _to_ms(f"{year:04d}-{month:02d}-01")
+    return _to_ms(period) + 24 * _HOUR_MS
+
+
+def _partition_dir() -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), DB_PARTITION_DIR)
+
+
+def _partition_path(name: str, kind: str = "live") -> str:
+    """A partition's database file, or its archive segment."""
+    if kind == "archive":
+        return os.path.join(_partition_dir(), f"dns_{name}.seg")
+    return os.path.join(_partition_dir(), f"dns_{name}.db")
+
+
+def _current_path(part: Dict) -> str:
+    """The file a partition is read from in its current state."""
+    return _partition_path(part["name"], "archive" if part["state"] == "archived" else "live")
+
+
+def _on(schema: str, sql: str) -> str:
+    """Point a dns_queries statement at one partition's table."""
+    return sql.replace("dns_queries", f"{schema}.dns_queries")
+
+
+def _attached(conn: sqlite3.Connection) -> "OrderedDict[str, str]":
+    """This connection's attached partition files: path -> schema, least recently used first."""
+    state = getattr(_local, "attached", None)
+    if state is None or state[0] is not conn:
+        state = _local.attached = (conn, OrderedDict())
+    return state[1]
+
+
+def _attach(conn: sqlite3.Connection, path: str, schema: str):
+    attached = _attached(conn)
+    while len(attached) >= _MAX_ATTACHED:
+        _detach(conn, next(iter(attached)))
+    read_only = getattr(_local, "read_only", False)
+    target = Path(path).resolve().as_uri() + "?mode=ro" if read_only else path
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (target,))
+    if not read_only:
+        conn.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+    attached[path] = schema
+
+
+def _detach(conn: sqlite3.Connection, path: str):
+    conn.execute(f"DETACH DATABASE {_attached(conn).pop(path)}")
+
+
+def _schema(conn: sqlite3.Connection, part: Dict) -> str:
+    """Schema name of a live partition on this connection, attaching it first."""
+    if part["state"] == "legacy":
+        return "main"
+    if part["state"] == "archived":
+        raise ValueError(f"Partition {part['name']} is archived; read it with _segment()")
+    path = _partition_path(part["name"])
+    attached = _attached(conn)
+    if path in attached:
+        attached.move_to_end(path)
+        return attached[path]
+    schema = f"p{part['id']}"
+    _attach(conn, path, schema)
+    return schema
+
+
+def _segment(part: Dict) -> Segment:
+    """This thread's reader of an archived partition's segment, opened on first use."""
+    segments = getattr(_local, "segments", None)
+    if segments is None:
+        segments = _local.segments = {}
+    path = _partition_path(part["name"], "archive")
+    if path not in segments:
+        segments[path] = Segment(path)
+    return segments[path]
+
+
+def _legacy_partition(conn: sqlite3.Connection) -> Dict:
+    """The pre-partition log in the main database, as a catalog entry."""
+    r = conn.execute("SELECT MIN(ts) AS lo, MAX(ts) AS hi, COALESCE(MAX(id), 0) AS last FROM dns_queries").fetchone()
+    return {"id": 0, "name": "main", "period": "", "first_id": 1,
+            "min_ts": r["lo"], "max_ts": r["hi"], "rows": r["last"], "state": "legacy"}
+
+
+def _partitions(conn: sqlite3.Connection, lo: Optional[int] = None, hi: Optional[int] = None,
+                above_id: Optional[int] = None, below_id: Optional[int] = None) -> List[Dict]:
+    """
+    Catalog entries of the partitions that can hold rows with ts in [lo, hi]
+    and id in (above_id, below_id), newest first. Also lets go of files this
+    thread no longer needs (partitions dropped or archived since).
+    """
+    if _legacy_log:
+        part = _legacy_partition(conn)
+        return [part] if part["min_ts"] is not None else []
+
+    parts = []
+    current = set()
+    next_first_id = None
+    for r in conn.execute(_SELECT_PARTITIONS).fetchall():
+        part = dict(r)
+        current.add(_current_path(part))
+        last_id = next_first_id - 1 if next_first_id is not None else None
+        next_first_id = part["first_id"]
+        if part["min_ts"] is None:
+            continue
+        if (lo is not None and part["max_ts"] < lo) or (hi is not None and part["min_ts"] > hi):
+            continue
+        if above_id is not None and last_id is not None and last_id <= above_id:
+            continue
+        if below_id is not None and part["first_id"] >= below_id:
+            continue
+        parts.append(part)
+
+    for path in [p for p in _attached(conn) if p not in current]:
+        _detach(conn, path)
+    segments = getattr(_local, "segments", {})
+    for path in [p for p in segments if p not in current]:
+        segments.pop(path).close()
+    return parts
+
+
+def _merge_partitions(parts: List[Dict], read: Callable[[Dict], List[sqlite3.Row]],
+                      limit: int, ascending: bool, key: Callable) -> List[sqlite3.Row]:
+    """
+    The first `limit` rows in key order (newest first unless ascending)
+    across partitions, given read(partition) returning each one's first
+    `limit`. Partitions are visited in the order their ranges start and the
+    walk stops at the first that cannot reach the rows already found.
+    """
+    by_ts = key is _by_ts_id
+    if by_ts:
+        parts = sorted(parts, key=lambda p: p["min_ts"] if ascending else -p["max_ts"])
+    elif ascending:
+        parts = parts[::-1]
+
+    rows = []
+    for part in parts:
+        if len(rows) >= limit:
+            if not by_ts:
+                break
+            last = rows[-1]["ts"]
+            if (part["min_ts"] > last) if ascending else (part["max_ts"] < last):
+                break
+        rows += read(part)
+        rows.sort(key=key, reverse=not ascending)
+        del rows[limit:]
+    return rows
+
+
+def _read_each(conn: sqlite3.Connection, query: str, params: list, limit: int, ascending: bool,
+               key: Callable, **filters) -> Callable[[Dict], List[sqlite3.Row]]:
+    """
+    read() for _merge_partitions: the same statement on each live partition,
+    and the same filters (see Segment.scan) on archived ones.
+    """
+    def read(part: Dict) -> List[sqlite3.Row]:
+        if part["state"] == "archived":
+            return _read_archived(conn, part, limit, ascending, key, **filters)
+        return conn.execute(_on(_schema(conn, part), query), params).fetchall()
+    return read
+
+
+def _read_archived(conn: sqlite3.Connection, part: Dict, limit: int, ascending: bool,
+                   key: Callable, **filters) -> List[Dict]:
+    """An archived partition's first `limit` matching rows in key order, shaped like _SELECT_EVENTS rows."""
+    rows = _segment(part).select(limit, by_id=key is _by_id, reverse=not ascending, **filters)
+    if not rows:
+        return []
+    sources = {r["id"]: r for r in conn.execute(
+        "SELECT id, ip, mac FROM sources WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted({r[2] for r in rows})),)
+    )}
+    domains = {r["id"]: r["name"] for r in conn.execute(
+        "SELECT id, name FROM domains WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted({r[3] for r in rows})),)
+    )}
+    categories = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM categories")}
+    return [
+        {
+            "id": row_id, "ts": ts,
+            "source_ip": sources[source_id]["ip"], "source_mac": sources[source_id]["mac"],
+            "domain": domains[domain_id], "qtype": qtype,
+            "response": response or "", "device_name": device_name or "",
+            "category": categories.get(category_id), "level": severity,
+        }
+        for row_id, ts, source_id, domain_id, qtype, response, device_name, category_id, severity in rows
+    ]
+
+
+def _partition_name_free(conn: sqlite3.Connection, name: str) -> bool:
+    """Whether neither the catalog nor any file in the partition directory uses a partition name."""
+    if conn.execute("SELECT 1 FROM partitions WHERE name = ?", (name,)).fetchone():
+        return False
+    live = _partition_path(name)
+    return not any(os.path.exists(path) for path in (live, live + "-wal", _partition_path(name, "archive")))
+
+
+def _create_partition(conn: sqlite3.Connection, period: str, first_id: int) -> Dict:
+    """Create the file and catalog entry of an empty partition whose ids start at first_id."""
+    name = period
+    if not _partition_name_free(conn, name):
+        # Written before, when DB_PARTITION_PERIOD was set differently, or a
+        # file the catalog doesn't know: another database's sharing the
+        # directory, or left behind by a deleted one. Its rows' ids would
+        # resolve against the wrong dictionaries, so it is never adopted.
+        if os.path.exists(_partition_path(name)) and not conn.execute(
+                "SELECT 1 FROM partitions WHERE name = ?", (name,)).fetchone():
+            logger.warning(f"Leaving {_partition_path(name)} alone: it is not in this database's catalog.")
+        name = f"{period}.{first_id}"
+        suffix = 1
+        while not _partition_name_free(conn, name):
+            suffix += 1
+            name = f"{period}.{first_id}.{suffix}"
+    os.makedirs(_partition_dir(), exist_ok=True)
+    path = _partition_path(name)
+    _attach(conn, path, "new_partition")
+    conn.executescript(_PARTITION_SCHEMA.format(schema="new_partition"))
+    conn.execute("PRAGMA new_partition.journal_mode=WAL")
+    with conn:
+        conn.execute("DELETE FROM new_partition.sqlite_sequence")
+        conn.execute(
+            "INSERT INTO new_partition.sqlite_sequence (name, seq) VALUES ('dns_queries', ?)", (first_id - 1,)
+        )
+    _detach(conn, path)
+    with conn:
+        part_id = conn.execute(
+            "INSERT INTO partitions (name, period, first_id) VALUES (?, ?, ?)", (name, period, first_id)
+        ).lastrowid
+    logger.info(f"Started partition {name} at query id {first_id}.")
+    return dict(conn.execute(
+        "SELECT id, name, period, first_id, min_ts, max_ts, rows, state FROM partitions WHERE id = ?", (part_id,)
+    ).fetchone())
+
+
+def _write_partition(conn: sqlite3.Connection) -> Dict:
+    """The partition rows written now belong to, started on the first write of each period."""
+    period = _period_of(_now_ms())
+    with _partition_lock:
+        newest = conn.execute(_SELECT_PARTITIONS + " LIMIT 1").fetchone()
+        if newest and newest["period"] == period:
+            return dict(newest)
+        first_id = 1
+        if newest:
+            schema = _schema(conn, dict(newest))
+            seq = conn.execute(f"SELECT seq FROM {schema}.sqlite_sequence WHERE name = 'dns_queries'").fetchone()
+            first_id = (seq["seq"] if seq else newest["first_id"] - 1) + 1
+        return _create_partition(conn, period, first_id)
+
+
+def _recount_partition(conn: sqlite3.Connection, part: Dict):
+    """Reset a partition's catalog row count and time bounds from its table."""
+    schema = _schema(conn, part)
+    rows = conn.execute(f"SELECT COUNT(*) AS cnt FROM {schema}.dns_queries").fetchone()["cnt"]
+    lo = conn.execute(f"SELECT MIN(ts) AS ts FROM {schema}.dns_queries").fetchone()["ts"]
+    hi = conn.execute(f"SELECT MAX(ts) AS ts FROM {schema}.dns_queries").fetchone()["ts"]
+    with conn:
+        conn.execute("UPDATE partitions SET rows = ?, min_ts = ?, max_ts = ? WHERE id = ?",
+                     (rows, lo, hi, part["id"]))
+
+
+def _segment_source(conn: sqlite3.Connection, schema: str) -> Iterator[tuple]:
+    """A partition's rows in segment order, streamed."""
+    cursor = conn.execute(f"SELECT {', '.join(SEGMENT_COLUMNS)} FROM {schema}.dns_queries ORDER BY ts, id")
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            return
+        yield from rows
+
+
+def _convert_gzip_archives(conn: sqlite3.Connection):
+    """Rewrite partitions archived as gzipped SQLite files (dns_<name>.db.gz) as segments."""
+    for r in conn.execute("SELECT name FROM partitions WHERE state = 'archived'").fetchall():
+        gz = os.path.join(_partition_dir(), f"dns_{r['name']}.db.gz")
+        if not os.path.exists(gz) or os.path.exists(_partition_path(r["name"], "archive")):
+            continue
+        copy = _partition_path(r["name"]) + ".restore"
+        with gzip.open(gz, "rb") as src, open(copy, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        _attach(conn, copy, "gz_archive")
+        try:
+            write_segment(_partition_path(r["name"], "archive"), _segment_source(conn, "gz_archive"))
+        finally:
+            _detach(conn, copy)
+        os.remove(copy)
+        os.remove(gz)
+        logger.info(f"Converted archived partition {r['name']} to a segment.")
+
+
+def _catalog_entry(conn: sqlite3.Connection, name: str) -> Dict:
+    row = conn.execute(
+        "SELECT id, name, period, first_id, min_ts, max_ts, rows, state FROM partitions WHERE name = ?", (name,)
+    ).fetchone()
+    if row is None or row["state"] == "dropped":
+        raise ValueError(f"No partition named {name!r}")
+    return dict(row)
+
+
+def list_partitions() -> List[Dict]:
+    """Every partition, newest first, with its time range, row count and size on disk."""
+    conn = get_conn()
+    result = []
+    for r in conn.execute(_SELECT_PARTITIONS).fetchall():
+        path = _current_path(dict(r))
+        files = [path, path + "-wal"]
+        result.append({
+            "name": r["name"],
+            "state": r["state"],
+            "rows": r["rows"],
+            "first_id": r["first_id"],
+            "from": _iso(r["min_ts"]) if r["min_ts"] is not None else None,
+            "to": _iso(r["max_ts"]) if r["max_ts"] is not None else None,
+            "bytes": sum(os.path.getsize(f) for f in files if os.path.exists(f)),
+        })
+    return result
+
+
+def archive_partition(name: str) -> Dict:
+    """
+    Convert a closed partition into a columnar segment, dns_<name>.seg, and
+    delete its database file. It stays readable: queries scan the segment
+    in place. Returns the sizes.
+    """
+    conn = get_conn()
+    # Keeps recategorize() from updating rows between the copy and the switch
+    with _recategorize_lock:
+        part = _catalog_entry(conn, name)
+        newest = conn.execute(_SELECT_PARTITIONS + " LIMIT 1").fetchone()
+        if part["state"] != "active":
+            raise ValueError(f"Partition {name} is already {part['state']}")
+        if part["id"] == newest["id"]:
+            raise ValueError(f"Partition {name} is still being written")
+
+        live = _partition_path(name)
+        archive = _partition_path(name, "archive")
+        started = time.perf_counter()
+        size = sum(os.path.getsize(f) for f in (live, live + "-wal") if os.path.exists(f))
+        written = write_segment(archive, _segment_source(conn, _schema(conn, part)))
+        if written["rows"] != part["rows"]:
+            logger.warning(f"Partition {name}: catalog counted {part['rows']} rows, archived {written['rows']}.")
+        with conn:
+            conn.execute("UPDATE partitions SET state = 'archived', rows = ? WHERE id = ?",
+                         (written["rows"], part["id"]))
+
+    sizes = {"name": name, "bytes": size, "archive_bytes": os.path.getsize(archive)}
+    logger.info(f"Archived partition {name}: {sizes['bytes']} -> {sizes['archive_bytes']} bytes "
+                f"in {time.perf_counter() - started:.1f}s.")
+    _sweep_partition_files(conn)
+    return sizes
+
+
+def _sweep_partition_files(conn: sqlite3.Connection):
+    """
+    Delete files no partition needs any more: those of dropped partitions
+    and the database file of archived ones. Windows will not delete a file
+    another thread still has open; those are retried on the next sweep.
+    """
+    _partitions(conn)
+    for r in conn.execute("SELECT id, name, state FROM partitions WHERE state != 'active'").fetchall():
+        live = _partition_path(r["name"])
+        paths = [live, live + "-wal", live + "-shm"]
+        if r["state"] == "dropped":
+            paths.append(_partition_path(r["name"], "archive"))
+
+        remaining = False
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                remaining = True
+        if r["state"] == "dropped" and not remaining:
+            with conn:
+                conn.execute("DELETE FROM partitions WHERE id = ?", (r["id"],))
+
+
+def apply_retention(retention_days: int = DB_RETENTION_DAYS,
+                    archive_after_days: int = DB_ARCHIVE_AFTER_DAYS) -> Dict:
+    """
+    Drop partitions whose newest row is older than retention_days and
+    archive those older than archive_after_days (0 disables either). The
+    partition being written is never touched, and the hourly rollups and
+    alerts of dropped periods are kept. Returns the partitions affected.
+    """
+    conn = get_conn()
+    dropped, archived = [], []
+    for part in [dict(r) for r in conn.execute(_SELECT_PARTITIONS).fetchall()][1:]:
+        newest_ts = part["max_ts"] or 0
+        if retention_days and newest_ts < _since_ms(days=retention_days):
+            with conn:
+                conn.execute("UPDATE partitions SET state = 'dropped' WHERE id = ?", (part["id"],))
+            logger.info(f"Dropped partition {part['name']} ({part['rows']} queries).")
+            dropped.append(part["name"])
+        elif archive_after_days and part["state"] == "active" and newest_ts < _since_ms(days=archive_after_days):
+            archive_partition(part["name"])
+            archived.append(part["name"])
+    _sweep_partition_files(conn)
+    if dropped:
+        recount_query_stats()
+    return {"dropped": dropped, "archived": archived}
+
+
+_maintenance_stop = threading.Event()
+_maintenance_thread: Optional[threading.Thread] = None
+
+
+def _maintenance_loop(interval: float):
+    while True:
+        try:
+            apply_retention()
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+        if _maintenance_stop.wait(interval):
+            return
+
+
+def start_partition_maintenance(interval: float = DB_MAINTENANCE_INTERVAL):
+    """Apply retention and archiving now and then every interval seconds, in the background."""
+    global _maintenance_thread
+    if _maintenance_thread and _maintenance_thread.is_alive():
+        return
+    _maintenance_stop.clear()
+    _maintenance_thread = threading.Thread(
+        target=_maintenance_loop, args=(interval,), name="db-partitions", daemon=True,
     )
-    conn.commit()
+    _maintenance_thread.start()
+
+
+def stop_partition_maintenance():
+    """Stop the background retention thread."""
+    _maintenance_stop.set()
+    if _maintenance_thread:
+        _maintenance_thread.join(timeout=30)
+
+
+# ── Ingest ──────────────────────────────────────────────────
+# Dictionary ids never change once assigned, so they are cached per process
+# together with the domain's category tag (cleared when recategorize() runs).
+_DICT_CACHE_MAX = 500000
+_domain_ids: Dict[str, tuple] = {}      # name -> (domain_id, category_id, severity)
+_source_ids: Dict[tuple, int] = {}
+_categories: Dict[str, tuple] = {}      # category name -> (category_id, severity)
+_category_names: Dict[int, str] = {}    # category_id -> name, for live events
+
+_UNTAGGED = (None, 0)
+_recategorize_lock = threading.Lock()
+
+_INSERT_DNS_QUERY = (
+    "INSERT INTO dns_queries (ts, source_id, domain_id, qtype, response, device_name, category_id, severity) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _chunks(items: list, size: int = 500):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _category_tag(conn: sqlite3.Connection, name: str) -> tuple:
+    """(category_id, severity) for a domain under the current categorizer."""
+    cat = categorize_domain(name)
+    if not cat:
+        return _UNTAGGED
+    tag = _categories.get(cat["category"])
+    if tag is None:
+        conn.execute(
+            "INSERT INTO categories (name, label, severity) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET label = excluded.label, severity = excluded.severity",
+            (cat["category"], cat["label"], cat["severity"])
+        )
+        row = conn.execute("SELECT id FROM categories WHERE name = ?", (cat["category"],)).fetchone()
+        tag = (row["id"], SEVERITY_LEVELS.get(cat["severity"], 0))
+        _categories[cat["category"]] = tag
+        _category_names[row["id"]] = cat["category"]
+    return tag
+
+
+def _lookup_domain_ids(conn: sqlite3.Connection, names: List[str]) -> Dict[str, tuple]:
+    found = {}
+    for chunk in _chunks(names):
+        marks = ",".join("?" * len(chunk))
+        for r in conn.execute(
+            "SELECT d.id, d.name, d.category_id, c.name AS category, c.severity FROM domains d "
+            f"LEFT JOIN categories c ON c.id = d.category_id WHERE d.name IN ({marks})",
+            chunk
+        ):
+            if r["category_id"] is not None:
+                _category_names[r["category_id"]] = r["category"]
+            found[r["name"]] = (r["id"], r["category_id"], SEVERITY_LEVELS.get(r["severity"], 0))
+    _domain_ids.update(found)
+    return found
+
+
+def _resolve_domain_ids(conn: sqlite3.Connection, names: set) -> Dict[str, tuple]:
+    """(domain_id, category_id, severity) for domain names, registering and tagging new ones."""
+    if len(_domain_ids) > _DICT_CACHE_MAX:
+        _domain_ids.clear()
+    # Built locally: recategorize() may clear the shared cache from another thread
+    found = {}
+    for n in names:
+        info = _domain_ids.get(n)
+        if info:
+            found[n] = info
+    missing = [n for n in names if n not in found]
+    if missing:
+        found.update(_lookup_domain_ids(conn, missing))
+        new = [n for n in missing if n not in found]
+        if new:
+            conn.executemany(
+                "INSERT OR IGNORE INTO domains (name, reversed_name, category_id) VALUES (?, ?, ?)",
+                [(n, _reverse_labels(n), _category_tag(conn, n)[0]) for n in new]
+            )
+            found.update(_lookup_domain_ids(conn, new))
+    return found
+
+
+def _resolve_source_ids(conn: sqlite3.Connection, pairs: set) -> Dict[tuple, int]:
+    """Dictionary ids for (ip, mac) sources, registering new ones."""
+    if len(_source_ids) > _DICT_CACHE_MAX:
+        _source_ids.clear()
+    for ip, mac in pairs:
+        if (ip, mac) in _source_ids:
+            continue
+        conn.execute("INSERT OR IGNORE INTO sources (ip, mac) VALUES (?, ?)", (ip, mac))
+        row = conn.execute("SELECT id FROM sources WHERE ip = ? AND mac = ?", (ip, mac)).fetchone()
+        _source_ids[(ip, mac)] = row["id"]
+    return _source_ids
+
+
+def _write_rows(conn: sqlite3.Connection, rows: List[tuple]) -> List[Dict]:
+    """
+    Commit rows to the current partition in one transaction and count them
+    for /status; returns their live-feed events.
+    """
+    part = _write_partition(conn)
+    # Attached before the transaction starts; SQLite cannot attach inside one
+    schema = _schema(conn, part)
+    with _query_counters.lock:
+        with conn:
+            last_id, events = _insert_dns_rows(conn, rows, schema, part["id"])
+        _query_counters.add(rows, last_id)
+    if _query_counters.save_due():
+        # The rows are committed; a failed save is tried again on a later batch
+        try:
+            _query_counters.save(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save query counters: {e}")
+    return events
+
+
+def _forget_dictionary_ids():
+    """
+    Drop the cached dictionary ids after a write transaction rolled back:
+    ids it assigned no longer exist and may be handed to other names.
+    """
+    _domain_ids.clear()
+    _source_ids.clear()
+    _categories.clear()
+
 
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    """Whether a write failed only because another connection held the database."""
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(e) or "busy" in str(e)
 
-def get_recent_queries(limit: int = 100, offset: int = 0) -> List[Dict]:
-    """Get most recent DNS queries."""
+
+def _insert_dns_rows(conn: sqlite3.Connection, rows: List[tuple], schema: str, partition_id: int) -> tuple:
+    """
+    Insert query rows given as (ts_ms, source_ip, source_mac, domain,
+    query_type, response, device_name) into a partition, resolving
+    dictionary ids and the domain's category tag first. Returns the last
+    id assigned and the rows as live-feed events (only built while someone
+    is subscribed); publish them once committed.
+    """
+    domains = _resolve_domain_ids(conn, {r[3] for r in rows})
+    source_ids = _resolve_source_ids(conn, {(r[1], r[2] or "") for r in rows})
+    values = []
+    for r in rows:
+        domain_id, category_id, severity = domains[r[3]]
+        values.append((r[0], source_ids[(r[1], r[2] or "")], domain_id,
+                       _qtype_code(r[4]), r[5] or None, r[6] or None, category_id, severity))
+    conn.executemany(_on(schema, _INSERT_DNS_QUERY), values)
+    # AUTOINCREMENT ids inside one write transaction are consecutive
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    lo = min(v[0] for v in values)
+    hi = max(v[0] for v in values)
+    conn.execute(_UPDATE_PARTITION_BOUNDS, (len(values), lo, lo, hi, hi, partition_id))
+    _update_rollups(conn, values)
+    _update_alerts(conn, values)
+
+    if not live_feed.has_subscribers:
+        return last_id, []
+    first_id = last_id - len(values) + 1
+    return last_id, [
+        {
+            "id": first_id + i,
+            "timestamp": _iso(v[0]),
+            "source_ip": r[1],
+            "source_mac": r[2] or "",
+            "domain": r[3],
+            "query_type": _qtype_name(v[3]),
+            "response": r[5] or "",
+            "device_name": r[6] or "",
+            "category": _category_names.get(v[6]),
+            "severity": _SEVERITY_NAMES.get(v[7]),
+        }
+        for i, (r, v) in enumerate(zip(rows, values))
+    ]
+
+
+_INSERT_ROLLUP = "INSERT INTO hourly_device_domain_counts (hour, source_id, domain_id, count, first_seen, last_seen) "
+
+_ROLLUP_CONFLICT = (
+    " ON CONFLICT (source_id, hour, domain_id) DO UPDATE SET "
+    "count = count + excluded.count, "
+    "first_seen = MIN(first_seen, excluded.first_seen), "
+    "last_seen = MAX(last_seen, excluded.last_seen)"
+)
+
+_UPSERT_ROLLUP = _INSERT_ROLLUP + "VALUES (?, ?, ?, ?, ?, ?)" + _ROLLUP_CONFLICT
+
+
+def _update_rollups(conn: sqlite3.Connection, values: List[tuple]):
+    """Fold freshly inserted rows (ts, source_id, domain_id, ...) into the hourly rollups."""
+    counts = {}
+    for ts, source_id, domain_id, *_ in values:
+        key = (ts // _HOUR_MS, source_id, domain_id)
+        agg = counts.get(key)
+        if agg:
+            agg[0] += 1
+            agg[1] = min(agg[1], ts)
+            agg[2] = max(agg[2], ts)
+        else:
+            counts[key] = [1, ts, ts]
+    conn.executemany(_UPSERT_ROLLUP, [key + tuple(agg) for key, agg in counts.items()])
+
+
+_INSERT_ALERT = (
+    "INSERT INTO alerts (source_id, domain_id, bucket, category_id, severity, first_seen, last_seen, hits) "
+)
+
+_ALERT_CONFLICT = (
+    " ON CONFLICT (source_id, domain_id, bucket) DO UPDATE SET "
+    "category_id = excluded.category_id, "
+    "severity = excluded.severity, "
+    "first_seen = MIN(first_seen, excluded.first_seen), "
+    "last_seen = MAX(last_seen, excluded.last_seen), "
+    "hits = hits + excluded.hits"
+)
+
+_UPSERT_ALERT = _INSERT_ALERT + "VALUES (?, ?, ?, ?, ?, ?, ?, ?)" + _ALERT_CONFLICT
+
+# Alert rows recomputed from the log; callers append a domain filter
+_SELECT_ALERT_ROWS = (
+    "SELECT source_id, domain_id, ts / ?, MAX(category_id), MAX(severity), MIN(ts), MAX(ts), COUNT(*) "
+    "FROM dns_queries WHERE severity >= 2"
+)
+
+
+def _update_alerts(conn: sqlite3.Connection, values: List[tuple]):
+    """Fold freshly inserted flagged rows into their (device, domain, window) alerts."""
+    alerts = {}
+    for ts, source_id, domain_id, _qtype, _response, _device, category_id, severity in values:
+        if severity < ALERT_SEVERITY:
+            continue
+        key = (source_id, domain_id, ts // _ALERT_WINDOW_MS)
+        agg = alerts.get(key)
+        if agg:
+            agg[2] = min(agg[2], ts)
+            agg[3] = max(agg[3], ts)
+            agg[4] += 1
+        else:
+            alerts[key] = [category_id, severity, ts, ts, 1]
+    if alerts:
+        conn.executemany(_UPSERT_ALERT, [key + tuple(agg) for key, agg in alerts.items()])
+
+
+def _retained_bucket(parts: List[Dict]) -> Optional[int]:
+    """First alert window with rows still in the log; older alerts outlive dropped partitions."""
+    return min(p["min_ts"] for p in parts) // _ALERT_WINDOW_MS if parts else None
+
+
+def _insert_partition_alerts(conn: sqlite3.Connection, part: Dict, domain_ids: Optional[List[int]] = None):
+    """Fold one partition's flagged rows (optionally for some domains) into the alerts table."""
+    if part["state"] == "archived":
+        flagged = _segment(part).scan(("ts", "source_id", "domain_id", "qtype", "response", "device_name",
+                                       "category_id", "severity"),
+                                      domain_ids=domain_ids, min_severity=ALERT_SEVERITY)
+        for rows in flagged:
+            with conn:
+                _update_alerts(conn, rows)
+        return
+    schema = _schema(conn, part)
+    query = _INSERT_ALERT + _on(schema, _SELECT_ALERT_ROWS)
+    params: list = [_ALERT_WINDOW_MS]
+    if domain_ids is not None:
+        query += f" AND domain_id IN ({','.join('?' * len(domain_ids))})"
+        params += domain_ids
+    params.append(_ALERT_WINDOW_MS)
+    with conn:
+        # Windows can span partitions, so each one's counts are merged in
+        conn.execute(query + " GROUP BY source_id, domain_id, ts / ?" + _ALERT_CONFLICT, params)
+
+
+def _rebuild_domain_alerts(conn: sqlite3.Connection, domain_ids: List[int]):
+    """Recompute the alerts of some domains after their rows were re-tagged."""
+    parts = _partitions(conn)
+    if not parts:
+        return
+    for chunk in _chunks(domain_ids):
+        marks = ",".join("?" * len(chunk))
+        with conn:
+            conn.execute(
+                f"DELETE FROM alerts WHERE domain_id IN ({marks}) AND bucket >= ?", chunk + [_retained_bucket(parts)]
+            )
+        for part in parts:
+            _insert_partition_alerts(conn, part, chunk)
+
+
+def rebuild_alerts() -> int:
+    """
+    Recompute the alerts table from the tagged log, a partition at a time.
+    Alerts from before the oldest retained row are kept. Returns the number
+    of alerts.
+    """
     conn = get_conn()
-    rows = conn.execute(
-        "SELECT * FROM dns_queries ORDER BY id DESC LIMIT ? OFFSET ?",
-        (limit, offset)
-    ).fetchall()
-    return [dict(r) for r in rows]
+    parts = _partitions(conn)
+    if parts:
+        with conn:
+            conn.execute("DELETE FROM alerts WHERE bucket >= ?", (_retained_bucket(parts),))
+        for part in parts:
+            _insert_partition_alerts(conn, part)
+    logger.info("Alerts rebuilt.")
+    return conn.execute("SELECT COUNT(*) AS cnt FROM alerts").fetchone()["cnt"]
 
 
-def search_queries(term: str, limit: int = 200,
-                   from_date: Optional[str] = None,
-                   to_date: Optional[str] = None) -> List[Dict]:
-    """Search DNS queries by domain substring."""
+def rebuild_rollups() -> int:
+    """
+    Recompute the hourly rollups from raw rows, one day per transaction so a
+    running agent can keep writing. Hours before the oldest retained row are
+    kept: they summarize dropped partitions. Returns the number of rollup rows.
+    """
+    conn = get_conn()
+    parts = _partitions(conn)
+    if not parts:
+        return conn.execute("SELECT COUNT(*) AS cnt FROM hourly_device_domain_counts").fetchone()["cnt"]
+
+    day_hours = 24
+    hour = min(p["min_ts"] for p in parts) // _HOUR_MS
+    last_hour = max(p["max_ts"] for p in parts) // _HOUR_MS
+    with conn:
+        conn.execute("DELETE FROM hourly_device_domain_counts WHERE hour > ?", (last_hour,))
+    while hour <= last_hour:
+        end = hour + day_hours
+        lo, hi = hour * _HOUR_MS, end * _HOUR_MS
+        overlapping = [p for p in parts if p["min_ts"] < hi and p["max_ts"] >= lo]
+        # Attached up front: SQLite cannot attach inside the transaction
+        schemas = [_schema(conn, p) for p in overlapping if p["state"] != "archived"]
+        with conn:
+            conn.execute("DELETE FROM hourly_device_domain_counts WHERE hour >= ? AND hour < ?", (hour, end))
+            for part in overlapping:
+                if part["state"] == "archived":
+                    for rows in _segment(part).scan(("ts", "source_id", "domain_id"), lo=lo, hi=hi - 1):
+                        _update_rollups(conn, rows)
+            for schema in schemas:
+                conn.execute(
+                    _INSERT_ROLLUP + _on(schema,
+                        "SELECT ts / ?, source_id, domain_id, COUNT(*), MIN(ts), MAX(ts) FROM dns_queries "
+                        "WHERE ts >= ? AND ts < ? GROUP BY ts / ?, source_id, domain_id"
+                    ) + _ROLLUP_CONFLICT,
+                    (_HOUR_MS, lo, hi, _HOUR_MS)
+                )
+        hour = end
+    logger.info("Hourly rollups rebuilt.")
+    return conn.execute("SELECT COUNT(*) AS cnt FROM hourly_device_domain_counts").fetchone()["cnt"]
+
+
+def recategorize(batch: int = 1000) -> int:
+    """
+    Re-tag domains, and every row logged for them, with the current
+    categorizer (after category lists or severities change). Works in small
+    transactions so a running agent keeps writing. Returns the number of
+    domains whose category changed.
+    """
+    with _recategorize_lock:
+        return _recategorize(batch)
+
+
+def _recategorize(batch: int) -> int:
     conn = get_conn()
-    query = "SELECT * FROM dns_queries WHERE domain LIKE ?"
-    params: list = [f"%{term}%"]
+    old_severity = {r["id"]: r["severity"] for r in conn.execute("SELECT id, severity FROM categories")}
+    _categories.clear()
+
+    changed = []
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, name, category_id FROM domains WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        with conn:
+            updates = []
+            for r in rows:
+                category_id, severity = _category_tag(conn, r["name"])
+                if category_id != r["category_id"]:
+                    updates.append((category_id, r["id"]))
+                    changed.append((category_id, severity, r["id"]))
+            conn.executemany("UPDATE domains SET category_id = ? WHERE id = ?", updates)
+
+    # Rows written from here on pick up the new domain tags
+    _domain_ids.clear()
+
+    # Archived partitions are read-only and keep the tags they were written with
+    parts = [p for p in _partitions(conn) if p["state"] != "archived"]
+    for part in parts:
+        schema = _schema(conn, part)
+        for chunk in _chunks(changed, 100):
+            with conn:
+                conn.executemany(
+                    _on(schema, "UPDATE dns_queries SET category_id = ?, severity = ? WHERE domain_id = ?"), chunk
+                )
+    affected = {domain_id for _, _, domain_id in changed}
+
+    for category_id, severity in _categories.values():
+        if category_id in old_severity and SEVERITY_LEVELS.get(old_severity[category_id], 0) != severity:
+            for part in parts:
+                schema = _schema(conn, part)
+                with conn:
+                    conn.execute(
+                        _on(schema, "UPDATE dns_queries SET severity = ? WHERE category_id = ?"),
+                        (severity, category_id)
+                    )
+            affected.update(
+                r["id"] for r in conn.execute("SELECT id FROM domains WHERE category_id = ?", (category_id,))
+            )
+
+    if _table_columns(conn, "alerts"):  # absent while migrating to v3
+        _rebuild_domain_alerts(conn, sorted(affected))
+
+    logger.info(f"Recategorized: {len(changed)} domains changed category.")
+    return len(changed)
+
+
+def log_dns_query(source_ip: str, domain: str, query_type: str = "A",
+                  source_mac: str = "", response: str = "", device_name: str = ""):
+    """Record a DNS query. Queued for the batch writer when it is running."""
+    row = (_now_ms(), source_ip, source_mac, domain, query_type, response, device_name)
+    if _writer and _writer.is_running:
+        _writer.submit(row)
+        return
+    events = _write_rows(get_conn(), [row])
+    live_feed.publish(events)
+
+
+def log_dns_queries(rows: List[tuple]):
+    """
+    Record DNS queries stamped elsewhere (proxy worker processes), as
+    (ts_ms, source_ip, source_mac, domain, query_type, response, device_name)
+    rows. Queued for the batch writer when it is running.
+    """
+    if _writer and _writer.is_running:
+        for row in rows:
+            _writer.submit(row)
+        return
+    events = _write_rows(get_conn(), rows)
+    live_feed.publish(events)
+
+
+class DNSLogWriter:
+    """
+    Single writer thread for DNS query rows.
+    Capture threads only enqueue; rows are committed with executemany in one
+    transaction every LOG_BATCH_SIZE rows or LOG_FLUSH_INTERVAL_MS. A batch
+    that finds the database locked (maintenance, a rollup rebuild) is
+    retried with backoff, then spilled to disk and written back later.
+    """
+
+    _STOP = object()
+
+    # Attempts after the first for a batch that finds the database locked,
+    # each after SQLite's own 5s busy wait and a pause of _RETRY_DELAY
+    # seconds, doubling each time
+    _RETRIES = 3
+    _RETRY_DELAY = 0.1
+
+    def __init__(self, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval_ms: int = LOG_FLUSH_INTERVAL_MS,
+                 queue_size: int = LOG_QUEUE_SIZE,
+                 overflow_policy: str = LOG_OVERFLOW_POLICY,
+                 spill_path: str = LOG_SPILL_PATH):
+        if overflow_policy not in ("block", "drop_oldest", "spill"):
+            raise ValueError(f"Unknown LOG_OVERFLOW_POLICY: {overflow_policy}")
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.overflow_policy = overflow_policy
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._running = False
 
+        # Monitoring counters
+        self.rows_written = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.retries = 0
+
+    # ── producer side ──
+
+    def submit(self, row: tuple):
+        """Queue a row, applying the overflow policy if the queue is full."""
+        if self.overflow_policy == "block":
+            self._queue.put(row)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(row)
+                return
+            except queue.Full:
+                pass
+
+            if self.overflow_policy == "spill":
+                self._spill([row])
+                return
+
+            # drop_oldest
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def _spill(self, rows: List[tuple]):
+        """Append overflow rows to the spill file."""
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+            self.spilled += len(rows)
+
+    # ── writer side ──
+
+    def _flush(self, conn: sqlite3.Connection, batch: List[tuple]):
+        """Commit a batch in a single transaction, retrying while the database is locked."""
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                events = _write_rows(conn, batch)
+                break
+            except sqlite3.OperationalError as e:
+                _forget_dictionary_ids()
+                if not _is_busy(e):
+                    self.failed += len(batch)
+                    logger.error(f"Failed to write {len(batch)} DNS queries: {e}")
+                    return
+                if attempt == self._RETRIES:
+                    logger.warning(f"Database still locked; spilling {len(batch)} DNS queries to write later.")
+                    self._spill(batch)
+                    return
+                time.sleep(self._RETRY_DELAY * 2 ** attempt)
+                attempt += 1
+                self.retries += 1
+            except Exception as e:
+                _forget_dictionary_ids()
+                self.failed += len(batch)
+                logger.error(f"Failed to write {len(batch)} DNS queries: {e}")
+                return
+        live_feed.publish(events)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.rows_written += len(batch)
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    def _replay_spill(self, conn: sqlite3.Connection):
+        """Write back rows spilled to disk while the queue was full."""
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            replay_path = self.spill_path + ".replay"
+            os.replace(self.spill_path, replay_path)
+
+        batch = []
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    if isinstance(row[0], str):
+                        # Spilled before the schema stored epoch milliseconds
+                        row[0] = _to_ms(row[0])
+                except ValueError:
+                    continue
+                batch.append(tuple(row))
+                if len(batch) >= self.batch_size:
+                    self._flush(conn, batch)
+                    batch = []
+        if batch:
+            self._flush(conn, batch)
+        os.remove(replay_path)
+        logger.info("Replayed spilled DNS queries.")
+
+    def _run(self):
+        """Collect rows into batches and commit them until stopped."""
+        conn = get_conn()
+        self._replay_spill(conn)
+        stopping = False
+
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._replay_spill(conn)
+                continue
+            if first is self._STOP:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is self._STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            self._flush(conn, batch)
+
+        # Drain whatever producers managed to queue after the stop marker
+        batch = []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not self._STOP:
+                batch.append(row)
+        if batch:
+            self._flush(conn, batch)
+        self._replay_spill(conn)
+
+    def start(self):
+        """Start the writer thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="dns-log-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"DNS log writer started (batch {self.batch_size} rows / "
+                    f"{int(self.flush_interval * 1000)} ms, overflow: {self.overflow_policy}).")
+
+    def stop(self):
+        """Flush everything queued and stop the writer thread."""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(self._STOP)
+        self._thread.join(timeout=30)
+        logger.info(f"DNS log writer stopped ({self.rows_written} rows written).")
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def stats(self) -> Dict:
+        """Queue depth, batch size and flush latency for monitoring."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            "overflow_policy": self.overflow_policy,
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(self.rows_written / self.batches, 1) if self.batches else 0.0,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 2) if self.batches else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+
+_writer: Optional[DNSLogWriter] = None
+
+
+def start_log_writer():
+    """Start the shared DNS log writer."""
+    global _writer
+    if _writer and _writer.is_running:
+        return
+    _writer = DNSLogWriter()
+    _writer.start()
+
+
+def stop_log_writer():
+    """Flush pending DNS queries, stop the shared writer and save the /status counters."""
+    if _writer:
+        _writer.stop()
+    _query_counters.save(get_conn())
+
+
+def get_log_writer_stats() -> Optional[Dict]:
+    """Stats for the shared DNS log writer, or None if it is not running."""
+    return _writer.stats() if _writer and _writer.is_running else None
+
+
+# ── Status counters ─────────────────────────────────────────
+# /status figures are kept in memory by ingest rather than counted from the
+# log: total queries, queries since UTC midnight and the device IPs seen.
+# They are saved to meta every DB_STATS_SAVE_INTERVAL seconds together with
+# the newest query id they include; startup folds in anything logged after
+# that id and checks the total against the partition catalog.
+_QUERY_STATS_KEY = "query_stats"
+
+
+class QueryCounters:
+    """Running totals for /status. `lock` also orders ingest commits against recounts."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.total = 0
+        self.day = 0            # UTC epoch day `today` counts
+        self.today = 0
+        self.devices = set()
+        self.as_of_id = 0       # newest query id included
+        self._saved_at = 0.0
+
+    def _roll(self, day: int):
+        if day != self.day:
+            self.day, self.today = day, 0
+
+    def add(self, rows: List[tuple], last_id: int):
+        """Count committed rows given as (ts_ms, source_ip, ...)."""
+        day = _now_ms() // _DAY_MS
+        start = day * _DAY_MS
+        with self.lock:
+            self._roll(day)
+            self.total += len(rows)
+            self.today += sum(1 for r in rows if r[0] >= start)
+            self.devices.update(r[1] for r in rows)
+            self.as_of_id = max(self.as_of_id, last_id)
+
+    def reset(self, total: int, today: int, devices: set, as_of_id: int):
+        with self.lock:
+            self.total, self.today, self.devices, self.as_of_id = total, today, devices, as_of_id
+            self.day = _now_ms() // _DAY_MS
+
+    def load(self, state: Dict):
+        with self.lock:
+            self.total, self.day, self.today = state["total"], state["day"], state["today"]
+            self.devices, self.as_of_id = set(state["devices"]), state["as_of_id"]
+
+    def save(self, conn: sqlite3.Connection):
+        with self.lock:
+            state = json.dumps({"total": self.total, "day": self.day, "today": self.today,
+                                "devices": sorted(self.devices), "as_of_id": self.as_of_id})
+        with conn:
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                         (_QUERY_STATS_KEY, state))
+        self._saved_at = time.monotonic()
+
+    def save_due(self) -> bool:
+        return time.monotonic() - self._saved_at >= DB_STATS_SAVE_INTERVAL
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            self._roll(_now_ms() // _DAY_MS)
+            return {
+                "total_queries": self.total,
+                "queries_today": self.today,
+                "unique_devices": len(self.devices),
+            }
+
+
+_query_counters = QueryCounters()
+
+
+def _load_query_counters(conn: sqlite3.Connection):
+    """
+    Restore the saved counters and fold in queries logged after them. Falls
+    back to a full recount when nothing was saved, when the gap reaches into
+    an archived partition, or when the total disagrees with the catalog.
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (_QUERY_STATS_KEY,)).fetchone()
+    if row is None:
+        logger.info("No saved query counters; counting the log.")
+        recount_query_stats()
+        return
+    _query_counters.load(json.loads(row["value"]))
+    as_of_id = _query_counters.as_of_id
+    missed = 0
+    for part in _partitions(conn, above_id=as_of_id):
+        if part["state"] == "archived":
+            logger.warning(f"Saved query counters predate archived partition {part['name']}; recounting.")
+            recount_query_stats()
+            return
+        cursor = conn.execute(_on(_schema(conn, part),
+            "SELECT q.ts, s.ip, q.id FROM dns_queries q JOIN sources s ON s.id = q.source_id "
+            "WHERE q.id > ? ORDER BY q.id"), (as_of_id,))
+        while rows := cursor.fetchmany(10000):
+            _query_counters.add(rows, rows[-1][2])
+            missed += len(rows)
+    catalog = sum(p["rows"] for p in _partitions(conn))
+    if _query_counters.total != catalog:
+        logger.warning(f"Saved query counters disagree with the log "
+                       f"({_query_counters.total} vs {catalog} queries); recounting.")
+        recount_query_stats()
+        return
+    if missed:
+        logger.info(f"Query counters caught up on {missed} queries logged since they were saved.")
+    _query_counters.save(conn)
+
+
+def recount_query_stats() -> Dict:
+    """
+    Recount the /status figures from the log and save them. Run at startup
+    when the saved counters can't be trusted and after retention drops
+    partitions; ingest waits while it runs. Returns the new figures.
+    """
+    conn = get_conn()
+    with _query_counters.lock:
+        parts = _partitions(conn)
+        total = sum(p["rows"] for p in parts)
+        today = _now_ms() // _DAY_MS * _DAY_MS
+        today_count = 0
+        for part in _partitions(conn, lo=today):
+            if part["state"] == "archived":
+                today_count += sum(len(rows) for rows in _segment(part).scan(("ts",), lo=today))
+                continue
+            today_count += conn.execute(
+                _on(_schema(conn, part), "SELECT COUNT(*) as cnt FROM dns_queries WHERE ts >= ?"),
+                (today,)
+            ).fetchone()["cnt"]
+        device_ips = set()
+        archived_sources = set()
+        for part in parts:
+            if part["state"] == "archived":
+                archived_sources.update(_segment(part).source_ids)
+                continue
+            device_ips.update(r["ip"] for r in conn.execute(_on(_schema(conn, part),
+                "SELECT DISTINCT s.ip FROM sources s "
+                "WHERE EXISTS (SELECT 1 FROM dns_queries q WHERE q.source_id = s.id)"
+            )))
+        if archived_sources:
+            device_ips.update(r["ip"] for r in conn.execute(
+                "SELECT DISTINCT ip FROM sources WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted(archived_sources)),)
+            ))
+        _query_counters.reset(total, today_count, device_ips, get_last_query_id())
+        _query_counters.save(conn)
+        return _query_counters.snapshot()
+
+
+# ── Queries ─────────────────────────────────────────────────
+# Rows are rebuilt in the original dns_queries column order and formats.
+_SELECT_QUERIES = (
+    "SELECT q.id, q.ts, s.ip AS source_ip, s.mac AS source_mac, d.name AS domain, q.qtype, "
+    "COALESCE(q.response, '') AS response, COALESCE(q.device_name, '') AS device_name "
+    "FROM dns_queries q "
+    "JOIN sources s ON s.id = q.source_id "
+    "JOIN domains d ON d.id = q.domain_id"
+)
+
+# Source ids for a device IP (one per MAC it was seen with)
+_SOURCE_IDS_FOR_IP = "SELECT id FROM sources WHERE ip = ?"
+
+
+def _query_row(r: sqlite3.Row) -> Dict:
+    return {
+        "id": r["id"],
+        "timestamp": _iso(r["ts"]),
+        "source_ip": r["source_ip"],
+        "source_mac": r["source_mac"],
+        "domain": r["domain"],
+        "query_type": _qtype_name(r["qtype"]),
+        "response": r["response"],
+        "device_name": r["device_name"],
+    }
+
+
+def _date_filters(query: str, params: list,
+                  from_date: Optional[str], to_date: Optional[str]) -> str:
     if from_date:
-        query += " AND timestamp >= ?"
-        params.append(from_date)
+        query += " AND q.ts >= ?"
+        params.append(_to_ms(from_date))
     if to_date:
-        query += " AND timestamp <= ?"
-        params.append(to_date)
+        query += " AND q.ts <= ?"
+        params.append(_to_ms(to_date))
+    return query
 
-    query += " ORDER BY id DESC LIMIT ?"
-    params.append(limit)
 
-    rows = conn.execute(query, params).fetchall()
-    return [dict(r) for r in rows]
+def _page_bound(before_id: Optional[str], after_id: Optional[str], size: int):
+    """Decode a before_id/after_id cursor into (keyset values, ascending)."""
+    if before_id and after_id:
+        raise InvalidCursor("Pass before_id or after_id, not both")
+    if after_id:
+        return _decode_cursor(after_id, size), True
+    if before_id:
+        return _decode_cursor(before_id, size), False
+    return None, False
 
 
-def get_queries_by_device(ip: str, limit: int = 200,
-                          from_date: Optional[str] = None,
-                          to_date: Optional[str] = None) -> List[Dict]:
-    """Get DNS queries from a specific device IP."""
+def _query_page(rows: List[sqlite3.Row], limit: int, ascending: bool,
+                key: Callable, after_id: Optional[str] = None) -> Dict:
+    """
+    A page of queries, newest first, with cursors to its neighbours:
+    next_cursor (pass as before_id) for older rows, prev_cursor (pass as
+    after_id) for newer ones.
+    """
+    rows = rows[:limit]
+    if ascending:
+        rows.reverse()
+    older = rows and (ascending or len(rows) >= limit)
+    return {
+        "queries": [_query_row(r) for r in rows],
+        "next_cursor": _encode_cursor(*key(rows[-1])) if older else None,
+        "prev_cursor": _encode_cursor(*key(rows[0])) if rows else after_id,
+    }
+
+
+def _by_id(r: sqlite3.Row) -> tuple:
+    return (r["id"],)
+
+
+def _by_ts_id(r: sqlite3.Row) -> tuple:
+    return (r["ts"], r["id"])
+
+
+def get_recent_queries(limit: int = 100, offset: int = 0,
+                       before_id: Optional[str] = None, after_id: Optional[str] = None) -> Dict:
+    """
+    Get most recent DNS queries, a page at a time along the primary key.
+    offset is kept for old clients; cursors cost the same at any depth.
+    Only the partitions whose id range the page reaches are read.
+    """
     conn = get_conn()
-    query = "SELECT * FROM dns_queries WHERE source_ip = ?"
-    params: list = [ip]
+    bound, ascending = _page_bound(before_id, after_id, 1)
+    query = _SELECT_QUERIES
+    params: list = []
+    if bound:
+        query += " WHERE q.id > ?" if ascending else " WHERE q.id < ?"
+        params += bound
+    wanted = limit + (offset if not bound else 0)
+    query += " ORDER BY q.id" + ("" if ascending else " DESC") + " LIMIT ?"
+    params.append(wanted)
+
+    filters = {}
+    if bound:
+        filters = {"above_id": bound[0]} if ascending else {"below_id": bound[0]}
+    parts = _partitions(conn, **filters)
+    read = _read_each(conn, query, params, wanted, ascending, _by_id, **filters)
+    rows = _merge_partitions(parts, read, wanted, ascending, _by_id)
+    return _query_page(rows[wanted - limit:], limit, ascending, _by_id, after_id)
+
+
+# Live-feed event shape: a query row plus its category and severity
+_SELECT_EVENTS = (
+    "SELECT q.id, q.ts, s.ip AS source_ip, s.mac AS source_mac, d.name AS domain, q.qtype, "
+    "COALESCE(q.response, '') AS response, COALESCE(q.device_name, '') AS device_name, "
+    "c.name AS category, q.severity AS level "
+    "FROM dns_queries q "
+    "JOIN sources s ON s.id = q.source_id "
+    "JOIN domains d ON d.id = q.domain_id "
+    "LEFT JOIN categories c ON c.id = q.category_id"
+)
+
+
+def get_last_query_id() -> int:
+    """Id of the newest logged query (0 if none)."""
+    conn = get_conn()
+    parts = _partitions(conn)
+    if not parts:
+        return 0
+    query = _on(_schema(conn, parts[0]), "SELECT COALESCE(MAX(id), 0) AS id FROM dns_queries")
+    return conn.execute(query).fetchone()["id"]
+
+
+def get_queries_since(since_id: int, limit: int = 500, ip: Optional[str] = None,
+                      min_severity: int = 0, category: Optional[str] = None) -> List[Dict]:
+    """
+    Queries logged after since_id, oldest first, in live-feed event form.
+    Used to replay what a reconnecting /dns/stream client missed. Filters
+    use unary + so the read stays a rowid range scan from since_id.
+    """
+    conn = get_conn()
+    query = f"{_SELECT_EVENTS} WHERE q.id > ?"
+    params: list = [since_id]
+    if ip:
+        query += f" AND +q.source_id IN ({_SOURCE_IDS_FOR_IP})"
+        params.append(ip)
+    if min_severity:
+        query += " AND +q.severity >= ?"
+        params.append(min_severity)
+    if category:
+        query += " AND +q.category_id = (SELECT id FROM categories WHERE name = ?)"
+        params.append(category)
+    query += " ORDER BY q.id LIMIT ?"
+    params.append(limit)
 
+    filters = {"above_id": since_id, "min_severity": min_severity}
+    if ip:
+        filters["source_ids"] = [r["id"] for r in conn.execute(_SOURCE_IDS_FOR_IP, (ip,))]
+    if category:
+        filters["category_ids"] = _category_ids(conn, category)
+    parts = _partitions(conn, above_id=since_id)
+    read = _read_each(conn, query, params, limit, True, _by_id, **filters)
+    rows = _merge_partitions(parts, read, limit, True, _by_id)
+    return [_event_row(r) for r in rows]
+
+
+def _category_ids(conn: sqlite3.Connection, category: str) -> List[int]:
+    return [r["id"] for r in conn.execute("SELECT id FROM categories WHERE name = ?", (category,))]
+
+
+def _event_row(r: sqlite3.Row) -> Dict:
+    event = _query_row(r)
+    event["category"] = r["category"]
+    event["severity"] = _SEVERITY_NAMES.get(r["level"])
+    return event
+
+
+# Field order of exported rows (the CSV header)
+EXPORT_FIELDS = [
+    "id", "timestamp", "source_ip", "source_mac", "domain", "query_type",
+    "response", "device_name", "category", "severity",
+]
+
+
+def export_queries(after: Optional[List[int]] = None, limit: int = 5000,
+                   from_date: Optional[str] = None, to_date: Optional[str] = None,
+                   ip: Optional[str] = None, category: Optional[str] = None) -> Dict:
+    """
+    The next batch of a bulk export, oldest first, in live-feed event form.
+    Pass the returned "after" position back until it is None. Every batch
+    is a fresh range read from that (ts, id) position on idx_dns_ts,
+    idx_dns_category_ts or, for a device, idx_dns_source_ts per source id,
+    in the partitions from there on, so an export of any size holds
+    neither memory nor a read snapshot.
+    """
+    conn = get_conn()
+    where = []
+    params: list = []
+    lo, hi = _time_range(from_date, to_date, after, ascending=True)
     if from_date:
-        query += " AND timestamp >= ?"
-        params.append(from_date)
+        where.append("q.ts >= ?")
+        params.append(_to_ms(from_date))
     if to_date:
-        query += " AND timestamp <= ?"
-        params.append(to_date)
+        where.append("q.ts <= ?")
+        params.append(_to_ms(to_date))
+    if after:
+        where.append("(q.ts, q.id) > (?, ?)")
+        params += after
+    if category:
+        where.append("q.category_id = (SELECT id FROM categories WHERE name = ?)")
+        params.append(category)
 
-    query += " ORDER BY id DESC LIMIT ?"
-    params.append(limit)
+    scopes = [([], [])]
+    filters = {"lo": lo, "hi": hi, "after": after}
+    if ip:
+        scopes = [(["q.source_id = ?"], [r["id"]]) for r in conn.execute(_SOURCE_IDS_FOR_IP, (ip,))]
+        filters["source_ids"] = [scope_params[0] for _, scope_params in scopes]
+    if category:
+        filters["category_ids"] = _category_ids(conn, category)
 
-    rows = conn.execute(query, params).fetchall()
-    return [dict(r) for r in rows]
+    def read(part: Dict) -> List[sqlite3.Row]:
+        if part["state"] == "archived":
+            return _read_archived(conn, part, limit, True, _by_ts_id, **filters)
+        schema = _schema(conn, part)
+        found = []
+        for scope, scope_params in scopes:
+            conditions = scope + where
+            query = _SELECT_EVENTS
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += _keyset_order(ascending=True) + " LIMIT ?"
+            found += conn.execute(_on(schema, query), scope_params + params + [limit]).fetchall()
+        return found
+
+    rows = _merge_partitions(_partitions(conn, lo, hi), read, limit, True, _by_ts_id)
+    return {
+        "queries": [_event_row(r) for r in rows],
+        "after": list(_by_ts_id(rows[-1])) if len(rows) >= limit else None,
+    }
+
+
+def _keyset_filters(query: str, params: list, bound: Optional[List[int]], ascending: bool) -> str:
+    """Restrict to rows past a (ts, id) page position."""
+    if bound:
+        query += " AND (q.ts, q.id) > (?, ?)" if ascending else " AND (q.ts, q.id) < (?, ?)"
+        params += bound
+    return query
+
+
+def _keyset_order(ascending: bool) -> str:
+    return " ORDER BY q.ts, q.id" if ascending else " ORDER BY q.ts DESC, q.id DESC"
+
+
+def _time_range(from_date: Optional[str], to_date: Optional[str],
+                bound: Optional[List[int]], ascending: bool) -> tuple:
+    """(lo, hi) epoch milliseconds a (ts, id) page can reach, for choosing partitions."""
+    lo = _to_ms(from_date) if from_date else None
+    hi = _to_ms(to_date) if to_date else None
+    if bound and ascending:
+        lo = bound[0] if lo is None else max(lo, bound[0])
+    elif bound:
+        hi = bound[0] if hi is None else min(hi, bound[0])
+    return lo, hi
+
+
+def search_queries(term: str, limit: int = 200,
+                   from_date: Optional[str] = None,
+                   to_date: Optional[str] = None,
+                   before_id: Optional[str] = None,
+                   after_id: Optional[str] = None) -> Dict:
+    """
+    Search DNS queries by domain substring, newest first.
+    Matching domains come from the trigram index over the domain dictionary.
+    If few of their rows remain past the page position, just those (ts, id)
+    keys are sorted straight from idx_dns_domain_ts; otherwise matches are
+    common enough that walking idx_dns_ts from the page position fills a
+    page quickly. The cut-over, sqrt(limit * partition size) rows, bounds
+    the work per page at any depth; each partition the page reaches
+    chooses for itself.
+    """
+    conn = get_conn()
+    bound, ascending = _page_bound(before_id, after_id, 2)
+    if _fts_enabled and len(term) >= 3:
+        matches = conn.execute(
+            "SELECT rowid FROM domains_fts WHERE domains_fts MATCH ?",
+            ('"' + term.replace('"', '""') + '"',),
+        )
+    else:
+        # Too short for trigrams; the dictionary is small enough to scan
+        matches = conn.execute("SELECT id FROM domains WHERE name LIKE ?", (f"%{term}%",))
+    matched = [r[0] for r in matches]
+    domain_ids = json.dumps(matched)
+    lo, hi = _time_range(from_date, to_date, bound, ascending)
+    filters = {"lo": lo, "hi": hi, "domain_ids": matched, ("after" if ascending else "before"): bound}
+
+    def where(column: str, params: list) -> str:
+        query = f" WHERE {column} IN (SELECT value FROM json_each(?))"
+        params.append(domain_ids)
+        query = _date_filters(query, params, from_date, to_date)
+        return _keyset_filters(query, params, bound, ascending)
+
+    def read(part: Dict) -> List[sqlite3.Row]:
+        if part["state"] == "archived":
+            return _read_archived(conn, part, limit, ascending, _by_ts_id, **filters)
+        schema = _schema(conn, part)
+        horizon = max(math.isqrt(limit * part["rows"]), limit)
+        params: list = []
+        remaining = conn.execute(
+            _on(schema, f"SELECT COUNT(*) FROM (SELECT 1 FROM dns_queries q {where('q.domain_id', params)} LIMIT ?)"),
+            params + [horizon],
+        ).fetchone()[0]
+
+        params = []
+        if remaining < horizon:
+            ids = [r[0] for r in conn.execute(
+                _on(schema, f"SELECT q.id FROM dns_queries q {where('q.domain_id', params)}"
+                            f"{_keyset_order(ascending)} LIMIT ?"),
+                params + [limit],
+            )]
+            return conn.execute(
+                _on(schema, f"{_SELECT_QUERIES} WHERE q.id IN (SELECT value FROM json_each(?))"), (json.dumps(ids),)
+            ).fetchall()
+        # Unary + keeps SQLite on the time index rather than per-domain ranges
+        return conn.execute(
+            _on(schema, f"{_SELECT_QUERIES}{where('+q.domain_id', params)}{_keyset_order(ascending)} LIMIT ?"),
+            params + [limit],
+        ).fetchall()
+
+    rows = _merge_partitions(_partitions(conn, lo, hi), read, limit, ascending, _by_ts_id)
+    return _query_page(rows, limit, ascending, _by_ts_id, after_id)
+
+
+def get_queries_by_device(ip: str, limit: int = 200,
+                          from_date: Optional[str] = None,
+                          to_date: Optional[str] = None,
+                          before_id: Optional[str] = None,
+                          after_id: Optional[str] = None) -> Dict:
+    """
+    Get DNS queries from a specific device IP, newest first.
+    Each source id (one per MAC) is read as a range on idx_dns_source_ts
+    from the page position, and the ranges are merged.
+    """
+    conn = get_conn()
+    bound, ascending = _page_bound(before_id, after_id, 2)
+    source_ids = [r["id"] for r in conn.execute(_SOURCE_IDS_FOR_IP, (ip,))]
+    lo, hi = _time_range(from_date, to_date, bound, ascending)
+    filters = {"lo": lo, "hi": hi, "source_ids": source_ids, ("after" if ascending else "before"): bound}
+
+    def read(part: Dict) -> List[sqlite3.Row]:
+        if part["state"] == "archived":
+            return _read_archived(conn, part, limit, ascending, _by_ts_id, **filters)
+        schema = _schema(conn, part)
+        found = []
+        for source_id in source_ids:
+            query = f"{_SELECT_QUERIES} WHERE q.source_id = ?"
+            params: list = [source_id]
+            query = _date_filters(query, params, from_date, to_date)
+            query = _keyset_filters(query, params, bound, ascending) + _keyset_order(ascending) + " LIMIT ?"
+            params.append(limit)
+            found += conn.execute(_on(schema, query), params).fetchall()
+        return found
+
+    parts = _partitions(conn, lo, hi) if source_ids else []
+    rows = _merge_partitions(parts, read, limit, ascending, _by_ts_id)
+    return _query_page(rows, limit, ascending, _by_ts_id, after_id)
 
 
 def get_device_report(ip: str, days: int = 30) -> Dict:
-    """Generate a summary report for a device over N days."""
+    """
+    Generate a summary report for a device over N days.
+    Reads the hourly rollups, so the window starts at the top of its first hour.
+    """
     conn = get_conn()
-    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    since = _since_ms(days=days) // _HOUR_MS
 
     total = conn.execute(
-        "SELECT COUNT(*) as cnt FROM dns_queries WHERE source_ip = ? AND timestamp >= ?",
+        "SELECT COALESCE(SUM(count), 0) as cnt FROM hourly_device_domain_counts "
+        f"WHERE source_id IN ({_SOURCE_IDS_FOR_IP}) AND hour >= ?",
         (ip, since)
     ).fetchone()["cnt"]
 
     top_domains = conn.execute(
-        "SELECT domain, COUNT(*) as cnt FROM dns_queries "
-        "WHERE source_ip = ? AND timestamp >= ? "
-        "GROUP BY domain ORDER BY cnt DESC LIMIT 50",
+        "SELECT d.name AS domain, t.cnt FROM ("
+        "  SELECT domain_id, SUM(count) as cnt FROM hourly_device_domain_counts "
+        f"  WHERE source_id IN ({_SOURCE_IDS_FOR_IP}) AND hour >= ? "
+        "  GROUP BY domain_id ORDER BY cnt DESC LIMIT 50"
+        ") t JOIN domains d ON d.id = t.domain_id ORDER BY t.cnt DESC",
         (ip, since)
     ).fetchall()
 
     daily = conn.execute(
-        "SELECT DATE(timestamp) as day, COUNT(*) as cnt FROM dns_queries "
-        "WHERE source_ip = ? AND timestamp >= ? "
-        "GROUP BY DATE(timestamp) ORDER BY day DESC",
+        "SELECT date(hour * 3600, 'unixepoch') as day, SUM(count) as cnt FROM hourly_device_domain_counts "
+        f"WHERE source_id IN ({_SOURCE_IDS_FOR_IP}) AND hour >= ? "
+        "GROUP BY day ORDER BY day DESC",
         (ip, since)
     ).fetchall()
 
@@ -152,23 +2338,8 @@ def get_device_report(ip: str, days: int = 30) -> Dict:
 
 
 def get_query_stats() -> Dict:
-    """Get overall stats for the status endpoint."""
-    conn = get_conn()
-    total = conn.execute("SELECT COUNT(*) as cnt FROM dns_queries").fetchone()["cnt"]
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    today_count = conn.execute(
-        "SELECT COUNT(*) as cnt FROM dns_queries WHERE timestamp >= ?",
-        (today,)
-    ).fetchone()["cnt"]
-    unique_devices = conn.execute(
-        "SELECT COUNT(DISTINCT source_ip) as cnt FROM dns_queries"
-    ).fetchone()["cnt"]
-
-    return {
-        "total_queries": total,
-        "queries_today": today_count,
-        "unique_devices": unique_devices,
-    }
+    """Overall stats for the status endpoint, from the ingest counters."""
+    return _query_counters.snapshot()
 
 
 def upsert_device(ip: str, mac: str, hostname: str = "", vendor: str = ""):
@@ -191,48 +2362,181 @@ def get_all_devices() -> List[Dict]:
     return [dict(r) for r in rows]
 
 
-def get_unique_domains(ip: str = None, days: int = 7, limit: int = 500) -> List[Dict]:
-    """Get unique domains with visit counts, optionally filtered by device IP."""
+def get_unique_domains(ip: str = None, days: int = 7, limit: int = 500,
+                       category: Optional[str] = None) -> List[Dict]:
+    """
+    Get unique domains with visit counts and categories, optionally filtered
+    by device IP and category.
+    Reads the hourly rollups, so the window starts at the top of its first hour.
+    """
     conn = get_conn()
-    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    since = _since_ms(days=days) // _HOUR_MS
 
+    where = "h.hour >= ?"
+    params: list = [since]
     if ip:
-        rows = conn.execute(
-            "SELECT domain, COUNT(*) as cnt, MIN(timestamp) as first_seen, MAX(timestamp) as last_seen "
-            "FROM dns_queries WHERE source_ip = ? AND timestamp >= ? "
-            "GROUP BY domain ORDER BY cnt DESC LIMIT ?",
-            (ip, since, limit)
-        ).fetchall()
+        where += f" AND h.source_id IN ({_SOURCE_IDS_FOR_IP})"
+        params.append(ip)
+    if category:
+        where += (" AND h.domain_id IN (SELECT id FROM domains WHERE category_id = "
+                  "(SELECT id FROM categories WHERE name = ?))")
+        params.append(category)
+    params.append(limit)
+
+    if ip:
+        inner = (
+            "SELECT h.domain_id, SUM(h.count) as cnt, MIN(h.first_seen) as first_seen, MAX(h.last_seen) as last_seen "
+            f"FROM hourly_device_domain_counts h WHERE {where} "
+            "GROUP BY h.domain_id ORDER BY cnt DESC LIMIT ?"
+        )
+        columns = "d.name AS domain, t.cnt, t.first_seen, t.last_seen"
     else:
-        rows = conn.execute(
-            "SELECT domain, source_ip, COUNT(*) as cnt, MIN(timestamp) as first_seen, MAX(timestamp) as last_seen "
-            "FROM dns_queries WHERE timestamp >= ? "
-            "GROUP BY domain, source_ip ORDER BY cnt DESC LIMIT ?",
-            (since, limit)
-        ).fetchall()
+        inner = (
+            "SELECT h.domain_id, s.ip AS source_ip, SUM(h.count) as cnt, "
+            "       MIN(h.first_seen) as first_seen, MAX(h.last_seen) as last_seen "
+            f"FROM hourly_device_domain_counts h JOIN sources s ON s.id = h.source_id WHERE {where} "
+            "GROUP BY h.domain_id, s.ip ORDER BY cnt DESC LIMIT ?"
+        )
+        columns = "d.name AS domain, t.source_ip, t.cnt, t.first_seen, t.last_seen"
+
+    rows = conn.execute(
+        f"SELECT {columns}, c.name AS category, c.label AS category_label, c.severity FROM ({inner}) t "
+        "JOIN domains d ON d.id = t.domain_id "
+        "LEFT JOIN categories c ON c.id = d.category_id ORDER BY t.cnt DESC",
+        params
+    ).fetchall()
+
+    result = []
+    for r in rows:
+        row = dict(r)
+        row["first_seen"] = _iso(row["first_seen"])
+        row["last_seen"] = _iso(row["last_seen"])
+        result.append(row)
+    return result
+
+
+_SELECT_ALERTS = (
+    "SELECT a.id, a.severity AS level, a.first_seen, a.last_seen, a.hits, "
+    "d.name AS domain, c.name AS category, c.label, c.severity, s.ip AS source_ip "
+    "FROM alerts a "
+    "JOIN domains d ON d.id = a.domain_id "
+    "JOIN sources s ON s.id = a.source_id "
+    "JOIN categories c ON c.id = a.category_id"
+)
+
+# Alert severity levels, highest first
+_ALERT_LEVELS = sorted((v for v in SEVERITY_LEVELS.values() if v >= ALERT_SEVERITY), reverse=True)
+
+
+def _alert_range(conn: sqlite3.Connection, severity: int, since: int, after: Optional[tuple],
+                 source_id: Optional[int], category_id: Optional[int], limit: int) -> List[sqlite3.Row]:
+    """Newest alerts of one severity (optionally one source/category), below a keyset position."""
+    query = f"{_SELECT_ALERTS} WHERE a.severity = ? AND a.last_seen >= ?"
+    params: list = [severity, since]
+    if after:
+        query += " AND (a.last_seen, a.id) < (?, ?)"
+        params += list(after)
+    if source_id is not None:
+        query += " AND a.source_id = ?"
+        params.append(source_id)
+    if category_id is not None:
+        query += " AND a.category_id = ?"
+        params.append(category_id)
+    query += " ORDER BY a.last_seen DESC, a.id DESC LIMIT ?"
+    params.append(limit)
+    return conn.execute(query, params).fetchall()
 
-    return [dict(r) for r in rows]
 
+def _alert_count(conn: sqlite3.Connection, severity: int, since: int,
+                 source_id: Optional[int], category_id: Optional[int]) -> int:
+    """How many alerts of one severity (optionally one source/category) were seen since a time."""
+    query = "SELECT COUNT(*) FROM alerts a WHERE a.severity = ? AND a.last_seen >= ?"
+    params: list = [severity, since]
+    if source_id is not None:
+        query += " AND a.source_id = ?"
+        params.append(source_id)
+    if category_id is not None:
+        query += " AND a.category_id = ?"
+        params.append(category_id)
+    return conn.execute(query, params).fetchone()[0]
 
-def get_all_queries_for_alerts(hours: int = 24) -> List[Dict]:
-    """Get all queries from the last N hours for alert scanning."""
+
+def get_recent_alerts(hours: int = 24, ip: Optional[str] = None, category: Optional[str] = None,
+                      limit: int = 100, cursor: Optional[str] = None) -> Dict:
+    """
+    A page of alerts (one per device, domain and ALERT_WINDOW_HOURS window)
+    seen in the last N hours, high severity first, then most recent.
+    Every read is a bounded range on an alerts index (one per severity, and
+    per source id for a device), so cost depends on the page size, not on
+    how much history exists. Pass next_cursor back as cursor for the
+    following page. count is every matching alert in the window, counted
+    over the same index ranges.
+    """
     conn = get_conn()
-    since = (datetime.utcnow() - timedelta(hours=hours)).isoformat()
-    rows = conn.execute(
-        "SELECT * FROM dns_queries WHERE timestamp >= ? ORDER BY id DESC",
-        (since,)
-    ).fetchall()
-    return [dict(r) for r in rows]
+    since = _since_ms(hours=hours)
+    if cursor:
+        level, last_seen, last_id = _decode_cursor(cursor, 3)
+    else:
+        level, last_seen, last_id = _ALERT_LEVELS[0], None, None
+
+    source_ids = [None]
+    if ip:
+        source_ids = [r["id"] for r in conn.execute(_SOURCE_IDS_FOR_IP, (ip,))]
+    category_id = None
+    if category:
+        row = conn.execute("SELECT id FROM categories WHERE name = ?", (category,)).fetchone()
+        category_id = row["id"] if row else -1
+
+    rows = []
+    for severity in _ALERT_LEVELS:
+        if severity > level:
+            continue
+        after = (last_seen, last_id) if severity == level and last_seen is not None else None
+        wanted = limit - len(rows)
+        found = []
+        for source_id in source_ids:
+            found += _alert_range(conn, severity, since, after, source_id, category_id, wanted)
+        found.sort(key=lambda r: (r["last_seen"], r["id"]), reverse=True)
+        rows += found[:wanted]
+        if len(rows) >= limit:
+            break
+
+    next_cursor = None
+    if len(rows) >= limit:
+        last = rows[-1]
+        next_cursor = _encode_cursor(last["level"], last["last_seen"], last["id"])
+
+    count = sum(_alert_count(conn, severity, since, source_id, category_id)
+                for severity in _ALERT_LEVELS for source_id in source_ids)
+
+    return {
+        "count": count,
+        "alerts": [
+            {
+                "id": r["id"],
+                "domain": r["domain"],
+                "category": r["category"],
+                "label": r["label"],
+                "severity": r["severity"],
+                "source_ip": r["source_ip"],
+                "timestamp": _iso(r["last_seen"]),
+                "first_seen": _iso(r["first_seen"]),
+                "hits": r["hits"],
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 def get_activity_timeline(ip: str, days: int = 7) -> List[Dict]:
-    """Get hourly activity breakdown for a device."""
+    """Get hourly activity breakdown for a device (from the hourly rollups)."""
     conn = get_conn()
-    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    since = _since_ms(days=days) // _HOUR_MS
     rows = conn.execute(
-        "SELECT strftime('%Y-%m-%d %H:00', timestamp) as hour, COUNT(*) as cnt "
-        "FROM dns_queries WHERE source_ip = ? AND timestamp >= ? "
-        "GROUP BY hour ORDER BY hour DESC",
+        "SELECT strftime('%Y-%m-%d %H:00', h.hour * 3600, 'unixepoch') as hour, SUM(h.count) as cnt "
+        f"FROM hourly_device_domain_counts h WHERE h.source_id IN ({_SOURCE_IDS_FOR_IP}) AND h.hour >= ? "
+        "GROUP BY h.hour ORDER BY h.hour DESC",
         (ip, since)
     ).fetchall()
     return [dict(r) for r in rows]
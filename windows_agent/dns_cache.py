@@ -0,0 +1,273 @@
+"""
+DNS Response Cache — TTL-aware, memory-bounded LRU cache for the DNS proxy.
+Answers are kept as raw upstream packets and re-issued under the asking
+client's transaction ID with their TTLs aged by the time spent in the cache,
+patched in place rather than re-encoded.
+
+An answer that proves popular is scheduled for a background refresh by the
+engine's prefetcher shortly before it expires, within a per-second budget;
+due refreshes start from whatever lookup comes along next. Expired answers
+linger for DNS_SERVE_STALE_MAX seconds so they can still be served, with a
+short TTL, when upstream fails (RFC 8767).
+"""
+import heapq
+import itertools
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dnslib import DNSRecord
+
+from config import (
+    DNS_CACHE_MAX_BYTES, DNS_CACHE_MAX_TTL, DNS_SERVE_STALE_MAX, DNS_STALE_ANSWER_TTL,
+    DNS_PREFETCH_MIN_HITS, DNS_PREFETCH_WINDOW, DNS_PREFETCH_BUDGET,
+)
+from dns_wire import scan_answer, readdress, restamp, TYPE_OPT, EDNS_NONE, EDNS_PLAIN, EDNS_DO
+
+logger = logging.getLogger("dns_cache")
+
+# Rough per-entry bookkeeping cost (key tuple, entry object, dict slot)
+_ENTRY_OVERHEAD = 200
+
+
+class _Entry:
+    """One cached answer."""
+
+    __slots__ = ("data", "stored_at", "expires_at", "size", "ttl_offsets",
+                 "hits", "prefetching", "replaced_expiry", "stale_until")
+
+    def __init__(self, data: bytes, stored_at: float, expires_at: float, size: int, ttl_offsets: list):
+        self.data = data
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.size = size
+        self.ttl_offsets = ttl_offsets
+        self.hits = 0
+        self.prefetching = False
+        # For a prefetched answer, when the one it replaced would have expired
+        self.replaced_expiry = 0.0
+        # After a failed lookup, answer stale without asking upstream until then
+        self.stale_until = 0.0
+
+
+class DNSCache:
+    """
+    Response cache keyed by (qname, qtype, qclass, EDNS state) with LRU
+    eviction under a byte cap. The EDNS state keeps answers to EDNS and
+    DNSSEC OK queries (OPT record, RRSIGs) from reaching clients that
+    asked without them.
+    """
+
+    def __init__(self, max_bytes: int = DNS_CACHE_MAX_BYTES, max_ttl: int = DNS_CACHE_MAX_TTL,
+                 stale_max: int = DNS_SERVE_STALE_MAX, stale_ttl: int = DNS_STALE_ANSWER_TTL,
+                 prefetch_budget: float = DNS_PREFETCH_BUDGET):
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.stale_max = stale_max
+        self.stale_ttl = stale_ttl
+        self.prefetch_budget = prefetch_budget
+        # Set by the engine: called with a key to refresh, outside the lock
+        self.prefetcher: Optional[Callable[[Tuple[str, int, int, int]], None]] = None
+        self._entries: "OrderedDict[Tuple[str, int, int, int], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # (refresh at, seq, key, stored_at of the entry it was scheduled for)
+        self._schedule: List[tuple] = []
+        self._seq = itertools.count()
+        self._tokens = float(prefetch_budget)
+        self._tokens_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_served = 0
+        self.prefetches = 0
+        self.prefetch_skipped = 0
+        self.prefetch_failures = 0
+        self.prefetch_saves = 0
+
+    @staticmethod
+    def key_for(request: DNSRecord) -> Tuple[str, int, int, int]:
+        """Cache key for a parsed request."""
+        edns = EDNS_NONE
+        for rr in request.ar:
+            if rr.rtype == TYPE_OPT:
+                edns = EDNS_DO if rr.ttl & 0x8000 else EDNS_PLAIN
+        return (str(request.q.qname).lower(), request.q.qtype, request.q.qclass, edns)
+
+    def get(self, key: Tuple[str, int, int, int], txid: int) -> Optional[bytes]:
+        """
+        Return a cached answer packet re-addressed to txid, or None on a
+        miss. A name whose lookup just failed is answered stale until the
+        recheck is due.
+        """
+        if self.max_bytes <= 0:
+            return None
+
+        now = time.monotonic()
+        stale = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at <= now:
+                if now < entry.stale_until:
+                    stale = True
+                    self.stale_served += 1
+                else:
+                    if entry.expires_at + self.stale_max <= now:
+                        self._remove(key)
+                    entry = None
+            if not entry:
+                self.misses += 1
+            elif not stale:
+                self.hits += 1
+                entry.hits += 1
+                if entry.replaced_expiry and now >= entry.replaced_expiry:
+                    # Without the prefetch this lookup would have gone upstream
+                    self.prefetch_saves += 1
+                    entry.replaced_expiry = 0.0
+                if entry.hits == DNS_PREFETCH_MIN_HITS and self.prefetcher and self.prefetch_budget > 0:
+                    refresh_at = entry.expires_at - DNS_PREFETCH_WINDOW * (entry.expires_at - entry.stored_at)
+                    heapq.heappush(self._schedule, (refresh_at, next(self._seq), key, entry.stored_at))
+            if entry:
+                self._entries.move_to_end(key)
+            due = self._due_refreshes(now) if self._schedule and self._schedule[0][0] <= now else ()
+
+        for refresh in due:
+            self.prefetcher(refresh)
+        if not entry:
+            return None
+        if stale:
+            return restamp(entry.data, txid, entry.ttl_offsets, self.stale_ttl)
+        return readdress(entry.data, txid, entry.ttl_offsets, int(now - entry.stored_at))
+
+    def _due_refreshes(self, now: float) -> List[Tuple[str, int, int, int]]:
+        """
+        Pop the scheduled refreshes that are due and the budget allows,
+        marking their entries (caller holds the lock). Ones the budget
+        holds back wait for a later lookup, unless their answer expires
+        first.
+        """
+        # Token bucket holding at most one second of budget
+        self._tokens = min(self.prefetch_budget,
+                           self._tokens + (now - self._tokens_at) * self.prefetch_budget)
+        self._tokens_at = now
+        keys = []
+        while self._schedule and self._schedule[0][0] <= now:
+            _, _, key, stored_at = self._schedule[0]
+            entry = self._entries.get(key)
+            if not entry or entry.stored_at != stored_at or entry.prefetching:
+                # Replaced or evicted since it was scheduled
+                heapq.heappop(self._schedule)
+                continue
+            if entry.expires_at <= now:
+                heapq.heappop(self._schedule)
+                self.prefetch_skipped += 1
+                continue
+            if self._tokens < 1:
+                break
+            heapq.heappop(self._schedule)
+            self._tokens -= 1
+            entry.prefetching = True
+            self.prefetches += 1
+            keys.append(key)
+        return keys
+
+    def refresh_done(self, key: Tuple[str, int, int, int], failed: bool = False):
+        """
+        End a background refresh of key, whether or not it stored a new
+        answer. A failed one leaves the cached answer to expire and be
+        looked up by the next client that asks.
+        """
+        with self._lock:
+            if failed:
+                self.prefetch_failures += 1
+            entry = self._entries.get(key)
+            if entry:
+                entry.prefetching = False
+
+    def get_stale(self, key: Tuple[str, int, int, int], txid: int) -> Optional[bytes]:
+        """
+        After upstream failed for key: the cached answer, stamped with the
+        stale TTL if it has expired, or None if there is nothing to serve.
+        Further lookups for it are answered stale for the stale TTL.
+        """
+        if self.max_bytes <= 0 or self.stale_max <= 0:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry.expires_at + self.stale_max <= now:
+                return None
+            if entry.expires_at > now:
+                # Refreshed by someone else meanwhile
+                return readdress(entry.data, txid, entry.ttl_offsets, int(now - entry.stored_at))
+            self.stale_served += 1
+            entry.stale_until = now + self.stale_ttl
+            return restamp(entry.data, txid, entry.ttl_offsets, self.stale_ttl)
+
+    def put(self, key: Tuple[str, int, int, int], data: bytes, prefetched: bool = False):
+        """Store a raw upstream answer if it is cacheable; prefetched if it is a background refresh."""
+        if self.max_bytes <= 0:
+            return
+
+        scanned = scan_answer(data)
+        if not scanned:
+            return
+        ttl, ttl_offsets = scanned
+        if not ttl or ttl <= 0:
+            return
+        ttl = min(ttl, self.max_ttl)
+
+        size = len(data) + len(key[0]) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        now = time.monotonic()
+        entry = _Entry(data, now, now + ttl, size, ttl_offsets)
+        with self._lock:
+            old = self._entries.get(key)
+            if old:
+                if prefetched and old.expires_at > now:
+                    entry.replaced_expiry = old.expires_at
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Drop an entry (caller holds the lock)."""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self):
+        """Drop every cached answer."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """Counters for the status endpoint."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "stale_served": self.stale_served,
+                "prefetches": self.prefetches,
+                "prefetch_skipped": self.prefetch_skipped,
+                "prefetch_failures": self.prefetch_failures,
+                "prefetch_saves": self.prefetch_saves,
+                # What hit_ratio would be had every prefetched answer expired instead
+                "hit_ratio_without_prefetch": (
+                    round((self.hits - self.prefetch_saves) / lookups, 4) if lookups else 0.0),
+            }
@@ -3,18 +3,53 @@ Mode A — DNS Proxy Server
 Runs a DNS server on port 53 that logs every query and forwards to upstream DNS.
 Requires router DHCP to point devices to this machine's IP.
 """
+import asyncio
+import random
 import socket
 import struct
 import threading
+import time
 import logging
-from dnslib import DNSRecord, DNSHeader, QTYPE, RR
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from dnslib import DNSRecord, DNSHeader, DNSError, QTYPE, RR
 from dnslib.server import DNSServer, DNSHandler, BaseResolver
 
-from config import UPSTREAM_DNS, UPSTREAM_DNS_ALT, DNS_PROXY_PORT, IGNORE_DOMAINS
+from config import (
+    DNS_PROXY_PORT, DNS_PROXY_TCP, DNS_TCP_IDLE_TIMEOUT, IGNORE_DOMAINS, DNS_UPSTREAM_SOCKETS,
+)
+from client_limits import ClientLimiter, FairSlots, ClientQueueFull
 from db import log_dns_query
+from dns_cache import DNSCache
+from dns_wire import (
+    parse_query, edns_state, servfail, refused, fit_udp, is_truncated, frame, recv_framed, build_query, rcode,
+    RCODE_SERVFAIL, RCODE_REFUSED,
+)
+from upstream_pool import UpstreamPool, Lookup
 
 logger = logging.getLogger("dns_proxy")
 
+# Where logged queries go instead of the database, if set (proxy workers)
+_query_sink: Optional[Callable[[str, str, str], None]] = None
+
+# Background refreshes the threaded engine runs at once
+_PREFETCH_THREADS = 4
+
+# Prefix the worker dispatcher puts on relayed queries and their answers:
+# the client's IPv4 address and port
+RELAY_HEADER = struct.Struct("!4sH")
+
+
+def set_query_sink(sink: Optional[Callable[[str, str, str], None]]):
+    """
+    Hand logged queries to sink(client_ip, domain, query_type) instead of
+    writing them to the database. The asyncio engine then calls it on its
+    event loop, so it must not block.
+    """
+    global _query_sink
+    _query_sink = sink
+
 
 def _should_ignore(domain: str) -> bool:
     """Check if a domain matches any ignore pattern."""
@@ -29,55 +64,294 @@ def _should_ignore(domain: str) -> bool:
     return False
 
 
+def _log_query(client_ip: str, qname: str, qtype: str):
+    """Log a DNS query (unless ignored)."""
+    if _should_ignore(qname):
+        return
+    logger.info(f"DNS query from {client_ip}: {qname} ({qtype})")
+    try:
+        if _query_sink:
+            _query_sink(client_ip, qname.rstrip("."), qtype)
+            return
+        log_dns_query(
+            source_ip=client_ip,
+            domain=qname.rstrip("."),
+            query_type=qtype,
+        )
+    except Exception as e:
+        logger.error(f"Failed to log DNS query: {e}")
+
+
+def _failed(response: bytes) -> bool:
+    """Whether an upstream answer is a failure a stale cached answer should stand in for."""
+    return rcode(response) in (RCODE_SERVFAIL, RCODE_REFUSED)
+
+
+def _coalesce_stats(exchanges: int, coalesced: int) -> dict:
+    """Upstream exchanges started and queries that shared one instead."""
+    lookups = exchanges + coalesced
+    return {
+        "upstream_exchanges": exchanges,
+        "coalesced": coalesced,
+        "coalesce_ratio": round(coalesced / lookups, 4) if lookups else 0.0,
+    }
+
+
+def _rate_limit_stats(limiter: ClientLimiter, slots: FairSlots) -> dict:
+    """Rate-limit totals, per-client events and upstream slot use."""
+    stats = limiter.stats()
+    stats["upstream_slots"] = slots.stats()
+    return stats
+
+
+class _Flight:
+    """One upstream exchange that concurrent identical queries wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class InFlightQueries:
+    """
+    Single-flight table for the threaded engine: while a lookup for a key
+    is with upstream, identical lookups wait for its answer instead of
+    sending their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # {key: _Flight}
+        self.exchanges = 0
+        self.coalesced = 0
+
+    def run(self, key, fetch: Callable[[], bytes]) -> bytes:
+        """Return fetch()'s answer, shared with concurrent callers for the same key (None never shares)."""
+        with self._lock:
+            flight = self._flights.get(key) if key else None
+            leader = flight is None
+            if leader:
+                self.exchanges += 1
+                flight = _Flight()
+                if key:
+                    self._flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # The leader's own upstream timeouts bound this wait
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.response
+
+        try:
+            flight.response = fetch()
+            return flight.response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            if key:
+                with self._lock:
+                    del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return _coalesce_stats(self.exchanges, self.coalesced)
+
+
 class LoggingResolver(BaseResolver):
     """DNS resolver that logs queries and forwards to upstream."""
 
-    def __init__(self, upstream: str = UPSTREAM_DNS, upstream_alt: str = UPSTREAM_DNS_ALT):
-        self.upstream = upstream
-        self.upstream_alt = upstream_alt
+    def __init__(self, servers: List[str] = None, cache: DNSCache = None, limiter: ClientLimiter = None):
+        self.pool = UpstreamPool(servers)
+        self.cache = cache or DNSCache()
+        self.cache.prefetcher = self._prefetch
+        self.in_flight = InFlightQueries()
+        self.limiter = limiter or ClientLimiter()
+        self.slots = FairSlots()
+        self._refreshing = ThreadPoolExecutor(_PREFETCH_THREADS, thread_name_prefix="dns-prefetch")
+
+    def resolve_raw(self, data: bytes, client_ip: str) -> Optional[bytes]:
+        """
+        Answer a plain query straight from its packet: the question is read
+        off the wire, the query forwarded as received and the upstream
+        answer relayed verbatim. None if the packet needs dnslib.
+        """
+        question = parse_query(data)
+        if not question:
+            return None
+        txid, qname, qtype, qclass = question
+        _log_query(client_ip, qname, QTYPE[qtype])
+
+        key = (qname.lower(), qtype, qclass, edns_state(data))
+        cached = self.cache.get(key, txid)
+        if cached:
+            return cached
+        return self._fetch(key, key, data, txid, client_ip) or servfail(data)
 
     def resolve(self, request, handler):
-        """Resolve a DNS request by forwarding and logging."""
+        """Resolve a DNS request from cache or by forwarding, and log it."""
         qname = str(request.q.qname)
         qtype = QTYPE[request.q.qtype]
         client_ip = handler.client_address[0]
 
         # Log the query (unless ignored)
-        if not _should_ignore(qname):
-            logger.info(f"DNS query from {client_ip}: {qname} ({qtype})")
-            try:
-                log_dns_query(
-                    source_ip=client_ip,
-                    domain=qname.rstrip("."),
-                    query_type=qtype,
-                )
-            except Exception as e:
-                logger.error(f"Failed to log DNS query: {e}")
+        _log_query(client_ip, qname, qtype)
+
+        key = DNSCache.key_for(request)
+        cached = self.cache.get(key, request.header.id)
+        if cached:
+            return DNSRecord.parse(cached)
 
         # Forward to upstream DNS
+        response = self._fetch(key, None, request.pack(), request.header.id, client_ip)
+        if not response:
+            reply = request.reply()
+            reply.header.rcode = 2  # SERVFAIL
+            return reply
+        return DNSRecord.parse(response)
+
+    def _fetch(self, key, share_key, data: bytes, txid: int, client_ip: str) -> Optional[bytes]:
+        """
+        Forward a query (sharing the exchange with identical ones under
+        share_key) once the client has an upstream slot, and cache the
+        answer. If upstream fails, the stale cached answer stands in; None
+        if there is none and nothing came back. REFUSED if the client
+        already has too many lookups outstanding.
+        """
         try:
-            response = self._forward(request.pack(), self.upstream)
-        except Exception:
-            try:
-                response = self._forward(request.pack(), self.upstream_alt)
-            except Exception as e:
-                logger.error(f"Upstream DNS failed: {e}")
-                reply = request.reply()
-                reply.header.rcode = 2  # SERVFAIL
-                return reply
+            self.slots.wait(client_ip, self.pool.timeout)
+        except ClientQueueFull:
+            self.limiter.limited(client_ip, "queue_full")
+            return refused(data)
+        except TimeoutError:
+            logger.warning(f"No upstream slot for {client_ip} in time")
+            return self.cache.get_stale(key, txid)
+        try:
+            response = self.in_flight.run(share_key, lambda: self._forward_any(data))
+        except Exception as e:
+            logger.error(f"Upstream DNS failed: {e}")
+            return self.cache.get_stale(key, txid)
+        finally:
+            self.slots.release(client_ip)
+        # A shared answer carries the first asker's transaction ID
+        if _failed(response):
+            return self.cache.get_stale(key, txid) or data[:2] + response[2:]
+        self.cache.put(key, response)
+        return data[:2] + response[2:]
 
-        return DNSRecord.parse(response)
+    def _forward_any(self, data: bytes) -> bytes:
+        """Forward a raw query through the upstream pool."""
+        return self.pool.exchange(data)
 
-    def _forward(self, data: bytes, upstream: str, port: int = 53, timeout: float = 5.0) -> bytes:
-        """Forward raw DNS packet to upstream server."""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(timeout)
+    def _prefetch(self, key):
+        """Cache hook: refresh a popular answer on a background thread before it expires."""
+        query = build_query(*key, random.getrandbits(16))
+        if not query:
+            self.cache.refresh_done(key)
+            return
         try:
-            sock.sendto(data, (upstream, port))
-            response, _ = sock.recvfrom(4096)
-            return response
+            self._refreshing.submit(self._refresh, key, query)
+        except RuntimeError:
+            # Shutting down
+            self.cache.refresh_done(key)
+
+    def _refresh(self, key, query: bytes):
+        """Fetch a fresh answer for key; failures leave the cached one in place, like _fetch."""
+        failed = True
+        try:
+            response = self.in_flight.run(key, lambda: self._forward_any(query))
+            if _failed(response):
+                logger.debug(f"Prefetch of {key[0]} answered rcode {rcode(response)}")
+            else:
+                self.cache.put(key, response, prefetched=True)
+                failed = False
+        except Exception as e:
+            logger.debug(f"Prefetch of {key[0]} failed: {e}")
         finally:
-            sock.close()
+            self.cache.refresh_done(key, failed)
+
+    def close(self):
+        """Drop queued refreshes and close pooled upstream connections."""
+        self._refreshing.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
+
+
+class _ProxyHandler(DNSHandler):
+    """
+    Request handler that turns away clients over their rate limit, tries
+    the resolver's raw fast path before dnslib's decode/encode, fits UDP
+    answers to the client's EDNS0 payload size and keeps TCP connections
+    open for further queries.
+    """
+
+    def handle(self):
+        if self.server.socket_type == socket.SOCK_STREAM:
+            self._serve_tcp()
+            return
+        self.protocol = "udp"
+        data, connection = self.request
+        try:
+            reply = self.get_reply(data)
+        except DNSError as e:
+            self.server.logger.log_error(self, e)
+            return
+        if reply is not None:
+            connection.sendto(reply, self.client_address)
+
+    def get_reply(self, data):
+        """The answer to a query, or None to send nothing."""
+        resolver = self.server.resolver
+        client_ip = self.client_address[0]
+        # Checked before the query is logged, so a flood never reaches the database
+        if not resolver.limiter.admit(client_ip):
+            return resolver.limiter.refusal(data)
+        reply = resolver.resolve_raw(data, client_ip)
+        if reply is None:
+            reply = super().get_reply(data)
+        return fit_udp(reply, data) if self.protocol == "udp" else reply
+
+    def _serve_tcp(self):
+        """
+        Answer queries on one connection until the client closes it or goes
+        idle. Each is answered on its own thread so pipelined queries don't
+        queue behind a slow one; answers may come back out of order (RFC 7766).
+        """
+        self.protocol = "tcp"
+        self.request.settimeout(DNS_TCP_IDLE_TIMEOUT)
+        send_lock = threading.Lock()
+        answering = []
+        while True:
+            try:
+                data = recv_framed(self.request)
+            except OSError:
+                break
+            if data is None:
+                break
+            answering = [t for t in answering if t.is_alive()]
+            thread = threading.Thread(target=self._answer_tcp, args=(data, send_lock), daemon=True)
+            thread.start()
+            answering.append(thread)
+        for thread in answering:
+            thread.join()
+
+    def _answer_tcp(self, data: bytes, send_lock: threading.Lock):
+        try:
+            reply = self.get_reply(data)
+        except DNSError as e:
+            self.server.logger.log_error(self, e)
+            return
+        if reply is None:
+            return
+        with send_lock:
+            try:
+                self.request.sendall(frame(reply))
+            except OSError:
+                pass
 
 
 class DNSProxyServer:
@@ -85,29 +359,535 @@ class DNSProxyServer:
 
     def __init__(self):
         self.server = None
+        self.tcp_server = None
+        self.resolver = None
         self._running = False
 
     def start(self):
         """Start the DNS proxy server."""
-        resolver = LoggingResolver()
+        self.resolver = LoggingResolver()
         self.server = DNSServer(
-            resolver,
+            self.resolver,
             port=DNS_PROXY_PORT,
             address="0.0.0.0",
             tcp=False,
+            handler=_ProxyHandler,
         )
+        if DNS_PROXY_TCP:
+            self.tcp_server = DNSServer(
+                self.resolver,
+                port=DNS_PROXY_PORT,
+                address="0.0.0.0",
+                tcp=True,
+                handler=_ProxyHandler,
+            )
         self._running = True
-        logger.info(f"DNS Proxy starting on port {DNS_PROXY_PORT} (forwarding to {UPSTREAM_DNS})")
+        logger.info(f"DNS Proxy starting on port {DNS_PROXY_PORT} "
+                    f"(forwarding to {', '.join(s.name for s in self.resolver.pool.servers)})")
         self.server.start_thread()
-        logger.info("DNS Proxy is running.")
+        if self.tcp_server:
+            self.tcp_server.start_thread()
+        logger.info(f"DNS Proxy is running{' (UDP and TCP)' if self.tcp_server else ''}.")
 
     def stop(self):
         """Stop the DNS proxy server."""
         if self.server:
-            self.server.stop()
+            for server in (self.server, self.tcp_server):
+                if server:
+                    server.stop()
+                    server.server.server_close()
+            self.resolver.close()
             self._running = False
             logger.info("DNS Proxy stopped.")
 
+    def stats(self) -> dict:
+        """Proxy counters for the status endpoint."""
+        return {
+            "engine": "threaded",
+            "cache": self.resolver.cache.stats() if self.resolver else None,
+            "in_flight": self.resolver.in_flight.stats() if self.resolver else None,
+            "upstreams": self.resolver.pool.stats() if self.resolver else None,
+            "rate_limit": _rate_limit_stats(self.resolver.limiter, self.resolver.slots) if self.resolver else None,
+        }
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+
+# ── asyncio engine ──────────────────────────────────────────
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    """Receives client queries on the proxy port."""
+
+    def __init__(self, server: "AsyncDNSProxyServer"):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server._spawn(self.server._handle_query(data, addr, self.transport))
+
+
+class _RelayedProtocol(_ClientProtocol):
+    """Receives client queries relayed by the worker dispatcher, each behind a RELAY_HEADER."""
+
+    def datagram_received(self, data, addr):
+        if len(data) > RELAY_HEADER.size:
+            self.server._spawn(self.server._handle_relayed(data, addr, self.transport))
+
+
+class _UpstreamProtocol(asyncio.DatagramProtocol):
+    """One long-lived upstream socket. Answers are matched to waiters by transaction ID."""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}  # {txid: (future, upstream_addr)}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        txid = struct.unpack("!H", data[:2])[0]
+        waiter = self.pending.get(txid)
+        if not waiter:
+            return
+        future, upstream_addr = waiter
+        # Ignore answers from anyone other than the server we asked
+        if addr[0] != upstream_addr[0] or addr[1] != upstream_addr[1]:
+            return
+        del self.pending[txid]
+        if not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        logger.debug(f"Upstream socket error: {exc}")
+
+    def connection_lost(self, exc):
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Upstream socket closed"))
+        self.pending.clear()
+
+    def _new_txid(self) -> int:
+        """Pick a random transaction ID not already in flight on this socket."""
+        while True:
+            txid = random.getrandbits(16)
+            if txid not in self.pending:
+                return txid
+
+    async def query(self, data: bytes, upstream_addr: tuple, timeout: float) -> bytes:
+        """Send a query upstream under a fresh transaction ID and wait for its answer."""
+        loop = asyncio.get_running_loop()
+        txid = self._new_txid()
+        future = loop.create_future()
+        self.pending[txid] = (future, upstream_addr)
+        try:
+            self.transport.sendto(struct.pack("!H", txid) + data[2:], upstream_addr)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(txid, None)
+
+
+class _UpstreamTCP:
+    """
+    A persistent, pipelined TCP connection to one upstream server. Queries
+    go out under fresh transaction IDs as they arrive and a reader task
+    matches the answers back. Reconnects on the next query after the server
+    closes it.
+    """
+
+    def __init__(self, addr: tuple):
+        self.addr = addr
+        self._writer = None
+        self._pending = {}  # {txid: future} for the current connection
+        self._reader_task = None
+        self._connecting = asyncio.Lock()
+
+    async def _connect(self):
+        async with self._connecting:
+            if self._writer and not self._writer.is_closing():
+                return
+            reader, self._writer = await asyncio.open_connection(*self.addr)
+            self._pending = {}
+            self._reader_task = asyncio.get_running_loop().create_task(
+                self._read(reader, self._writer, self._pending))
+
+    async def _read(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pending: dict):
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                data = await reader.readexactly(struct.unpack("!H", header)[0])
+                future = pending.pop(struct.unpack("!H", data[:2])[0], None) if len(data) >= 12 else None
+                if future and not future.done():
+                    future.set_result(data)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Upstream TCP connection closed"))
+            pending.clear()
+
+    async def query(self, data: bytes, timeout: float) -> bytes:
+        """Send a query under a fresh transaction ID and wait for its answer."""
+        await asyncio.wait_for(self._connect(), timeout)
+        pending = self._pending
+        while True:
+            txid = random.getrandbits(16)
+            if txid not in pending:
+                break
+        future = asyncio.get_running_loop().create_future()
+        pending[txid] = future
+        try:
+            self._writer.write(frame(struct.pack("!H", txid) + data[2:]))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            pending.pop(txid, None)
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        if self._reader_task:
+            self._reader_task.cancel()
+
+
+class AsyncDNSProxyServer:
+    """
+    DNS proxy built on a single asyncio event loop (DNS_PROXY_ENGINE = "asyncio").
+    Client queries are handled as tasks and every in-flight upstream query is
+    multiplexed over a small pool of long-lived UDP sockets.
+
+    Proxy workers run one each: with reuse_port several bind the same port,
+    and with relay the UDP listener instead takes queries from the worker
+    dispatcher on a loopback port (relay_address, once started).
+    """
+
+    def __init__(self, servers: List[str] = None, port: int = DNS_PROXY_PORT,
+                 sockets: int = DNS_UPSTREAM_SOCKETS, reuse_port: bool = False,
+                 relay: bool = False, tcp: bool = DNS_PROXY_TCP, cache: DNSCache = None,
+                 limiter: ClientLimiter = None):
+        self.pool = UpstreamPool(servers)
+        self.port = port
+        self.reuse_port = reuse_port
+        self.relay = relay
+        self.relay_address = None
+        self.tcp = tcp
+        self._num_sockets = max(1, sockets)
+        self.cache = cache or DNSCache()
+        self.cache.prefetcher = self._prefetch
+        self.limiter = limiter or ClientLimiter()
+        self.slots = FairSlots()
+        self._loop = None
+        self._thread = None
+        self._listener = None
+        self._tcp_listener = None
+        self._upstreams = []
+        self._tcp_upstreams = {}  # {upstream addr: _UpstreamTCP}
+        self._next_upstream = 0
+        self._tasks = set()
+        self._flights = {}  # {cache key: upstream exchange task}
+        self._exchanges = 0
+        self._coalesced = 0
+        self._running = False
+
+    def _spawn(self, coro):
+        """Run a coroutine as a task, keeping a reference until it finishes."""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _tcp_to(self, server) -> _UpstreamTCP:
+        """The persistent TCP connection to an upstream server, created on first use."""
+        conn = self._tcp_upstreams.get(server.addr)
+        if not conn:
+            conn = self._tcp_upstreams[server.addr] = _UpstreamTCP(server.addr)
+        return conn
+
+    def _pick_socket(self) -> _UpstreamProtocol:
+        """Round-robin over the upstream sockets."""
+        proto = self._upstreams[self._next_upstream]
+        self._next_upstream = (self._next_upstream + 1) % len(self._upstreams)
+        return proto
+
+    async def _forward(self, data: bytes) -> bytes:
+        """Forward a raw query through the upstream pool, hedging to a second server when the first is slow."""
+        lookup = Lookup(self.pool)
+        pending = {}  # {task: Upstream}
+        try:
+            while not lookup.expired:
+                for server in lookup.due():
+                    query = self._pick_socket().query(data, server.addr, lookup.deadline - time.monotonic())
+                    pending[self._loop.create_task(query)] = server
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, timeout=lookup.wait(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    server = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception:
+                        lookup.error(server)
+                        continue
+                    if lookup.answer(server, response):
+                        return await self._untruncate(server, data, response)
+            return lookup.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _untruncate(self, server, data: bytes, response: bytes) -> bytes:
+        """The full answer for a truncated one, asked again over TCP; the truncated one if that fails."""
+        if not is_truncated(response):
+            return response
+        self.pool.record_tcp_retry()
+        try:
+            return await self._tcp_to(server).query(data, self.pool.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"TCP retry to {server.name} failed: {e}")
+            return response
+
+    async def _forward_shared(self, key, data: bytes) -> bytes:
+        """
+        Forward a query, letting concurrent identical queries (same key) wait
+        on the exchange already in flight. A key of None never shares.
+        """
+        flight = self._flights.get(key) if key else None
+        if flight:
+            self._coalesced += 1
+        else:
+            self._exchanges += 1
+            flight = self._loop.create_task(self._forward(data))
+            if key:
+                self._flights[key] = flight
+                flight.add_done_callback(lambda _: self._land(key, flight))
+        # One asker giving up must not cancel the exchange for the others
+        return await asyncio.shield(flight)
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _handle_query(self, data: bytes, addr: tuple, transport):
+        """Answer one UDP query, truncated if it doesn't fit the client's EDNS0 payload size."""
+        response = await self._answer(data, addr[0])
+        if response:
+            transport.sendto(fit_udp(response, data), addr)
+
+    async def _handle_relayed(self, packet: bytes, addr: tuple, transport):
+        """Answer one query relayed by the dispatcher, returning it behind the same header."""
+        header, data = packet[:RELAY_HEADER.size], packet[RELAY_HEADER.size:]
+        client_ip = socket.inet_ntoa(header[:4])
+        response = await self._answer(data, client_ip)
+        if response:
+            transport.sendto(header + fit_udp(response, data), addr)
+
+    async def _serve_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        One client TCP connection, kept open for further queries until the
+        client closes it or goes idle. Pipelined queries are answered as each
+        completes, which may be out of order (RFC 7766).
+        """
+        connection = asyncio.current_task()
+        self._tasks.add(connection)
+        client_ip = writer.get_extra_info("peername")[0]
+        answering = set()
+        try:
+            while True:
+                try:
+                    header = await asyncio.wait_for(reader.readexactly(2), DNS_TCP_IDLE_TIMEOUT)
+                    data = await reader.readexactly(struct.unpack("!H", header)[0])
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                task = self._loop.create_task(self._answer_tcp(data, client_ip, writer))
+                answering.add(task)
+                task.add_done_callback(answering.discard)
+            if answering:
+                await asyncio.wait(answering)
+        finally:
+            writer.close()
+            self._tasks.discard(connection)
+
+    async def _answer_tcp(self, data: bytes, client_ip: str, writer: asyncio.StreamWriter):
+        response = await self._answer(data, client_ip)
+        if response and not writer.is_closing():
+            writer.write(frame(response))
+
+    async def _answer(self, data: bytes, client_ip: str) -> Optional[bytes]:
+        """Log a client query and answer it from the cache or upstream; None to drop it."""
+        # Checked before the query is logged, so a flood never reaches the database
+        if not self.limiter.admit(client_ip):
+            return self.limiter.refusal(data)
+
+        # Plain queries are read off the wire; dnslib only sees the rest
+        question = parse_query(data)
+        request = None
+        if question:
+            txid, qname, qtype, qclass = question
+            key = (qname.lower(), qtype, qclass, edns_state(data))
+        else:
+            try:
+                request = DNSRecord.parse(data)
+            except DNSError as e:
+                logger.debug(f"Dropping malformed query from {client_ip}: {e}")
+                return None
+            txid, qname, qtype = request.header.id, str(request.q.qname), request.q.qtype
+            key = DNSCache.key_for(request)
+
+        if _query_sink:
+            # A worker's sink only buffers the record
+            _log_query(client_ip, qname, QTYPE[qtype])
+        else:
+            # SQLite work stays off the event loop
+            self._loop.run_in_executor(None, _log_query, client_ip, qname, QTYPE[qtype])
+
+        cached = self.cache.get(key, txid)
+        if cached:
+            return cached
+
+        response = await self._fetch(key, key if question else None, data, txid, client_ip)
+        if response:
+            return response
+        if request:
+            reply = request.reply()
+            reply.header.rcode = 2  # SERVFAIL
+            return reply.pack()
+        return servfail(data)
+
+    async def _fetch(self, key, share_key, data: bytes, txid: int, client_ip: str) -> Optional[bytes]:
+        """
+        Forward a query (sharing the exchange with identical ones under
+        share_key) once the client has an upstream slot, and cache the
+        answer. If upstream fails, the stale cached answer stands in; None
+        if there is none and nothing came back. REFUSED if the client
+        already has too many lookups outstanding.
+        """
+        try:
+            await self.slots.wait_async(client_ip, self.pool.timeout)
+        except ClientQueueFull:
+            self.limiter.limited(client_ip, "queue_full")
+            return refused(data)
+        except TimeoutError:
+            logger.warning(f"No upstream slot for {client_ip} in time")
+            return self.cache.get_stale(key, txid)
+        try:
+            response = await self._forward_shared(share_key, data)
+        except Exception as e:
+            logger.error(f"Upstream DNS failed: {e}")
+            return self.cache.get_stale(key, txid)
+        finally:
+            self.slots.release(client_ip)
+        # Hand the answer back under the client's own transaction ID
+        if _failed(response):
+            return self.cache.get_stale(key, txid) or data[:2] + response[2:]
+        self.cache.put(key, response)
+        return data[:2] + response[2:]
+
+    def _prefetch(self, key):
+        """Cache hook, called on the event loop: refresh a popular answer before it expires."""
+        query = build_query(*key, random.getrandbits(16))
+        if query:
+            self._spawn(self._refresh(key, query))
+        else:
+            self.cache.refresh_done(key)
+
+    async def _refresh(self, key, query: bytes):
+        """Fetch a fresh answer for key; failures leave the cached one in place, like _fetch."""
+        failed = True
+        try:
+            response = await self._forward_shared(key, query)
+            if _failed(response):
+                logger.debug(f"Prefetch of {key[0]} answered rcode {rcode(response)}")
+            else:
+                self.cache.put(key, response, prefetched=True)
+                failed = False
+        except Exception as e:
+            logger.debug(f"Prefetch of {key[0]} failed: {e}")
+        finally:
+            self.cache.refresh_done(key, failed)
+
+    async def _open(self):
+        """Bind the listener and open the upstream sockets."""
+        if self.relay:
+            self._listener, _ = await self._loop.create_datagram_endpoint(
+                lambda: _RelayedProtocol(self),
+                local_addr=("127.0.0.1", 0),
+            )
+            self.relay_address = self._listener.get_extra_info("sockname")
+        else:
+            self._listener, _ = await self._loop.create_datagram_endpoint(
+                lambda: _ClientProtocol(self),
+                local_addr=("0.0.0.0", self.port),
+                reuse_port=self.reuse_port or None,
+            )
+        if self.tcp:
+            self._tcp_listener = await asyncio.start_server(
+                self._serve_tcp, "0.0.0.0", self.port, reuse_port=self.reuse_port or None)
+        for _ in range(self._num_sockets):
+            _, proto = await self._loop.create_datagram_endpoint(
+                _UpstreamProtocol,
+                local_addr=("0.0.0.0", 0),
+            )
+            self._upstreams.append(proto)
+
+    async def _close(self):
+        """Close all sockets and cancel in-flight queries."""
+        if self._listener:
+            self._listener.close()
+        if self._tcp_listener:
+            self._tcp_listener.close()
+        for conn in self._tcp_upstreams.values():
+            conn.close()
+        for proto in self._upstreams:
+            if proto.transport:
+                proto.transport.close()
+        for task in list(self._tasks) + list(self._flights.values()):
+            task.cancel()
+        self._upstreams = []
+        self._tcp_upstreams = {}
+
+    def start(self):
+        """Start the DNS proxy event loop in a background thread."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"DNS Proxy (asyncio) starting on port {self.port} "
+                    f"(forwarding to {', '.join(s.name for s in self.pool.servers)})")
+        asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+        self._running = True
+        logger.info(f"DNS Proxy is running ({self._num_sockets} upstream sockets).")
+
+    def stop(self):
+        """Stop the DNS proxy server."""
+        if not self._loop:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout=5)
+        except Exception as e:
+            logger.error(f"Error closing DNS proxy sockets: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+        self._running = False
+        logger.info("DNS Proxy stopped.")
+
+    def stats(self) -> dict:
+        """Proxy counters for the status endpoint."""
+        return {
+            "engine": "asyncio",
+            "cache": self.cache.stats(),
+            "in_flight": _coalesce_stats(self._exchanges, self._coalesced),
+            "upstreams": self.pool.stats(),
+            "rate_limit": _rate_limit_stats(self.limiter, self.slots),
+        }
+
     @property
     def is_running(self) -> bool:
         return self._running
@@ -0,0 +1,297 @@
+"""
+DNS wire format — just enough of it for the proxy's hot path.
+Reads the question out of a raw query and the cache-relevant parts of a raw
+answer without building dnslib objects, so packets can be forwarded and
+relayed byte for byte. Anything unusual or malformed returns None and the
+caller falls back to dnslib.
+"""
+import socket
+import struct
+from typing import List, Optional, Tuple
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR_FIXED = struct.Struct("!HHIH")     # type, class, ttl, rdlength
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+
+_QR = 0x8000
+_OPCODE = 0x7800
+_AA = 0x0400
+_TC = 0x0200
+_RD = 0x0100
+_RA = 0x0080
+_RCODE = 0x000F
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_REFUSED = 5
+
+TYPE_SOA = 6
+TYPE_OPT = 41
+
+# What a query asks of EDNS, which changes the answer (OPT record, RRSIGs):
+# no OPT record, OPT without the DNSSEC OK bit, OPT with it
+EDNS_NONE = 0
+EDNS_PLAIN = 1
+EDNS_DO = 2
+_DO = 0x8000
+
+# Largest UDP answer a client without EDNS0 accepts (RFC 1035)
+UDP_PAYLOAD_DEFAULT = 512
+
+# EDNS0 payload size the proxy advertises in queries of its own (DNS Flag Day 2020)
+UDP_PAYLOAD_OWN = 1232
+
+# Label bytes dnslib prints as-is; names using anything else ('.' inside a
+# label, spaces, non-ASCII) take the dnslib path so logs and cache keys agree.
+_PLAIN = bytes(c for c in range(0x21, 0x7f) if c != ord("."))
+
+
+def parse_query(data: bytes) -> Optional[Tuple[int, str, int, int]]:
+    """
+    (txid, qname, qtype, qclass) of a standard single-question query, with
+    qname spelled the way dnslib prints it ("example.com."). None for
+    responses, other opcodes, compressed or unprintable names and packets
+    that carry answer or authority records.
+    """
+    if len(data) < 17:
+        return None
+    txid, flags, qdcount, ancount, nscount, _ = _HEADER.unpack_from(data)
+    if flags & (_QR | _OPCODE) or qdcount != 1 or ancount or nscount:
+        return None
+    labels = []
+    pos = 12
+    while True:
+        length = data[pos]
+        if not length:
+            break
+        # Compression pointers (0xC0) and extended label types never appear here
+        if length > 63:
+            return None
+        label = data[pos + 1:pos + 1 + length]
+        if len(label) != length or label.translate(None, _PLAIN):
+            return None
+        labels.append(label)
+        pos += length + 1
+        if pos > 255 + 12 or pos >= len(data):
+            return None
+    if pos + 5 > len(data):
+        return None
+    qtype, qclass = struct.unpack_from("!HH", data, pos + 1)
+    qname = b".".join(labels).decode("ascii") + "." if labels else "."
+    return txid, qname, qtype, qclass
+
+
+def _skip_name(data: bytes, pos: int) -> int:
+    """Offset just past a possibly compressed name; IndexError if it runs off the end."""
+    while True:
+        length = data[pos]
+        if not length:
+            return pos + 1
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        if length & 0xC0:
+            raise IndexError("unsupported label type")
+        pos += length + 1
+
+
+def scan_answer(data: bytes) -> Optional[Tuple[Optional[int], List[int]]]:
+    """
+    Walk an upstream answer once. Returns how long it may be cached (None
+    if it must not be) and the offsets of every record's TTL field, OPT
+    excluded, so a cached copy can be aged in place. Positive answers live
+    for their minimum answer TTL; NXDOMAIN and NODATA answers for the SOA
+    minimum (RFC 2308). None if the packet is malformed.
+    """
+    try:
+        _, flags, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(data)
+        pos = 12
+        for _ in range(qdcount):
+            pos = _skip_name(data, pos) + 4
+        offsets = []
+        answer_ttl = soa_ttl = None
+        for i in range(ancount + nscount + arcount):
+            pos = _skip_name(data, pos)
+            rtype, _, ttl, rdlength = _RR_FIXED.unpack_from(data, pos)
+            end = pos + 10 + rdlength
+            if end > len(data):
+                return None
+            if rtype != TYPE_OPT:
+                offsets.append(pos + 4)
+            if i < ancount:
+                answer_ttl = ttl if answer_ttl is None else min(answer_ttl, ttl)
+            elif i < ancount + nscount and rtype == TYPE_SOA and soa_ttl is None and rdlength >= 22:
+                soa_ttl = min(ttl, _U32.unpack_from(data, end - 4)[0])
+            pos = end
+    except (IndexError, struct.error):
+        return None
+
+    rcode = flags & _RCODE
+    if flags & _TC:
+        return None, offsets
+    if rcode == RCODE_NOERROR and ancount:
+        return answer_ttl, offsets
+    if rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+        return soa_ttl, offsets
+    return None, offsets
+
+
+def readdress(data: bytes, txid: int, ttl_offsets: List[int], age: int) -> bytes:
+    """A copy of a cached answer under txid with its TTLs reduced by age seconds."""
+    if not age or not ttl_offsets:
+        return _U16.pack(txid) + data[2:]
+    out = bytearray(data)
+    _U16.pack_into(out, 0, txid)
+    for offset in ttl_offsets:
+        _U32.pack_into(out, offset, max(0, _U32.unpack_from(out, offset)[0] - age))
+    return bytes(out)
+
+
+def restamp(data: bytes, txid: int, ttl_offsets: List[int], ttl: int) -> bytes:
+    """A copy of a cached answer under txid with every TTL set to ttl (serve-stale answers)."""
+    out = bytearray(data)
+    _U16.pack_into(out, 0, txid)
+    for offset in ttl_offsets:
+        _U32.pack_into(out, offset, ttl)
+    return bytes(out)
+
+
+def edns_state(query: bytes) -> int:
+    """EDNS_NONE, EDNS_PLAIN or EDNS_DO for a query, from its OPT record."""
+    try:
+        _, _, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(query)
+        if not arcount:
+            return EDNS_NONE
+        pos = 12
+        for _ in range(qdcount):
+            pos = _skip_name(query, pos) + 4
+        for i in range(ancount + nscount + arcount):
+            pos = _skip_name(query, pos)
+            rtype, _, ttl, rdlength = _RR_FIXED.unpack_from(query, pos)
+            if rtype == TYPE_OPT and i >= ancount + nscount:
+                # An OPT record's TTL field carries the EDNS flags
+                return EDNS_DO if ttl & _DO else EDNS_PLAIN
+            pos += 10 + rdlength
+    except (IndexError, struct.error):
+        pass
+    return EDNS_NONE
+
+
+def build_query(qname: str, qtype: int, qclass: int, edns: int, txid: int) -> Optional[bytes]:
+    """
+    A recursive query for a cache key the proxy asks on its own behalf,
+    with the key's EDNS state (advertising UDP_PAYLOAD_OWN). None for
+    names parse_query wouldn't have produced (escaped or non-ASCII labels).
+    """
+    name = qname.rstrip(".")
+    if "\\" in name:
+        return None
+    try:
+        labels = [label.encode("ascii") for label in name.split(".")] if name else []
+    except UnicodeEncodeError:
+        return None
+    if any(not 0 < len(label) <= 63 for label in labels):
+        return None
+    wire = b"".join(bytes([len(label)]) + label for label in labels) + b"\0"
+    question = wire + struct.pack("!HH", qtype, qclass)
+    if edns == EDNS_NONE:
+        return _HEADER.pack(txid, _RD, 1, 0, 0, 0) + question
+    opt = b"\0" + _RR_FIXED.pack(TYPE_OPT, UDP_PAYLOAD_OWN, _DO if edns == EDNS_DO else 0, 0)
+    return _HEADER.pack(txid, _RD, 1, 0, 0, 1) + question + opt
+
+
+def rcode(response: bytes) -> int:
+    """The response code of an answer; SERVFAIL if it is too short to have one."""
+    return _U16.unpack_from(response, 2)[0] & _RCODE if len(response) >= 12 else RCODE_SERVFAIL
+
+
+def servfail(query: bytes) -> bytes:
+    """SERVFAIL for a query parse_query accepted, echoing its question."""
+    _, flags, _, _, _, _ = _HEADER.unpack_from(query)
+    end = _skip_name(query, 12) + 4
+    flags = _QR | _AA | (flags & _RD) | _RA | RCODE_SERVFAIL
+    return query[:2] + struct.pack("!HHHHH", flags, 1, 0, 0, 0) + query[12:end]
+
+
+def refused(query: bytes) -> bytes:
+    """REFUSED for any query with a full header, echoing its first question if that can be read."""
+    _, flags, qdcount, _, _, _ = _HEADER.unpack_from(query)
+    try:
+        end = _skip_name(query, 12) + 4 if qdcount else 12
+    except IndexError:
+        end = 12
+    if end > len(query):
+        end = 12
+    flags = _QR | _AA | (flags & _RD) | _RA | RCODE_REFUSED
+    return query[:2] + struct.pack("!HHHHH", flags, 1 if end > 12 else 0, 0, 0, 0) + query[12:end]
+
+
+def is_truncated(response: bytes) -> bool:
+    """Whether an answer has the TC bit set."""
+    return len(response) >= 12 and bool(_U16.unpack_from(response, 2)[0] & _TC)
+
+
+def udp_payload_size(query: bytes) -> int:
+    """The largest UDP answer the asking client accepts: its EDNS0 payload size, or 512 without EDNS."""
+    try:
+        _, _, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(query)
+        pos = 12
+        for _ in range(qdcount):
+            pos = _skip_name(query, pos) + 4
+        for i in range(ancount + nscount + arcount):
+            pos = _skip_name(query, pos)
+            rtype, rclass, _, rdlength = _RR_FIXED.unpack_from(query, pos)
+            if rtype == TYPE_OPT and i >= ancount + nscount:
+                # An OPT record's class field carries the payload size
+                return max(UDP_PAYLOAD_DEFAULT, rclass)
+            pos += 10 + rdlength
+    except (IndexError, struct.error):
+        pass
+    return UDP_PAYLOAD_DEFAULT
+
+
+def truncate(response: bytes) -> bytes:
+    """Header and question of an answer with TC set, telling the client to ask again over TCP."""
+    _, flags, qdcount, _, _, _ = _HEADER.unpack_from(response)
+    try:
+        end = 12
+        for _ in range(qdcount):
+            end = _skip_name(response, end) + 4
+    except IndexError:
+        qdcount, end = 0, 12
+    return response[:2] + struct.pack("!HHHHH", flags | _TC, qdcount, 0, 0, 0) + response[12:end]
+
+
+def fit_udp(response: bytes, query: bytes) -> bytes:
+    """The answer as a UDP reply to query: itself if it fits the client's payload size, else truncated."""
+    if len(response) <= UDP_PAYLOAD_DEFAULT or len(response) <= udp_payload_size(query):
+        return response
+    return truncate(response)
+
+
+def frame(message: bytes) -> bytes:
+    """A message with the two-byte length prefix DNS over TCP uses."""
+    return _U16.pack(len(message)) + message
+
+
+def recv_framed(sock: socket.socket) -> Optional[bytes]:
+    """Read one length-prefixed message from a TCP socket; None if the peer closed it first."""
+    header = _recv_exactly(sock, 2)
+    if header is None:
+        return None
+    message = _recv_exactly(sock, _U16.unpack(header)[0])
+    if message is None:
+        raise ConnectionError("Connection closed mid-message")
+    return message
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
@@ -4,6 +4,8 @@ Automatically flags and categorizes domains by type.
 Works purely from DNS data — no phone access needed.
 """
 import logging
+from collections import deque
+from functools import lru_cache
 from typing import Dict, List, Optional
 
 logger = logging.getLogger("domain_categories")
@@ -121,31 +123,164 @@ CATEGORIES = {
 }
 
 
+# Distinct domains whose category lookups are remembered
+CACHE_SIZE = 65536
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over keyword substrings.
+    Each keyword carries a rank; search() returns the lowest rank of any
+    keyword found in the text.
+    """
+
+    def __init__(self, keywords: List[tuple]):
+        self._goto = [{}]          # node -> {char: node}
+        self._fail = [0]
+        self._rank = [None]        # lowest rank ending at (or failing into) node
+
+        for word, rank in keywords:
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._rank.append(None)
+                node = nxt
+            if self._rank[node] is None or rank < self._rank[node]:
+                self._rank[node] = rank
+
+        # Breadth-first: fail links, and inherit ranks from fail targets
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                inherited = self._rank[self._fail[nxt]]
+                if inherited is not None and (self._rank[nxt] is None or inherited < self._rank[nxt]):
+                    self._rank[nxt] = inherited
+
+    def __bool__(self):
+        return len(self._goto) > 1
+
+    def search(self, text: str) -> Optional[int]:
+        """Lowest rank of any keyword contained in text, or None."""
+        goto, fail, ranks = self._goto, self._fail, self._rank
+        best = None
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            rank = ranks[node]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+        return best
+
+
+class Categorizer:
+    """
+    Matcher compiled once from a categories dict.
+    Known domains live in one hash keyed by domain, looked up once per label
+    suffix (a.b.c.com -> b.c.com -> c.com -> com); keywords go through an
+    Aho-Corasick automaton. Category order is the rank, so the first category
+    that matches either way wins, as with the original linear scan.
+    An optional DomainList (see blocklists.py) adds imported list entries,
+    checked per suffix the same way.
+    """
+
+    def __init__(self, categories: Dict[str, Dict], domain_list=None):
+        categories = dict(categories)
+        if domain_list:
+            for cat_id, meta in domain_list.categories.items():
+                categories.setdefault(cat_id, {**meta, "domains": [], "keywords": []})
+        self.categories = categories
+        self.domain_list = domain_list
+        self.results = []
+        self._suffixes = {}
+        keywords = []
+
+        for rank, (cat_id, cat) in enumerate(categories.items()):
+            self.results.append({
+                "category": cat_id,
+                "label": cat["label"],
+                "severity": cat["severity"],
+            })
+            for known_domain in cat["domains"]:
+                self._suffixes.setdefault(known_domain.lower(), rank)
+            for keyword in cat["keywords"]:
+                keywords.append((keyword.lower(), rank))
+
+        self._keywords = KeywordAutomaton(keywords)
+        ranks = {cat_id: rank for rank, cat_id in enumerate(categories)}
+        self._list_ranks = [ranks[cat_id] for cat_id in domain_list.categories] if domain_list else []
+        # Per-instance, so swapping in a new categorizer also drops old results
+        self.lookup = lru_cache(maxsize=CACHE_SIZE)(self.match)
+
+    def match(self, domain: str) -> Optional[int]:
+        """Rank of the category a normalized domain belongs to, or None."""
+        suffixes = self._suffixes
+        best = suffixes.get(domain)
+        dot = domain.find(".")
+        while dot >= 0:
+            rank = suffixes.get(domain[dot + 1:])
+            if rank is not None and (best is None or rank < best):
+                best = rank
+            dot = domain.find(".", dot + 1)
+
+        if self.domain_list and best != 0:
+            index = self.domain_list.match(domain)
+            if index is not None:
+                rank = self._list_ranks[index]
+                if best is None or rank < best:
+                    best = rank
+
+        if self._keywords and best != 0:
+            rank = self._keywords.search(domain)
+            if rank is not None and (best is None or rank < best):
+                best = rank
+        return best
+
+
+_categorizer = Categorizer(CATEGORIES)
+
+
+def get_categorizer() -> Categorizer:
+    """The matcher currently in use."""
+    return _categorizer
+
+
+def install_categorizer(categorizer: Categorizer):
+    """Swap in a new matcher; lookups already running finish on the old one."""
+    global _categorizer
+    _categorizer = categorizer
+
+
+def rebuild_categorizer():
+    """Recompile the matcher after CATEGORIES has been changed, keeping any imported lists."""
+    install_categorizer(Categorizer(CATEGORIES, _categorizer.domain_list))
+
+
 def categorize_domain(domain: str) -> Optional[Dict]:
     """
     Check if a domain belongs to a known category.
     Returns {"category": "adult", "label": "...", "severity": "high"} or None.
     """
-    domain = domain.lower().rstrip(".")
-
-    for cat_id, cat in CATEGORIES.items():
-        for known_domain in cat["domains"]:
-            if domain == known_domain or domain.endswith("." + known_domain):
-                return {
-                    "category": cat_id,
-                    "label": cat["label"],
-                    "severity": cat["severity"],
-                }
-
-        for keyword in cat["keywords"]:
-            if keyword in domain:
-                return {
-                    "category": cat_id,
-                    "label": cat["label"],
-                    "severity": cat["severity"],
-                }
-
-    return None
+    categorizer = _categorizer
+    rank = categorizer.lookup(domain.lower().rstrip("."))
+    if rank is None:
+        return None
+    return dict(categorizer.results[rank])
 
 
 def categorize_batch(domains: List[str]) -> Dict[str, List[Dict]]:
@@ -0,0 +1,109 @@
+"""
+Live Query Feed — in-process fan-out of freshly committed DNS queries.
+The log writer publishes each committed batch; every stream subscriber gets
+the events that match its filter on its own event loop. A subscriber that
+falls too far behind is told it lagged and catches up from the database
+(events carry the row id), so nothing is lost.
+"""
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, List
+
+logger = logging.getLogger("live_feed")
+
+# Per-subscriber buffer before it is marked as lagging
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Marker a subscriber receives after overflowing its buffer
+LAGGED = object()
+
+
+class Subscription:
+    """One stream consumer; only touched from its own event loop except for _deliver scheduling."""
+
+    def __init__(self, feed: "LiveFeed", loop: asyncio.AbstractEventLoop,
+                 predicate: Callable[[Dict], bool], maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.feed = feed
+        self.loop = loop
+        self.predicate = predicate
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+
+    def _deliver(self, events: List[Dict]):
+        """Queue matching events (runs on the subscriber's loop)."""
+        if self.lagged:
+            return
+        for event in events:
+            if not self.predicate(event):
+                continue
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Drop the backlog; the consumer re-reads it from the database
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(LAGGED)
+                self.lagged = True
+                self.feed.lagged += 1
+                return
+
+    async def get(self, timeout: float):
+        """Next event, LAGGED, or None if nothing arrived within timeout."""
+        try:
+            item = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if item is LAGGED:
+            # Buffer again from here; the consumer replays what it missed
+            self.lagged = False
+        return item
+
+
+class LiveFeed:
+    """Thread-safe publisher with per-subscriber filtering."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.lagged = 0
+
+    def subscribe(self, predicate: Callable[[Dict], bool] = lambda event: True) -> Subscription:
+        """Register a consumer on the running event loop."""
+        sub = Subscription(self, asyncio.get_running_loop(), predicate)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, events: List[Dict]):
+        """Fan committed events out to every subscriber (called from the writer thread)."""
+        if not events:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        self.published += len(events)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, events)
+            except RuntimeError:
+                # Loop already closed; the stream is gone
+                self.unsubscribe(sub)
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "lagged": self.lagged,
+        }
+
+
+feed = LiveFeed()
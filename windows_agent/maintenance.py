@@ -0,0 +1,156 @@
+"""
+Windows Remote Network Monitor — Database maintenance commands.
+Run from the agent directory (the agent may keep running):
+
+Usage:
+    python maintenance.py backfill-search
+    python maintenance.py rebuild-rollups
+    python maintenance.py recategorize
+    python maintenance.py rebuild-alerts
+    python maintenance.py partitions
+    python maintenance.py apply-retention --days 365 --archive-after 90
+    python maintenance.py archive 2026-01
+    python maintenance.py recount-stats
+"""
+import argparse
+import logging
+import sys
+
+from config import LOG_LEVEL, CATEGORY_LISTS, DB_RETENTION_DAYS, DB_ARCHIVE_AFTER_DAYS
+from db import (
+    init_db, rebuild_search_index, rebuild_rollups, recategorize, rebuild_alerts,
+    list_partitions, apply_retention, archive_partition, recount_query_stats,
+)
+from blocklists import reload_category_lists
+
+logging.basicConfig(
+    level=getattr(logging, LOG_LEVEL),
+    format="%(asctime)s [%(name)s] %(levelname)s: %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+logger = logging.getLogger("maintenance")
+
+
+def cmd_backfill_search(args):
+    """Rebuild the /dns/search index from the domain dictionary."""
+    count = rebuild_search_index()
+    logger.info(f"Search index ready: {count} distinct domains.")
+
+
+def cmd_rebuild_rollups(args):
+    """Recompute the hourly report/timeline rollups from the raw log."""
+    count = rebuild_rollups()
+    logger.info(f"Rollups ready: {count} device/domain/hour rows.")
+
+
+def cmd_recategorize(args):
+    """Re-tag logged queries after category lists or severities change."""
+    if CATEGORY_LISTS:
+        reload_category_lists()
+    count = recategorize()
+    logger.info(f"Recategorized: {count} domains changed category.")
+
+
+def cmd_rebuild_alerts(args):
+    """Recompute the alerts table from the tagged log."""
+    count = rebuild_alerts()
+    logger.info(f"Alerts ready: {count} device/domain/window rows.")
+
+
+def cmd_partitions(args):
+    """List the query log's partitions, newest first."""
+    for p in list_partitions():
+        span = f"{p['from']} .. {p['to']}" if p["from"] else "(empty)"
+        logger.info(f"{p['name']:<14} {p['state']:<9} {p['rows']:>12} queries  "
+                    f"{p['bytes'] / 1048576:>9.1f} MB  {span}")
+
+
+def cmd_apply_retention(args):
+    """Drop and archive old partitions now, instead of waiting for the agent."""
+    result = apply_retention(args.days, args.archive_after)
+    logger.info(f"Dropped: {', '.join(result['dropped']) or 'none'}. "
+                f"Archived: {', '.join(result['archived']) or 'none'}.")
+
+
+def cmd_archive(args):
+    """Convert one closed partition into a compressed segment."""
+    try:
+        sizes = archive_partition(args.name)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    logger.info(f"Archived {sizes['name']}: {sizes['bytes'] / 1048576:.1f} MB -> "
+                f"{sizes['archive_bytes'] / 1048576:.1f} MB.")
+
+
+def cmd_recount_stats(args):
+    """Recount the /status totals from the log (a running agent keeps its own until restarted)."""
+    stats = recount_query_stats()
+    logger.info(f"Status counters: {stats['total_queries']} queries, "
+                f"{stats['queries_today']} today, {stats['unique_devices']} devices.")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="maintenance",
+        description="Windows Remote Network Monitor — database maintenance",
+    )
+    sub = parser.add_subparsers(dest="command", help="Available commands")
+
+    # backfill-search
+    p_backfill = sub.add_parser("backfill-search", help="Rebuild the /dns/search index")
+    p_backfill.set_defaults(func=cmd_backfill_search)
+
+    # rebuild-rollups
+    p_rollups = sub.add_parser("rebuild-rollups", help="Rebuild hourly rollups used by reports and timelines")
+    p_rollups.set_defaults(func=cmd_rebuild_rollups)
+
+    # recategorize
+    p_recat = sub.add_parser(
+        "recategorize",
+        help="Re-tag logged queries with current categories (a running agent does this on /categories/reload)",
+    )
+    p_recat.set_defaults(func=cmd_recategorize)
+
+    # rebuild-alerts
+    p_alerts = sub.add_parser("rebuild-alerts", help="Rebuild the alerts table from the query log")
+    p_alerts.set_defaults(func=cmd_rebuild_alerts)
+
+    # partitions
+    p_parts = sub.add_parser("partitions", help="List query log partitions")
+    p_parts.set_defaults(func=cmd_partitions)
+
+    # apply-retention
+    p_retention = sub.add_parser("apply-retention", help="Drop and archive old partitions now")
+    p_retention.add_argument("--days", type=int, default=DB_RETENTION_DAYS,
+                             help="Drop partitions older than this many days, 0 keeps all (default: config)")
+    p_retention.add_argument("--archive-after", type=int, default=DB_ARCHIVE_AFTER_DAYS,
+                             help="Compress partitions older than this many days, 0 never (default: config)")
+    p_retention.set_defaults(func=cmd_apply_retention)
+
+    # archive
+    p_archive = sub.add_parser("archive", help="Compress a closed partition")
+    p_archive.add_argument("name", help="Partition name, as listed by 'partitions' (e.g. 2026-01)")
+    p_archive.set_defaults(func=cmd_archive)
+
+    # recount-stats
+    p_recount = sub.add_parser("recount-stats", help="Recount the /status totals from the query log")
+    p_recount.set_defaults(func=cmd_recount_stats)
+
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return
+
+    init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
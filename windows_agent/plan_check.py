@@ -0,0 +1,169 @@
+"""
+Windows Remote Network Monitor — Query plan regression check.
+Seeds a scratch database through the normal ingest path, runs every read
+in db.py with SQL tracing on, and asks SQLite how it would execute each
+statement. Exits non-zero if any of them scans a table that grows with
+traffic, so a dropped or shadowed index is caught before it ships.
+test_query_plans.py runs the same check under pytest.
+
+Usage:
+    python plan_check.py
+    python plan_check.py --verbose
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import tempfile
+
+from config import LOG_LEVEL
+import db
+
+logging.basicConfig(
+    level=getattr(logging, LOG_LEVEL),
+    format="%(asctime)s [%(name)s] %(levelname)s: %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+logger = logging.getLogger("plan_check")
+
+# Tables that grow with traffic; a full scan of any of them is a regression
+WATCHED_TABLES = {"dns_queries", "domains", "alerts", "hourly_device_domain_counts"}
+
+# Deliberate full scans: statement prefix -> why it is acceptable
+ALLOWED_SCANS = {
+    "SELECT id FROM domains WHERE name LIKE": "search terms shorter than a trigram scan the dictionary",
+}
+
+_SQL_WORDS = {"WHERE", "JOIN", "LEFT", "INNER", "ON", "GROUP", "ORDER", "LIMIT", "USING", "SET", "AS"}
+# Partition tables are schema-qualified (p1.dns_queries); plans name them unqualified
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+
+
+def _seed():
+    """A little traffic from two devices, including flagged domains and one broad name family."""
+    for i in range(400):
+        db.log_dns_query("10.0.0.2" if i % 2 else "10.0.0.3", f"site{i % 40}.example.com",
+                         source_mac=f"aa:bb:cc:dd:ee:0{i % 3}")
+    for name in ("www.pornhub.com", "tinder.com", "nordvpn.com"):
+        db.log_dns_query("10.0.0.2", name)
+    db.upsert_device("10.0.0.2", "aa:bb:cc:dd:ee:01", "laptop")
+
+
+def _scenarios():
+    """(name, call) for every read path, covering each branch that issues different SQL."""
+    first = db.get_recent_queries(limit=5)
+    device = db.get_queries_by_device("10.0.0.2", limit=5)
+    broad = db.search_queries("example", limit=5)
+    narrow = db.search_queries("tinder", limit=1)
+    alerts = db.get_recent_alerts(hours=24, limit=1)
+    return [
+        ("get_recent_queries", lambda: db.get_recent_queries(limit=5)),
+        ("get_recent_queries offset", lambda: db.get_recent_queries(limit=5, offset=10)),
+        ("get_recent_queries before_id", lambda: db.get_recent_queries(limit=5, before_id=first["next_cursor"])),
+        ("get_recent_queries after_id", lambda: db.get_recent_queries(limit=5, after_id=first["next_cursor"])),
+        ("get_last_query_id", db.get_last_query_id),
+        ("get_queries_since", lambda: db.get_queries_since(0)),
+        ("get_queries_since filtered", lambda: db.get_queries_since(
+            0, ip="10.0.0.2", min_severity=db.SEVERITY_LEVELS["medium"], category="adult")),
+        ("search_queries narrow", lambda: db.search_queries("tinder", limit=1, before_id=narrow["next_cursor"])),
+        ("search_queries broad", lambda: db.search_queries("example", limit=5, before_id=broad["next_cursor"])),
+        ("search_queries dates", lambda: db.search_queries("example", limit=5, from_date="2020-01-01", to_date="2100-01-01")),
+        ("search_queries short term", lambda: db.search_queries("ti", limit=5)),
+        ("get_queries_by_device", lambda: db.get_queries_by_device("10.0.0.2", limit=5)),
+        ("get_queries_by_device page", lambda: db.get_queries_by_device(
+            "10.0.0.2", limit=5, from_date="2020-01-01", before_id=device["next_cursor"])),
+        ("get_device_report", lambda: db.get_device_report("10.0.0.2")),
+        ("get_activity_timeline", lambda: db.get_activity_timeline("10.0.0.2")),
+        ("export_queries", lambda: db.export_queries(limit=5, after=[0, 0])),
+        ("export_queries filtered", lambda: db.export_queries(
+            limit=5, from_date="2020-01-01", ip="10.0.0.2", category="adult")),
+        ("export_queries category", lambda: db.export_queries(limit=5, category="adult")),
+        ("recount_query_stats", db.recount_query_stats),
+        ("get_all_devices", db.get_all_devices),
+        ("get_unique_domains", lambda: db.get_unique_domains()),
+        ("get_unique_domains device", lambda: db.get_unique_domains(ip="10.0.0.2", category="adult")),
+        ("get_recent_alerts", lambda: db.get_recent_alerts(hours=24, limit=1, cursor=alerts["next_cursor"])),
+        ("get_recent_alerts device", lambda: db.get_recent_alerts(hours=24, ip="10.0.0.2", category="dating")),
+    ]
+
+
+def _full_scans(conn, sql: str):
+    """Plan lines that read a whole watched table (or its whole index)."""
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        if table in WATCHED_TABLES:
+            aliases[table] = table
+            if alias and alias.upper() not in _SQL_WORDS:
+                aliases[alias] = table
+    plan = [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    # An unfiltered read in index order that stops at LIMIT ("newest N") is bounded
+    if " LIMIT " in sql and " WHERE " not in sql and not any("TEMP B-TREE" in line for line in plan):
+        return plan, []
+    scans = [line for line in plan if line.startswith("SCAN ") and line.split()[1] in aliases]
+    return plan, scans
+
+
+def check(verbose: bool = False) -> int:
+    """Run every scenario; returns the number of statements that regressed."""
+    conn = db.get_conn()
+    failures = 0
+    for name, call in _scenarios():
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+
+        selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+        if not selects:
+            logger.warning(f"{name}: issued no SELECT; scenario needs seed data")
+            failures += 1
+        for sql in selects:
+            plan, scans = _full_scans(conn, sql)
+            allowed = next((why for prefix, why in ALLOWED_SCANS.items() if sql.startswith(prefix)), None)
+            if scans and not allowed:
+                failures += 1
+                logger.error(f"{name}: full scan\n    {sql}\n    " + "\n    ".join(plan))
+            elif verbose:
+                note = f" (allowed: {allowed})" if scans else ""
+                logger.info(f"{name}{note}\n    {sql}\n    " + "\n    ".join(plan))
+    return failures
+
+
+def run(verbose: bool = False) -> int:
+    """Seed a scratch database, check every read against it and return the regressions."""
+    db_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before the first connection, so nothing touches the agent's database
+        db.DB_PATH = os.path.join(tmp, "plan_check.db")
+        try:
+            db.init_db()
+            _seed()
+            return check(verbose)
+        finally:
+            # Windows will not delete an open database file
+            db.get_conn().close()
+            db._local.conn = None
+            db._forget_dictionary_ids()
+            db.DB_PATH = db_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="plan_check",
+        description="Windows Remote Network Monitor — query plan regression check",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print every statement and its plan")
+    args = parser.parse_args()
+
+    failures = run(args.verbose)
+    if failures:
+        logger.error(f"{failures} statement(s) regressed to a full scan")
+        sys.exit(1)
+    logger.info("All query plans use an index.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+"""
+Mode A — DNS proxy worker processes (DNS_PROXY_WORKERS > 1).
+Each worker runs the asyncio engine with its own listening socket, cache
+and upstream sockets, so the proxy scales past the one core a Python
+process can use. On Linux every worker binds the proxy port with
+SO_REUSEPORT and the kernel spreads clients across them; elsewhere a
+dispatcher process owns the port and relays each query to a worker chosen
+by the queried name, so each worker caches its own share of names.
+
+Workers don't touch the database. They pack each logged query into a
+small binary record and ship them in batches over one local connection
+(a Unix socket on Linux, a named pipe on Windows) to the agent process,
+whose batch writer stays the only one writing to SQLite.
+
+Each worker enforces the full per-client rate limit on the queries it
+sees, and the agent adds up their rate-limit events. A client's queries
+are not spread evenly: the dispatcher routes by name and SO_REUSEPORT by
+source port, so a device asking for one name, or reusing one port, keeps
+hitting the same worker. A split limit would hold such a client to a
+fraction of its rate; the full one lets a client spread over N workers
+reach up to N times it before being limited.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.connection import Listener, Client, Connection
+from typing import Callable, Dict, List, Optional
+
+from config import DNS_PROXY_PORT, DNS_PROXY_TCP, DNS_PROXY_WORKERS, LOG_LEVEL
+from db import log_dns_queries
+from dns_proxy import AsyncDNSProxyServer, RELAY_HEADER, set_query_sink
+
+logger = logging.getLogger("proxy_workers")
+
+# Message kinds on a worker's connection, by first byte
+_HELLO = b"H"     # JSON: worker index and relay address, once started
+_FAILED = b"E"    # UTF-8 error text: the worker could not start
+_QUERIES = b"Q"   # packed query records
+_STATS = b"S"     # JSON: the worker's proxy stats
+
+# One query record: ts_ms and the lengths of the client IP, query type and
+# domain that follow it as bytes
+_RECORD = struct.Struct("<qBBH")
+
+# A worker ships its buffered records every _FLUSH_INTERVAL seconds or once
+# _FLUSH_BYTES have built up, and drops new ones past _MAX_PENDING_BYTES
+# while the agent isn't keeping up.
+_FLUSH_INTERVAL = 0.05
+_FLUSH_BYTES = 64 * 1024
+_MAX_PENDING_BYTES = 8 * 1024 * 1024
+
+# Seconds between stats messages from each worker
+_STATS_INTERVAL = 2.0
+
+# Seconds to wait for the workers to bind their sockets, and to exit
+_START_TIMEOUT = 15.0
+_STOP_TIMEOUT = 10.0
+
+# Datagrams the dispatcher moves in one direction before checking the other
+_DISPATCH_BURST = 64
+
+_MAX_MESSAGE = 65535
+
+
+def reuse_port_available() -> bool:
+    """Whether the kernel balances one UDP port across sockets (Linux SO_REUSEPORT)."""
+    return sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+
+
+class _QueryShipper:
+    """
+    A worker's end of the connection. The event loop adds records to a
+    buffer under a lock; a thread sends the buffer as one message.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.shipped = 0
+        self.dropped = 0
+        self._buffer = bytearray(_QUERIES)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="query-shipper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, client_ip: str, domain: str, query_type: str):
+        """The query sink: pack one record into the buffer."""
+        ip = client_ip.encode()
+        qtype = query_type.encode()
+        name = domain.encode("utf-8", "replace")
+        record = _RECORD.pack(int(time.time() * 1000), len(ip), len(qtype), len(name)) + ip + qtype + name
+        with self._lock:
+            if len(self._buffer) >= _MAX_PENDING_BYTES:
+                self.dropped += 1
+                return
+            self._buffer += record
+            self._count += 1
+            full = len(self._buffer) >= _FLUSH_BYTES
+        if full:
+            self._wake.set()
+
+    def send(self, kind: bytes, payload: bytes):
+        with self._send_lock:
+            self.conn.send_bytes(kind + payload)
+
+    def flush(self):
+        with self._lock:
+            if not self._count:
+                return
+            batch, count = self._buffer, self._count
+            self._buffer, self._count = bytearray(_QUERIES), 0
+        with self._send_lock:
+            self.conn.send_bytes(batch)
+        self.shipped += count
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Lost the connection to the agent: {e}")
+                return
+
+    def close(self):
+        """Ship whatever is left and close the connection."""
+        self._closed = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except OSError:
+            pass
+        self.conn.close()
+
+
+def _unpack_queries(batch: bytes) -> List[tuple]:
+    """Query log rows from one _QUERIES message."""
+    rows = []
+    pos = 1
+    end = len(batch)
+    while pos < end:
+        ts_ms, ip_len, qtype_len, name_len = _RECORD.unpack_from(batch, pos)
+        pos += _RECORD.size
+        ip = batch[pos:pos + ip_len].decode()
+        pos += ip_len
+        qtype = batch[pos:pos + qtype_len].decode()
+        pos += qtype_len
+        domain = batch[pos:pos + name_len].decode("utf-8", "replace")
+        pos += name_len
+        rows.append((ts_ms, ip, "", domain, qtype, "", ""))
+    return rows
+
+
+def _worker_main(index: int, sink_address, authkey: bytes, servers: Optional[List[str]],
+                 port: int, relay: bool, tcp: bool, log_level: str, stop):
+    """Entry point of one worker process."""
+    logging.basicConfig(
+        level=getattr(logging, log_level),
+        format=f"%(asctime)s [%(name)s:{index}] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    # basicConfig is a no-op when the re-imported main module already ran it
+    logging.getLogger().setLevel(getattr(logging, log_level))
+    # Ctrl+C reaches the whole process group; the agent stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shipper = _QueryShipper(Client(sink_address, authkey=authkey))
+    server = None
+    try:
+        server = AsyncDNSProxyServer(servers, port=port, reuse_port=not relay, relay=relay, tcp=tcp)
+        set_query_sink(shipper.add)
+        server.start()
+    except Exception as e:
+        shipper.send(_FAILED, str(e).encode())
+        shipper.close()
+        if server:
+            server.stop()
+        return
+    shipper.start()
+    shipper.send(_HELLO, json.dumps({"worker": index, "relay": server.relay_address}).encode())
+    try:
+        while not stop.wait(_STATS_INTERVAL):
+            stats = dict(server.stats(), worker=index, pid=os.getpid(),
+                         shipped=shipper.shipped, dropped=shipper.dropped)
+            shipper.send(_STATS, json.dumps(stats).encode())
+    except OSError:
+        pass
+    finally:
+        server.stop()
+        shipper.close()
+
+
+def _dispatch(port: int, workers: List[tuple], ready, stop):
+    """
+    Entry point of the dispatcher process: own the proxy port and relay
+    each query to a worker by a hash of its question name, and each answer
+    back to its client.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    public = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    public.bind(("0.0.0.0", port))
+    relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    relay.bind(("127.0.0.1", 0))
+    known = set(workers)
+    public.setblocking(False)
+    relay.setblocking(False)
+    ready.set()
+
+    while not stop.is_set():
+        readable, _, _ = select.select([public, relay], [], [], 0.5)
+        if public in readable:
+            for _ in range(_DISPATCH_BURST):
+                try:
+                    data, (ip, client_port) = public.recvfrom(_MAX_MESSAGE)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    # A client's ICMP unreachable from an earlier reply
+                    continue
+                if len(data) < 13:
+                    continue
+                # Same name, same worker: its cache and in-flight lookups cover it
+                name_end = data.find(b"\0", 12)
+                worker = workers[zlib.crc32(data[12:name_end].lower()) % len(workers)]
+                try:
+                    relay.sendto(RELAY_HEADER.pack(socket.inet_aton(ip), client_port) + data, worker)
+                except OSError:
+                    pass
+        if relay in readable:
+            for _ in range(_DISPATCH_BURST):
+                try:
+                    packet, addr = relay.recvfrom(_MAX_MESSAGE)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    continue
+                if addr not in known or len(packet) <= RELAY_HEADER.size:
+                    continue
+                ip, client_port = RELAY_HEADER.unpack_from(packet)
+                try:
+                    public.sendto(packet[RELAY_HEADER.size:], (socket.inet_ntoa(ip), client_port))
+                except OSError:
+                    pass
+    public.close()
+    relay.close()
+
+
+def _merge_rate_limits(total: dict, worker: dict):
+    """Add one worker's rate-limit totals and per-client events into total."""
+    total["refused"] += worker.get("refused", 0)
+    total["dropped"] += worker.get("dropped", 0)
+    for ip, events in worker.get("clients", {}).items():
+        merged = total["clients"].get(ip)
+        if not merged:
+            total["clients"][ip] = dict(events)
+            continue
+        merged["rate_limited"] += events["rate_limited"]
+        merged["queue_full"] += events["queue_full"]
+        merged["last_limited"] = max(merged["last_limited"], events["last_limited"])
+
+
+class ProxyWorkerPool:
+    """
+    DNS proxy run as several worker processes, with the agent process as
+    the single sink for their query logs. Drop-in for the in-process
+    engines: start(), stop(), stats() and is_running.
+    """
+
+    def __init__(self, workers: int = DNS_PROXY_WORKERS, servers: List[str] = None,
+                 port: int = DNS_PROXY_PORT, distribution: str = None,
+                 ingest: Callable[[List[tuple]], None] = log_dns_queries,
+                 log_level: str = LOG_LEVEL):
+        if distribution is None:
+            distribution = "reuseport" if reuse_port_available() else "dispatcher"
+        if distribution not in ("reuseport", "dispatcher"):
+            raise ValueError(f"Unknown worker distribution: {distribution}")
+        if distribution == "reuseport" and not reuse_port_available():
+            raise ValueError("SO_REUSEPORT load balancing is not available on this system")
+        self.workers = max(1, workers)
+        self.servers = servers
+        self.port = port
+        self.distribution = distribution
+        self.ingest = ingest
+        self.log_level = log_level
+        # Spawned, not forked: the agent process has threads and open databases
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = None
+        self._listener = None
+        self._procs: List[multiprocessing.Process] = []
+        self._dispatcher = None
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._started = threading.Condition(self._lock)
+        self._hellos: Dict[int, dict] = {}
+        self._failures: List[str] = []
+        self._stats: Dict[int, dict] = {}
+        self._ingested = 0
+        self._ingest_errors = 0
+        self._running = False
+
+    def _accept(self):
+        """Accept one connection per worker and read each on its own thread."""
+        for _ in range(self.workers):
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._receive, args=(conn,), name="proxy-ingest", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _receive(self, conn: Connection):
+        """Read one worker's messages until it closes the connection."""
+        index = None
+        try:
+            while True:
+                message = conn.recv_bytes()
+                kind = message[:1]
+                if kind == _QUERIES:
+                    rows = _unpack_queries(message)
+                    try:
+                        self.ingest(rows)
+                    except Exception as e:
+                        with self._lock:
+                            self._ingest_errors += len(rows)
+                        logger.error(f"Failed to log {len(rows)} DNS queries from worker {index}: {e}")
+                        continue
+                    with self._lock:
+                        self._ingested += len(rows)
+                elif kind == _STATS:
+                    stats = json.loads(message[1:])
+                    with self._lock:
+                        self._stats[stats["worker"]] = stats
+                elif kind == _HELLO:
+                    hello = json.loads(message[1:])
+                    index = hello["worker"]
+                    with self._started:
+                        self._hellos[index] = hello
+                        self._started.notify_all()
+                elif kind == _FAILED:
+                    with self._started:
+                        self._failures.append(message[1:].decode())
+                        self._started.notify_all()
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+        if self._running:
+            logger.error(f"DNS proxy worker {index} exited.")
+
+    def _wait_started(self):
+        """Block until every worker is serving; RuntimeError if one failed or died first."""
+        deadline = time.monotonic() + _START_TIMEOUT
+        with self._started:
+            while len(self._hellos) < self.workers:
+                if self._failures:
+                    raise RuntimeError(f"DNS proxy worker failed to start: {self._failures[0]}")
+                dead = [p.name for p in self._procs if p.exitcode is not None]
+                if dead:
+                    raise RuntimeError(f"DNS proxy worker exited during startup: {dead[0]}")
+                if time.monotonic() >= deadline:
+                    raise RuntimeError("Timed out waiting for DNS proxy workers to start")
+                self._started.wait(0.1)
+
+    def start(self):
+        """Start the worker processes (and the dispatcher) and wait until they are serving."""
+        relay = self.distribution == "dispatcher"
+        authkey = os.urandom(32)
+        self._stop = self._ctx.Event()
+        self._listener = Listener(authkey=authkey)
+        accept = threading.Thread(target=self._accept, name="proxy-accept", daemon=True)
+        accept.start()
+        logger.info(f"DNS Proxy starting {self.workers} worker processes on port {self.port} "
+                    f"({self.distribution})")
+        for index in range(self.workers):
+            # Behind the dispatcher only the first worker takes TCP clients
+            tcp = DNS_PROXY_TCP and (not relay or index == 0)
+            proc = self._ctx.Process(
+                target=_worker_main,
+                args=(index, self._listener.address, authkey, self.servers, self.port, relay, tcp,
+                      self.log_level, self._stop),
+                name=f"dns-proxy-worker-{index}",
+                daemon=True,
+            )
+            proc.start()
+            self._procs.append(proc)
+        try:
+            self._wait_started()
+            if relay:
+                ready = self._ctx.Event()
+                addresses = [tuple(self._hellos[i]["relay"]) for i in range(self.workers)]
+                self._dispatcher = self._ctx.Process(
+                    target=_dispatch, args=(self.port, addresses, ready, self._stop),
+                    name="dns-proxy-dispatcher", daemon=True)
+                self._dispatcher.start()
+                if not ready.wait(_START_TIMEOUT):
+                    raise RuntimeError("DNS proxy dispatcher failed to start")
+        except Exception:
+            self.stop()
+            raise
+        self._running = True
+        logger.info(f"DNS Proxy is running ({self.workers} workers).")
+
+    def stop(self):
+        """Stop the workers, then wait for the queries they had buffered."""
+        if not self._stop:
+            return
+        self._running = False
+        self._stop.set()
+        for proc in self._procs + ([self._dispatcher] if self._dispatcher else []):
+            proc.join(timeout=_STOP_TIMEOUT)
+            if proc.is_alive():
+                logger.warning(f"{proc.name} did not exit; terminating it.")
+                proc.terminate()
+                proc.join(timeout=1)
+        for thread in self._threads:
+            thread.join(timeout=_STOP_TIMEOUT)
+        self._listener.close()
+        self._procs, self._dispatcher, self._threads = [], None, []
+        self._stop = None
+        logger.info("DNS Proxy stopped.")
+
+    def stats(self) -> dict:
+        """
+        Per-worker proxy counters (as of their last report), the shipped
+        query totals and the workers' rate-limit events added up per client.
+        """
+        with self._lock:
+            workers = []
+            rate_limit = {"refused": 0, "dropped": 0, "clients": {}}
+            for i in sorted(self._stats):
+                worker = dict(self._stats[i])
+                limits = worker.get("rate_limit")
+                if limits:
+                    worker["rate_limit"] = {k: v for k, v in limits.items() if k != "clients"}
+                    _merge_rate_limits(rate_limit, limits)
+                workers.append(worker)
+            return {
+                "engine": "workers",
+                "workers": self.workers,
+                "distribution": self.distribution,
+                "alive": sum(1 for p in self._procs if p.is_alive()),
+                "ingested": self._ingested,
+                "ingest_errors": self._ingest_errors,
+                "dropped": sum(w.get("dropped", 0) for w in workers),
+                "rate_limit": rate_limit,
+                "per_worker": workers,
+            }
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
@@ -0,0 +1,358 @@
+"""
+Columnar archive segments — the compact, read-only form of a closed query
+log partition.
+
+A segment holds the rows of one partition sorted by (ts, id), cut into
+blocks of BLOCK_ROWS. Within a block each column is stored on its own:
+ids and timestamps as deltas from the block's first row, sources, domains,
+categories and the text columns as codes into segment-wide dictionaries,
+and query type and severity as they are. Every column is packed into the
+narrowest integer array that holds it and zlib-compressed.
+
+The footer lists the dictionaries and, per block, its key range, id range,
+the sources and categories it contains and its highest severity, so a scan
+skips whole blocks on time, id, device, category and severity without
+decompressing them. The file is memory-mapped; only the columns a scan
+needs are decoded, one block at a time.
+
+Layout: MAGIC, column chunks, zlib-compressed JSON footer, then a trailer
+of (footer offset, footer length, MAGIC).
+"""
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate, compress
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger("segment")
+
+MAGIC = b"DNSSEG01"
+_TRAILER = struct.Struct("<QI8s")
+
+# Row layout, the dns_queries column order
+COLUMNS = ("id", "ts", "source_id", "domain_id", "qtype", "response", "device_name", "category_id", "severity")
+
+BLOCK_ROWS = 16384
+
+# Decoded block columns kept per reader (a few MB), so paging through a block is decoded once
+_DECODED_COLUMNS = 16
+
+_DELTA_COLUMNS = ("id", "ts")
+_DICT_COLUMNS = ("source_id", "domain_id", "response", "device_name", "category_id")
+
+# Narrowest array type for a value range, tried in order
+_INT_TYPES = [("b", 1 << 7), ("h", 1 << 15), ("i", 1 << 31), ("q", 1 << 63)]
+
+
+class SegmentError(ValueError):
+    pass
+
+
+def _pack(values: List[int], level: int) -> tuple:
+    """(typecode, compressed bytes) of an integer column."""
+    lo, hi = min(values), max(values)
+    typecode = next(code for code, limit in _INT_TYPES if -limit <= lo and hi < limit)
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return typecode, zlib.compress(packed.tobytes(), level)
+
+
+def _unpack(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(zlib.decompress(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _gather(values: Sequence[int], index) -> Sequence[int]:
+    """values at the given positions; a range is a slice."""
+    if isinstance(index, range):
+        return values[index.start:index.stop]
+    return list(map(values.__getitem__, index))
+
+
+def write_segment(path: str, rows: Iterable[tuple], block_rows: int = BLOCK_ROWS, level: int = 6) -> Dict:
+    """
+    Write rows (tuples in COLUMNS order, sorted by ts then id) to a segment
+    at path, replacing it atomically. Rows are streamed; only one block is
+    held at a time. Returns the row and block counts.
+    """
+    codes = {name: {} for name in _DICT_COLUMNS}
+    blocks = []
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+
+        def flush(block: List[tuple]):
+            columns = dict(zip(COLUMNS, zip(*block)))
+            meta = {
+                "rows": len(block),
+                "first": [block[0][1], block[0][0]],
+                "last": [block[-1][1], block[-1][0]],
+                "min_id": min(columns["id"]),
+                "max_id": max(columns["id"]),
+                "max_severity": max(columns["severity"]),
+                "base": {},
+                "columns": {},
+            }
+            for name in COLUMNS:
+                values = columns[name]
+                if name in _DELTA_COLUMNS:
+                    meta["base"][name] = values[0]
+                    values = [0] + [b - a for a, b in zip(values, values[1:])]
+                elif name in _DICT_COLUMNS:
+                    dictionary = codes[name]
+                    values = [dictionary.setdefault(v, len(dictionary)) for v in values]
+                    if name in ("source_id", "category_id"):
+                        meta["sources" if name == "source_id" else "categories"] = sorted(set(values))
+                typecode, data = _pack(list(values), level)
+                meta["columns"][name] = [f.tell(), len(data), typecode]
+                f.write(data)
+            blocks.append(meta)
+
+        block = []
+        rows_written = 0
+        for row in rows:
+            block.append(tuple(row))
+            if len(block) >= block_rows:
+                flush(block)
+                rows_written += len(block)
+                block = []
+        if block:
+            flush(block)
+            rows_written += len(block)
+
+        footer = {
+            "version": 1,
+            "rows": rows_written,
+            "dicts": {name: list(values) for name, values in codes.items()},
+            "blocks": blocks,
+        }
+        data = zlib.compress(json.dumps(footer, separators=(",", ":")).encode(), level)
+        offset = f.tell()
+        f.write(data)
+        f.write(_TRAILER.pack(offset, len(data), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"rows": rows_written, "blocks": len(blocks)}
+
+
+class Segment:
+    """
+    Memory-mapped reader of one segment file. Not shared between threads:
+    each keeps its own (the map itself is cheap, the pages are shared).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < len(MAGIC) + _TRAILER.size or self._map[:len(MAGIC)] != MAGIC:
+                raise SegmentError(f"{path} is not a query log segment")
+            offset, length, magic = _TRAILER.unpack(self._map[-_TRAILER.size:])
+            if magic != MAGIC:
+                raise SegmentError(f"{path} is truncated")
+            footer = json.loads(zlib.decompress(self._map[offset:offset + length]))
+        except Exception:
+            self._map.close()
+            raise
+        self.rows: int = footer["rows"]
+        self.blocks: List[Dict] = footer["blocks"]
+        self.dicts: Dict[str, list] = footer["dicts"]
+        self._codes: Dict[str, Dict] = {}
+        # Decoded block columns by file offset, least recently used first
+        self._decoded: "OrderedDict[int, Sequence[int]]" = OrderedDict()
+
+    def close(self):
+        self._map.close()
+
+    @property
+    def source_ids(self) -> list:
+        """Every source id with rows in this segment."""
+        return self.dicts["source_id"]
+
+    def _code_set(self, name: str, values: Iterable) -> set:
+        """Codes of the given dictionary values that occur in this segment."""
+        if name not in self._codes:
+            self._codes[name] = {v: i for i, v in enumerate(self.dicts[name])}
+        codes = self._codes[name]
+        return {codes[v] for v in values if v in codes}
+
+    def _column(self, block: Dict, name: str) -> Sequence[int]:
+        """One column of a block, decoded; recently used ones are kept for the next page."""
+        offset, length, typecode = block["columns"][name]
+        values = self._decoded.get(offset)
+        if values is not None:
+            self._decoded.move_to_end(offset)
+            return values
+        values = _unpack(typecode, self._map[offset:offset + length])
+        if name in _DELTA_COLUMNS:
+            values = list(accumulate(values, initial=block["base"][name]))[1:]
+        self._decoded[offset] = values
+        if len(self._decoded) > _DECODED_COLUMNS:
+            self._decoded.popitem(last=False)
+        return values
+
+    def _prepare(self, lo=None, hi=None, after=None, before=None, above_id=None, below_id=None,
+                 source_ids=None, domain_ids=None, category_ids=None, min_severity=0) -> Optional[Dict]:
+        """Filters with dictionary values turned into this segment's codes; None if nothing can match."""
+        f = {
+            "lo": lo, "hi": hi, "above_id": above_id, "below_id": below_id, "min_severity": min_severity,
+            "after": list(after) if after is not None else None,
+            "before": list(before) if before is not None else None,
+        }
+        for key, name, values in (("sources", "source_id", source_ids), ("domains", "domain_id", domain_ids),
+                                  ("categories", "category_id", category_ids)):
+            f[key] = self._code_set(name, values) if values is not None else None
+            if f[key] is not None and not f[key]:
+                return None
+        return f
+
+    def _candidates(self, f: Dict) -> List[Dict]:
+        """Blocks that can hold matching rows, judged from the footer alone."""
+        found = []
+        for block in self.blocks:
+            if (f["lo"] is not None and block["last"][0] < f["lo"]) or \
+                    (f["hi"] is not None and block["first"][0] > f["hi"]):
+                continue
+            if (f["after"] is not None and block["last"] <= f["after"]) or \
+                    (f["before"] is not None and block["first"] >= f["before"]):
+                continue
+            if (f["above_id"] is not None and block["max_id"] <= f["above_id"]) or \
+                    (f["below_id"] is not None and block["min_id"] >= f["below_id"]):
+                continue
+            if f["min_severity"] and block["max_severity"] < f["min_severity"]:
+                continue
+            if f["sources"] is not None and f["sources"].isdisjoint(block["sources"]):
+                continue
+            if f["categories"] is not None and f["categories"].isdisjoint(block["categories"]):
+                continue
+            found.append(block)
+        return found
+
+    def _block_rows(self, block: Dict, columns: Sequence[str], f: Dict, need: Optional[int] = None,
+                    by_id: bool = False, reverse: bool = False) -> List[tuple]:
+        """
+        Matching rows of one block, in (ts, id) order, decoding only the
+        columns involved. With `need`, only that many are gathered: the
+        first (last if reverse) in ts order, or by id if by_id.
+        """
+        decoded = {}
+
+        def column(name: str) -> Sequence[int]:
+            if name not in decoded:
+                decoded[name] = self._column(block, name)
+            return decoded[name]
+
+        lo, hi, after, before = f["lo"], f["hi"], f["after"], f["before"]
+        above_id, below_id = f["above_id"], f["below_id"]
+        # Rows are sorted by ts, so time bounds are a slice. Each bound is
+        # only applied to the blocks it cuts; the rest need no decoding.
+        start, stop = 0, block["rows"]
+        if lo is not None and block["first"][0] < lo:
+            start = bisect_left(column("ts"), lo)
+        if after is not None and block["first"] <= after:
+            start = max(start, bisect_left(column("ts"), after[0]))
+        if hi is not None and block["last"][0] > hi:
+            stop = bisect_right(column("ts"), hi)
+        if before is not None and block["last"] >= before:
+            stop = min(stop, bisect_right(column("ts"), before[0]))
+        index = range(start, stop)
+
+        if after is not None and block["first"] <= after:
+            ts, ids = column("ts"), column("id")
+            index = [i for i in index if ts[i] > after[0] or (ts[i] == after[0] and ids[i] > after[1])]
+        if before is not None and block["last"] >= before:
+            ts, ids = column("ts"), column("id")
+            index = [i for i in index if ts[i] < before[0] or (ts[i] == before[0] and ids[i] < before[1])]
+        if above_id is not None and block["min_id"] <= above_id:
+            index = list(compress(index, map(above_id.__lt__, _gather(column("id"), index))))
+        if below_id is not None and block["max_id"] >= below_id:
+            index = list(compress(index, map(below_id.__gt__, _gather(column("id"), index))))
+        # Code-set and severity tests run through map/compress, without a Python loop per row
+        for name, codes in (("source_id", f["sources"]), ("domain_id", f["domains"]),
+                            ("category_id", f["categories"])):
+            if codes is not None:
+                index = list(compress(index, map(codes.__contains__, _gather(column(name), index))))
+        if f["min_severity"]:
+            index = list(compress(index, map(f["min_severity"].__le__, _gather(column("severity"), index))))
+        if not index:
+            return []
+        if need is not None and len(index) > need:
+            if by_id:
+                pick = heapq.nlargest if reverse else heapq.nsmallest
+                index = sorted(pick(need, index, key=column("id").__getitem__))
+            else:
+                index = index[-need:] if reverse else index[:need]
+
+        picked = []
+        for name in columns:
+            values = _gather(column(name), index)
+            if name in _DICT_COLUMNS:
+                values = list(map(self.dicts[name].__getitem__, values))
+            picked.append(values)
+        return list(zip(*picked))
+
+    def scan(self, columns: Sequence[str] = COLUMNS, reverse: bool = False, **filters) -> Iterator[List[tuple]]:
+        """
+        Matching rows, a block at a time, in (ts, id) order (newest first if
+        reverse), as tuples of the requested columns. Filters: ts in
+        [lo, hi]; (ts, id) after or before a keyset position; id in
+        (above_id, below_id); source_ids, domain_ids and category_ids as
+        collections of allowed values; min_severity.
+        """
+        f = self._prepare(**filters)
+        if f is None:
+            return
+        blocks = self._candidates(f)
+        for block in reversed(blocks) if reverse else blocks:
+            rows = self._block_rows(block, columns, f)
+            if rows:
+                yield rows[::-1] if reverse else rows
+
+    def select(self, limit: int, columns: Sequence[str] = COLUMNS, by_id: bool = False,
+               reverse: bool = False, **filters) -> List[tuple]:
+        """
+        The first `limit` rows scan() would return, or in id order if by_id
+        (then "id" must be one of the columns). Newest first if reverse.
+        Only the rows kept are gathered from each block.
+        """
+        f = self._prepare(**filters)
+        if f is None:
+            return []
+        blocks = self._candidates(f)
+        rows = []
+        if not by_id:
+            for block in reversed(blocks) if reverse else blocks:
+                found = self._block_rows(block, columns, f, limit - len(rows), reverse=reverse)
+                rows += found[::-1] if reverse else found
+                if len(rows) >= limit:
+                    break
+            return rows
+
+        # Ids follow time closely but not exactly (rows replayed late), so
+        # blocks are visited in id order and the walk stops at the first
+        # that cannot beat the rows already found
+        position = columns.index("id")
+        blocks.sort(key=lambda b: -b["max_id"] if reverse else b["min_id"])
+        for block in blocks:
+            if len(rows) >= limit:
+                worst = rows[limit - 1][position]
+                if (block["max_id"] < worst) if reverse else (block["min_id"] > worst):
+                    break
+            rows += self._block_rows(block, columns, f, limit, by_id=True, reverse=reverse)
+            rows.sort(key=lambda r: r[position], reverse=reverse)
+            del rows[limit:]
+        return rows
@@ -0,0 +1,12 @@
+"""
+Round trips through db.py's compact storage: values read back must match
+what the proxy logged before the schema stored them as integers.
+"""
+import pytest
+
+import db
+
+
+@pytest.mark.parametrize("name", ["A", "AAAA", "HTTPS", "TYPE65280", "TYPE0"])
+def test_qtype_round_trip(name):
+    assert db._qtype_name(db._qtype_code(name)) == name
@@ -0,0 +1,10 @@
+"""
+Query plan regression test: every read in db.py must stay on an index.
+Runs plan_check against a scratch database; `python plan_check.py
+--verbose` prints the plans when it fails.
+"""
+import plan_check
+
+
+def test_reads_use_indexes():
+    assert plan_check.run() == 0
@@ -0,0 +1,64 @@
+"""
+Upstream pool failover: a primary that never answers must not cost the
+client its lookup, with or without hedging.
+"""
+import socket
+import threading
+import time
+
+import pytest
+from dnslib import DNSRecord, DNSQuestion, RR, A, QTYPE
+
+from upstream_pool import UpstreamPool
+
+
+@pytest.fixture
+def silent_primary():
+    """A bound UDP port that reads nothing and answers nothing."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    yield f"127.0.0.1:{sock.getsockname()[1]}"
+    sock.close()
+
+
+@pytest.fixture
+def answering_alternate():
+    """A local server answering every query with one A record."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+
+    def serve():
+        while True:
+            try:
+                data, addr = sock.recvfrom(4096)
+            except OSError:
+                return
+            reply = DNSRecord.parse(data).reply()
+            reply.add_answer(RR(reply.q.qname, QTYPE.A, ttl=60, rdata=A("192.0.2.1")))
+            sock.sendto(reply.pack(), addr)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f"127.0.0.1:{sock.getsockname()[1]}"
+    sock.close()
+
+
+@pytest.mark.parametrize("hedge", [False, True])
+def test_silent_primary_fails_over(silent_primary, answering_alternate, hedge):
+    pool = UpstreamPool([silent_primary, answering_alternate], timeout=2.0, hedge=hedge)
+    started = time.monotonic()
+    response = pool.exchange(DNSRecord(q=DNSQuestion("example.com")).pack())
+    elapsed = time.monotonic() - started
+
+    assert str(DNSRecord.parse(response).a.rdata) == "192.0.2.1"
+    # The alternate is asked once the primary's share (or hedge delay) is up
+    assert elapsed < 1.5
+    primary = pool.stats()["servers"][0]
+    assert primary["answers"] == 0 and primary["failure_rate"] > 0
+
+
+def test_silent_primary_is_benched(silent_primary, answering_alternate):
+    pool = UpstreamPool([silent_primary, answering_alternate], timeout=0.4, hedge=False)
+    for _ in range(3):
+        pool.exchange(DNSRecord(q=DNSQuestion("example.com")).pack())
+    # Three timeouts in a row: later lookups go to the alternate first
+    assert pool.ranked()[0].name == answering_alternate
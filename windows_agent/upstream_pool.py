@@ -0,0 +1,341 @@
+"""
+Upstream DNS pool — health tracking, latency-based selection and hedging.
+Each server keeps a smoothed RTT and deviation (RFC 6298) and a decaying
+failure rate. A lookup goes to the server with the lowest expected cost;
+if it hasn't answered within its usual latency the same query is also sent
+to the next server and the first good answer wins. Without hedging each
+server gets an even share of the time left and the lookup fails over to
+the next one when it runs out. Servers that keep
+failing sit out with exponential backoff. An answer truncated over UDP is
+fetched again over TCP from the same server.
+
+The pool only decides who to ask and when; the proxy engines own the
+sockets and drive a Lookup with what they hear back. The threaded engine's
+sockets live here (exchange() and exchange_tcp()).
+"""
+import logging
+import select
+import socket
+import threading
+import time
+from typing import Dict, List
+
+from config import (
+    UPSTREAM_DNS_SERVERS, DNS_UPSTREAM_TIMEOUT, DNS_HEDGE, DNS_HEDGE_MIN_MS, DNS_HEDGE_MAX_MS,
+)
+from dns_wire import is_truncated, frame, recv_framed
+
+logger = logging.getLogger("upstream_pool")
+
+# Consecutive failures before a server is benched, and the longest bench
+_DOWN_AFTER = 3
+_MAX_BACKOFF = 60.0
+
+# Weight of the newest sample in the failure rate
+_FAILURE_DECAY = 0.1
+
+_RCODE_SERVFAIL = 2
+_RCODE_REFUSED = 5
+
+# Largest DNS message; upstream UDP answers are read whole
+_MAX_MESSAGE = 65535
+
+# Idle TCP connections kept open per server for reuse
+_TCP_IDLE_MAX = 4
+
+
+class Upstream:
+    """One upstream server and what the pool has learned about it."""
+
+    def __init__(self, spec: str):
+        host, _, port = spec.partition(":")
+        self.name = spec
+        self.addr = (host, int(port or 53))
+        self.srtt = None        # seconds; None until the first answer
+        self.rttvar = 0.0
+        self.failure_rate = 0.0
+        self.failures = 0       # consecutive
+        self.down_until = 0.0
+        self.queries = 0
+        self.answers = 0
+        self.tcp_idle: List[socket.socket] = []
+
+    def cost(self, penalty: float) -> float:
+        """Expected wait: RTT plus `penalty` for each expected failure. Unmeasured servers go first."""
+        return (self.srtt or 0.0) + self.failure_rate * penalty
+
+
+class UpstreamPool:
+    """Upstream servers ranked by latency and health, shared by one proxy engine."""
+
+    def __init__(self, servers: List[str] = None, timeout: float = DNS_UPSTREAM_TIMEOUT,
+                 hedge: bool = DNS_HEDGE):
+        self.servers = [Upstream(s) for s in (servers or UPSTREAM_DNS_SERVERS)]
+        if not self.servers:
+            raise ValueError("No upstream DNS servers configured")
+        self.timeout = timeout
+        self.hedge = hedge and len(self.servers) > 1
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.tcp_retries = 0
+
+    def ranked(self) -> List[Upstream]:
+        """Servers in the order to try them: healthy by expected cost, then benched ones by readiness."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [s for s in self.servers if s.down_until <= now]
+            benched = [s for s in self.servers if s.down_until > now]
+            # A lost query costs the hedge delay when hedging, else the whole timeout
+            healthy.sort(key=lambda s: s.cost(self.hedge_delay(s) if self.hedge else self.timeout))
+            benched.sort(key=lambda s: s.down_until)
+        return healthy + benched
+
+    def hedge_delay(self, server: Upstream) -> float:
+        """How long to give a server before asking another as well."""
+        if server.srtt is None:
+            return DNS_HEDGE_MAX_MS / 1000
+        delay = server.srtt + 4 * server.rttvar
+        return min(max(delay, DNS_HEDGE_MIN_MS / 1000), DNS_HEDGE_MAX_MS / 1000)
+
+    def record_answer(self, server: Upstream, rtt: float):
+        with self._lock:
+            server.answers += 1
+            if server.srtt is None:
+                server.srtt, server.rttvar = rtt, rtt / 2
+            else:
+                server.rttvar = 0.75 * server.rttvar + 0.25 * abs(server.srtt - rtt)
+                server.srtt = 0.875 * server.srtt + 0.125 * rtt
+            server.failure_rate *= 1 - _FAILURE_DECAY
+            if server.failures >= _DOWN_AFTER:
+                logger.info(f"Upstream {server.name} is answering again.")
+            server.failures = 0
+            server.down_until = 0.0
+
+    def record_miss(self, server: Upstream):
+        """A server was beaten by a hedge: it counts against its failure rate, but doesn't bench it."""
+        with self._lock:
+            server.failure_rate = server.failure_rate * (1 - _FAILURE_DECAY) + _FAILURE_DECAY
+
+    def record_tcp_retry(self):
+        with self._lock:
+            self.tcp_retries += 1
+
+    def record_failure(self, server: Upstream):
+        with self._lock:
+            server.failure_rate = server.failure_rate * (1 - _FAILURE_DECAY) + _FAILURE_DECAY
+            server.failures += 1
+            if server.failures >= _DOWN_AFTER:
+                backoff = min(_MAX_BACKOFF, 2.0 ** (server.failures - _DOWN_AFTER))
+                server.down_until = time.monotonic() + backoff
+                if server.failures == _DOWN_AFTER:
+                    logger.warning(f"Upstream {server.name} failed {server.failures} times in a row; "
+                                   f"preferring other servers.")
+
+    def exchange(self, data: bytes) -> bytes:
+        """
+        Blocking lookup for the threaded engine: one connected UDP socket
+        per server asked, all waited on together with select().
+        """
+        lookup = Lookup(self)
+        socks: Dict[socket.socket, Upstream] = {}
+        try:
+            while not lookup.expired:
+                for server in lookup.due():
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    try:
+                        sock.connect(server.addr)
+                        sock.send(data)
+                    except OSError:
+                        sock.close()
+                        lookup.error(server)
+                        continue
+                    socks[sock] = server
+                if not socks:
+                    break
+                ready, _, _ = select.select(list(socks), [], [], lookup.wait())
+                for sock in ready:
+                    server = socks.pop(sock)
+                    try:
+                        response = sock.recv(_MAX_MESSAGE)
+                    except OSError:
+                        # ICMP port unreachable surfaces here on a connected socket
+                        lookup.error(server)
+                        continue
+                    finally:
+                        sock.close()
+                    if lookup.answer(server, response):
+                        return self._untruncate(server, data, response)
+            return lookup.result()
+        finally:
+            for sock in socks:
+                sock.close()
+
+    def _untruncate(self, server: Upstream, data: bytes, response: bytes) -> bytes:
+        """The full answer for a truncated one, asked again over TCP; the truncated one if that fails."""
+        if not is_truncated(response):
+            return response
+        self.record_tcp_retry()
+        try:
+            return self.exchange_tcp(server, data)
+        except OSError as e:
+            logger.debug(f"TCP retry to {server.name} failed: {e}")
+            return response
+
+    def exchange_tcp(self, server: Upstream, data: bytes) -> bytes:
+        """
+        One query over a persistent TCP connection to server, reusing an
+        idle one when there is one. A reused connection the server has
+        since closed is retried once on a fresh one.
+        """
+        while True:
+            with self._lock:
+                sock = server.tcp_idle.pop() if server.tcp_idle else None
+            reused = sock is not None
+            if not reused:
+                sock = socket.create_connection(server.addr, timeout=self.timeout)
+            try:
+                sock.settimeout(self.timeout)
+                sock.sendall(frame(data))
+                response = recv_framed(sock)
+                if response is None:
+                    raise ConnectionError("Upstream closed the connection")
+            except OSError:
+                sock.close()
+                if reused:
+                    continue
+                raise
+            with self._lock:
+                if len(server.tcp_idle) < _TCP_IDLE_MAX:
+                    server.tcp_idle.append(sock)
+                    sock = None
+            if sock:
+                sock.close()
+            return response
+
+    def close(self):
+        """Close pooled TCP connections."""
+        with self._lock:
+            for server in self.servers:
+                for sock in server.tcp_idle:
+                    sock.close()
+                server.tcp_idle.clear()
+
+    def stats(self) -> Dict:
+        """Per-server health and the hedging counters, for the status endpoint."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "tcp_retries": self.tcp_retries,
+                "servers": [
+                    {
+                        "server": s.name,
+                        "healthy": s.down_until <= now,
+                        "srtt_ms": round(s.srtt * 1000, 1) if s.srtt is not None else None,
+                        "rttvar_ms": round(s.rttvar * 1000, 1),
+                        "failure_rate": round(s.failure_rate, 4),
+                        "queries": s.queries,
+                        "answers": s.answers,
+                    }
+                    for s in self.servers
+                ],
+            }
+
+
+class Lookup:
+    """
+    One query's schedule across the pool. The engine sends to whatever
+    due() returns, waits up to wait() seconds for answers, reports each
+    with answer() or error(), and falls back to result() once nothing is
+    left to try.
+    """
+
+    def __init__(self, pool: UpstreamPool):
+        self.pool = pool
+        self._order = pool.ranked()
+        now = time.monotonic()
+        self.deadline = now + pool.timeout
+        self._sent: Dict[Upstream, float] = {}
+        self._hedged = set()
+        self._timed_out = set()
+        self._next_at = now
+        self._fallback = None
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def due(self) -> List[Upstream]:
+        """
+        Servers to send the query to now: the next one when none is
+        outstanding, a hedge is due or (without hedging) the last one's
+        share of the timeout is up.
+        """
+        now = time.monotonic()
+        servers = []
+        while self._order and now < self.deadline and (not self._sent or now >= self._next_at):
+            if not self.pool.hedge:
+                # Failing over: whoever is still outstanding counts as failed,
+                # though a late answer from it is still taken
+                for silent in self._sent:
+                    if silent not in self._timed_out:
+                        self._timed_out.add(silent)
+                        self.pool.record_failure(silent)
+            server = self._order.pop(0)
+            with self.pool._lock:
+                server.queries += 1
+                if self._sent and self.pool.hedge:
+                    self.pool.hedges += 1
+                    self._hedged.add(server)
+            self._sent[server] = now
+            if self.pool.hedge:
+                self._next_at = now + self.pool.hedge_delay(server)
+            else:
+                self._next_at = now + (self.deadline - now) / (len(self._order) + 1)
+            servers.append(server)
+        return servers
+
+    def wait(self) -> float:
+        """Seconds until a hedge or failover is due or the lookup gives up."""
+        until = self.deadline
+        if self._order:
+            until = min(until, self._next_at)
+        return max(0.0, until - time.monotonic())
+
+    def answer(self, server: Upstream, response: bytes) -> bool:
+        """Record an answer; True if it is the one to relay."""
+        sent = self._sent.pop(server)
+        rcode = response[3] & 0x0F if len(response) >= 12 else _RCODE_SERVFAIL
+        if rcode in (_RCODE_SERVFAIL, _RCODE_REFUSED):
+            # Keep it in case nobody does better, but try the next server now
+            self.pool.record_failure(server)
+            self._fallback = response
+            self._next_at = time.monotonic()
+            return False
+        self.pool.record_answer(server, time.monotonic() - sent)
+        if server in self._hedged:
+            with self.pool._lock:
+                self.pool.hedge_wins += 1
+            for slower, sent_at in self._sent.items():
+                if sent_at < sent:
+                    self.pool.record_miss(slower)
+        return True
+
+    def error(self, server: Upstream):
+        """Record a send or receive error from a server."""
+        self._sent.pop(server, None)
+        self.pool.record_failure(server)
+        # Its hedge slot is free: the next server needn't wait out its delay
+        self._next_at = time.monotonic()
+
+    def result(self) -> bytes:
+        """Out of servers or time: the best error answer heard, else TimeoutError."""
+        for server in self._sent:
+            if server not in self._timed_out:
+                self.pool.record_failure(server)
+        self._sent.clear()
+        if self._fallback:
+            return self._fallback
+        raise TimeoutError("No upstream DNS server answered")